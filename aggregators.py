@@ -0,0 +1,336 @@
+"""
+Streaming, mergeable accumulators used by the groupby mapper, combiner and reducer.
+Every accumulator keeps O(1) state regardless of how many rows it has seen and
+supports:
+    update(value)   fold one input value into the state
+    merge(other)    fold another accumulator of the same type into this one
+    result()        the final aggregate value
+    encode()        a compact text form that contains no ',', '|' or tab
+    decode(text)    (classmethod) rebuild an accumulator from encode()'s output
+"""
+import base64
+import math
+import zlib
+from hashlib import blake2b
+
+# HyperLogLog precision: 2**12 registers gives a standard error of about 1.6%
+HLL_PRECISION = 12
+HLL_REGISTERS = 1 << HLL_PRECISION
+# Registers are kept in a sparse dict until this many are set
+HLL_SPARSE_LIMIT = HLL_REGISTERS // 4
+
+# t-digest compression; the number of centroids kept grows with TDIGEST_DELTA,
+# not with the number of values seen
+TDIGEST_DELTA = 100
+TDIGEST_BUFFER = 500
+
+
+class SumAgg:
+    __slots__ = ('total',)
+
+    def __init__(self, total=0.0):
+        self.total = total
+
+    def update(self, value):
+        self.total += value
+
+    def merge(self, other):
+        self.total += other.total
+
+    def result(self):
+        return self.total
+
+    def encode(self):
+        return repr(self.total)
+
+    @classmethod
+    def decode(cls, text):
+        return cls(float(text))
+
+
+class CountAgg:
+    __slots__ = ('count',)
+
+    def __init__(self, count=0):
+        self.count = count
+
+    def update(self, value):
+        self.count += 1
+
+    def merge(self, other):
+        self.count += other.count
+
+    def result(self):
+        return self.count
+
+    def encode(self):
+        return str(self.count)
+
+    @classmethod
+    def decode(cls, text):
+        return cls(int(text))
+
+
+class AvgAgg:
+    """
+    AVG is carried as (sum, count) so partial averages merge exactly.
+    """
+    __slots__ = ('total', 'count')
+
+    def __init__(self, total=0.0, count=0):
+        self.total = total
+        self.count = count
+
+    def update(self, value):
+        self.total += value
+        self.count += 1
+
+    def merge(self, other):
+        self.total += other.total
+        self.count += other.count
+
+    def result(self):
+        return self.total / self.count if self.count else 0
+
+    def encode(self):
+        return f"{self.total!r}|{self.count}"
+
+    @classmethod
+    def decode(cls, text):
+        total, count = text.split('|')
+        return cls(float(total), int(count))
+
+
+class MinAgg:
+    __slots__ = ('value',)
+
+    def __init__(self, value=math.inf):
+        self.value = value
+
+    def update(self, value):
+        if value < self.value:
+            self.value = value
+
+    def merge(self, other):
+        self.update(other.value)
+
+    def result(self):
+        return self.value
+
+    def encode(self):
+        return repr(self.value)
+
+    @classmethod
+    def decode(cls, text):
+        return cls(float(text))
+
+
+class MaxAgg:
+    __slots__ = ('value',)
+
+    def __init__(self, value=-math.inf):
+        self.value = value
+
+    def update(self, value):
+        if value > self.value:
+            self.value = value
+
+    def merge(self, other):
+        self.update(other.value)
+
+    def result(self):
+        return self.value
+
+    def encode(self):
+        return repr(self.value)
+
+    @classmethod
+    def decode(cls, text):
+        return cls(float(text))
+
+
+class CountDistinctAgg:
+    """
+    Approximate COUNT(DISTINCT col) using a HyperLogLog sketch.
+    Small sketches are stored sparsely (register index -> rank) and switch to a
+    dense bytearray once HLL_SPARSE_LIMIT registers are set.
+    """
+    __slots__ = ('sparse', 'registers')
+
+    def __init__(self, sparse=None, registers=None):
+        if sparse is None and registers is None:
+            sparse = {}
+        self.sparse = sparse
+        self.registers = registers
+
+    def _set(self, index, rank):
+        if self.registers is not None:
+            if rank > self.registers[index]:
+                self.registers[index] = rank
+            return
+        if rank > self.sparse.get(index, 0):
+            self.sparse[index] = rank
+            if len(self.sparse) > HLL_SPARSE_LIMIT:
+                self.registers = bytearray(HLL_REGISTERS)
+                for i, r in self.sparse.items():
+                    self.registers[i] = r
+                self.sparse = None
+
+    def update(self, value):
+        h = int.from_bytes(blake2b(value.encode('utf-8'), digest_size=8).digest(), 'big')
+        index = h >> (64 - HLL_PRECISION)
+        rest = h & ((1 << (64 - HLL_PRECISION)) - 1)
+        self._set(index, (64 - HLL_PRECISION) - rest.bit_length() + 1)
+
+    def merge(self, other):
+        if other.registers is not None:
+            for i, r in enumerate(other.registers):
+                if r:
+                    self._set(i, r)
+        else:
+            for i, r in other.sparse.items():
+                self._set(i, r)
+
+    def result(self):
+        m = HLL_REGISTERS
+        if self.registers is not None:
+            ranks = self.registers
+        else:
+            ranks = bytearray(m)
+            for i, r in self.sparse.items():
+                ranks[i] = r
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -r for r in ranks)
+        zeros = ranks.count(0)
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+    def encode(self):
+        if self.registers is not None:
+            return 'd' + base64.b64encode(zlib.compress(bytes(self.registers))).decode('ascii')
+        return 's' + ';'.join(f"{i}:{r}" for i, r in self.sparse.items())
+
+    @classmethod
+    def decode(cls, text):
+        if text[0] == 'd':
+            return cls(registers=bytearray(zlib.decompress(base64.b64decode(text[1:]))))
+        sparse = {}
+        for item in text[1:].split(';'):
+            if item:
+                i, r = item.split(':')
+                sparse[int(i)] = int(r)
+        return cls(sparse=sparse)
+
+
+class PercentileAgg:
+    """
+    Approximate percentile using a merging t-digest.
+    Values are buffered and periodically compressed into O(TDIGEST_DELTA)
+    weighted centroids, with finer centroids near the tails.
+    """
+    __slots__ = ('quantile', 'centroids', 'buffer')
+
+    def __init__(self, quantile, centroids=None):
+        self.quantile = quantile
+        self.centroids = centroids if centroids is not None else []
+        self.buffer = []
+
+    def update(self, value):
+        self.buffer.append(value)
+        if len(self.buffer) >= TDIGEST_BUFFER:
+            self._compress()
+
+    def merge(self, other):
+        self.buffer.extend(other.buffer)
+        self.centroids.extend(other.centroids)
+        self._compress()
+
+    def _compress(self):
+        items = self.centroids + [(v, 1) for v in self.buffer]
+        self.buffer = []
+        if not items:
+            return
+        items.sort()
+        total = sum(w for _, w in items)
+        merged = []
+        mean, weight = items[0]
+        cumulative = 0
+        for m, w in items[1:]:
+            q = (cumulative + (weight + w) / 2) / total
+            if weight + w <= max(1, 4 * total * q * (1 - q) / TDIGEST_DELTA):
+                mean = (mean * weight + m * w) / (weight + w)
+                weight += w
+            else:
+                merged.append((mean, weight))
+                cumulative += weight
+                mean, weight = m, w
+        merged.append((mean, weight))
+        self.centroids = merged
+
+    def result(self):
+        self._compress()
+        if not self.centroids:
+            return 0
+        if len(self.centroids) == 1:
+            return self.centroids[0][0]
+        total = sum(w for _, w in self.centroids)
+        target = self.quantile * total
+        cumulative = 0
+        previous_mean, previous_center = self.centroids[0][0], self.centroids[0][1] / 2
+        if target <= previous_center:
+            return previous_mean
+        for mean, weight in self.centroids:
+            center = cumulative + weight / 2
+            if target <= center:
+                span = center - previous_center
+                fraction = (target - previous_center) / span if span else 0
+                return previous_mean + fraction * (mean - previous_mean)
+            previous_mean, previous_center = mean, center
+            cumulative += weight
+        return self.centroids[-1][0]
+
+    def encode(self):
+        self._compress()
+        return f"{self.quantile!r}|" + ';'.join(f"{m!r}:{w}" for m, w in self.centroids)
+
+    @classmethod
+    def decode(cls, text):
+        quantile, body = text.split('|')
+        centroids = []
+        for item in body.split(';'):
+            if item:
+                m, w = item.split(':')
+                centroids.append((float(m), int(w)))
+        return cls(float(quantile), centroids)
+
+
+# Map of aggregation functions to accumulator classes
+ACCUMULATORS = {
+    'SUM': SumAgg,
+    'AVG': AvgAgg,
+    'MAX': MaxAgg,
+    'MIN': MinAgg,
+    'COUNT': CountAgg,
+    'COUNT_DISTINCT': CountDistinctAgg,
+    'PERCENTILE': PercentileAgg,
+}
+
+# Aggregations whose input values are kept as strings instead of floats
+NON_NUMERIC = {'COUNT', 'COUNT_DISTINCT'}
+
+
+def new_accumulator(func, param=None):
+    """
+    Creates an empty accumulator for an aggregation function.
+    Args:
+        func (str): One of the keys of ACCUMULATORS.
+        param (float): The quantile for PERCENTILE, ignored otherwise.
+    """
+    if func == 'PERCENTILE':
+        return PercentileAgg(param)
+    return ACCUMULATORS[func]()
+
+
+def decode_accumulator(func, text):
+    return ACCUMULATORS[func].decode(text)
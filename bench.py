@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite for the operators.
+
+Generates synthetic tripdata.csv, views.csv and carts.csv, then runs
+projection, filter, groupby and the inner join over them with the local
+runner (see local_runner.py). Grouping and join keys are drawn from a Zipf
+distribution over a fixed number of distinct keys, so both cardinality and
+skew can be varied. Each benchmark runs in its own process, so its peak RSS
+is its own. Results are written as JSON, to compare one version against the
+next:
+    python3 bench.py bench_data bench.json 1000000 1000 1.1
+
+The local runner registers every generated file in schemas.json (see
+schema.py), which the mappers read for column names and types.
+"""
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from itertools import accumulate
+
+from local_runner import LOCAL_WORKERS, run_local
+
+BENCH_ROWS = 100000
+BENCH_KEYS = 1000
+BENCH_SKEW = 1.0
+# carts.csv has this fraction of the rows of views.csv
+CART_FRACTION = 0.1
+
+BENCHMARKS = [
+    ('projection', "SELECT trip_id, fare FROM trips", ['tripdata.csv']),
+    ('filter', "SELECT trip_id, fare FROM trips WHERE fare > 50 AND passengers <= 2", ['tripdata.csv']),
+    ('groupby', "SELECT city, SUM(fare), COUNT(*) FROM trips GROUPBY city", ['tripdata.csv']),
+    ('join', "SELECT views.user_id, price FROM views INNER JOIN carts ON views.category_id = carts.category_id "
+             "WHERE price > 90", ['views.csv', 'carts.csv']),
+]
+
+
+def zipf_keys(count, num_keys, skew, rng):
+    """
+    Draws `count` key ranks in [0, num_keys), rank k with probability
+    proportional to 1 / (k + 1) ** skew. A skew of 0 is uniform.
+    """
+    cum_weights = list(accumulate(1 / (k + 1) ** skew for k in range(num_keys)))
+    return rng.choices(range(num_keys), cum_weights=cum_weights, k=count)
+
+
+def write_trips(path, rows, num_keys, skew, rng):
+    """
+    Writes a tripdata.csv whose cities are Zipf distributed.
+    """
+    cities = zipf_keys(rows, num_keys, skew, rng)
+    with open(path, 'w') as f:
+        f.write("trip_id,city,vendor,fare,trip_distance,passengers\n")
+        for trip_id, city in enumerate(cities):
+            f.write(f"{trip_id},city{city},{rng.choice('ABCD')},{rng.uniform(2, 100):.2f},"
+                    f"{rng.uniform(0, 30):.2f},{rng.randint(1, 6)}\n")
+
+
+def write_views(path, rows, num_keys, skew, rng):
+    """
+    Writes a views.csv whose categories are Zipf distributed.
+    """
+    categories = zipf_keys(rows, num_keys, skew, rng)
+    with open(path, 'w') as f:
+        f.write("user_id,category_id,product_id,view_time\n")
+        for view_time, category in enumerate(categories):
+            f.write(f"u{rng.randrange(rows)},c{category},p{rng.randrange(10 * num_keys)},{view_time}\n")
+
+
+def write_carts(path, rows, num_keys, rng):
+    """
+    Writes a carts.csv with uniformly distributed categories, so the join's
+    output grows with the skew of views.csv alone.
+    """
+    with open(path, 'w') as f:
+        f.write("user_id,category_id,product_id,price\n")
+        for _ in range(rows):
+            f.write(f"u{rng.randrange(rows)},c{rng.randrange(num_keys)},p{rng.randrange(10 * num_keys)},"
+                    f"{rng.uniform(1, 100):.2f}\n")
+
+
+def generate(data_dir, rows=BENCH_ROWS, num_keys=BENCH_KEYS, skew=BENCH_SKEW, seed=0):
+    """
+    Writes the synthetic tables into `data_dir`.
+    """
+    rng = random.Random(seed)
+    os.makedirs(data_dir, exist_ok=True)
+    write_trips(os.path.join(data_dir, 'tripdata.csv'), rows, num_keys, skew, rng)
+    write_views(os.path.join(data_dir, 'views.csv'), rows, num_keys, skew, rng)
+    write_carts(os.path.join(data_dir, 'carts.csv'), max(1, int(rows * CART_FRACTION)), num_keys, rng)
+
+
+def count_lines(paths):
+    total = 0
+    for path in paths:
+        with open(path, 'rb') as f:
+            total += sum(1 for _ in f)
+    return total
+
+
+def measure(operation, sql_statement, inputs, workers=LOCAL_WORKERS):
+    """
+    Runs one operation with the local runner and measures it.
+    Returns:
+        dict: Input and output rows, input bytes, wall seconds, rows/s, MB/s,
+            peak RSS in MB over this process and its workers, the wall
+            seconds of the map, sort and reduce phases, the seconds the tasks
+            spent in each phase summed over tasks, and the task counters per
+            stage (see counters.py).
+    """
+    rows_in = count_lines(inputs) - len(inputs)
+    bytes_in = sum(os.path.getsize(path) for path in inputs)
+    phase_seconds = {}
+    task_seconds = {}
+    job_counters = {}
+    with tempfile.TemporaryDirectory() as output_dir:
+        start = time.perf_counter()
+        outputs = run_local(operation, sql_statement, inputs, output_dir, workers,
+                            phase_seconds=phase_seconds, task_seconds=task_seconds, job_counters=job_counters)
+        wall = time.perf_counter() - start
+        rows_out = count_lines(outputs)
+
+    # ru_maxrss is in KB on Linux
+    peak_rss = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                   resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return {
+        'operation': operation,
+        'sql': sql_statement,
+        'rows_in': rows_in,
+        'rows_out': rows_out,
+        'bytes_in': bytes_in,
+        'wall_seconds': round(wall, 3),
+        'rows_per_second': round(rows_in / wall, 1),
+        'mb_per_second': round(bytes_in / wall / 1e6, 3),
+        'peak_rss_mb': round(peak_rss / 1024, 1),
+        'phase_seconds': {phase: round(value, 3) for phase, value in phase_seconds.items()},
+        'task_seconds': {phase: round(value, 3) for phase, value in task_seconds.items()},
+        'counters': job_counters,
+    }
+
+
+def git_revision():
+    result = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    return result.stdout.strip() or None
+
+
+def run_benchmarks(data_dir, workers=LOCAL_WORKERS):
+    """
+    Measures every benchmark, each in a fresh process.
+    Returns:
+        list: The measure() result of each benchmark.
+    """
+    results = []
+    for operation, sql_statement, tables in BENCHMARKS:
+        inputs = [os.path.join(data_dir, table) for table in tables]
+        # The tasks read schemas.json from the working directory
+        result = subprocess.run([sys.executable, os.path.abspath(__file__), 'measure', operation, sql_statement,
+                                 str(workers)] + inputs,
+                                cwd=data_dir, check=True, stdout=subprocess.PIPE, text=True)
+        results.append(json.loads(result.stdout))
+        print(f"{operation}: {results[-1]['rows_per_second']} rows/s, {results[-1]['wall_seconds']} s",
+              file=sys.stderr)
+    return results
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == 'measure':
+        print(json.dumps(measure(sys.argv[2], sys.argv[3], sys.argv[5:], int(sys.argv[4]))))
+        sys.exit(0)
+    if len(sys.argv) < 3:
+        print("Usage: python bench.py <data dir> <result.json> [rows] [distinct keys] [zipf skew] [workers]")
+        sys.exit(1)
+
+    data_dir, result_path = os.path.abspath(sys.argv[1]), sys.argv[2]
+    rows = int(sys.argv[3]) if len(sys.argv) > 3 else BENCH_ROWS
+    num_keys = int(sys.argv[4]) if len(sys.argv) > 4 else BENCH_KEYS
+    skew = float(sys.argv[5]) if len(sys.argv) > 5 else BENCH_SKEW
+    workers = int(sys.argv[6]) if len(sys.argv) > 6 else LOCAL_WORKERS
+
+    generate(data_dir, rows, num_keys, skew)
+    report = {
+        'revision': git_revision(),
+        'python': sys.version.split()[0],
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'config': {'rows': rows, 'distinct_keys': num_keys, 'skew': skew, 'workers': workers},
+        'results': run_benchmarks(data_dir, workers),
+    }
+    with open(result_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {result_path}", file=sys.stderr)
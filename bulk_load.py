@@ -0,0 +1,327 @@
+"""
+Parallel bulk loader.
+
+A CSV file is cut into line-aligned chunks of about LOAD_BLOCK_BYTES (the HDFS
+block size), which a bounded pool of threads uploads concurrently as the files
+of a directory named after the CSV file: tripdata.csv is loaded as
+<target>/tripdata.csv/tripdata.00000.csv, tripdata.00001.csv, ... Hadoop reads
+the directory as one input, so jobs keep using <target>/tripdata.csv. Only the
+first chunk starts with the header line.
+
+The file is read once. The same pass infers the table's schema (see
+schema.py) and computes the MD5 of every chunk; the worker uploading a CSV
+chunk computes its zone map (see zone_maps.py), uploaded next to it as
+_<chunk>.zonemap.json, and its row count. Each chunk
+that is uploaded is recorded in a manifest, _<file>.load.json next to the CSV
+file, so a load that fails part way can be run again and resumes where it
+stopped: a chunk whose offset and MD5 match the manifest and that is in the
+target with the recorded size is not uploaded again. Loading a table drops
+its secondary indexes (see secondary_index.py).
+
+With `columnar`, the worker uploading a chunk first converts it to the
+columnar format (see columnar.py), as <stem>.<index>.hcol.
+
+A target of the form file://<dir> is a local directory standing in for HDFS,
+to try a load without a cluster:
+    python3 bulk_load.py tripdata.csv /home/hadoop/hadoopdata/hdfs/data [workers] [columnar]
+    python3 bulk_load.py tripdata.csv file:///tmp/hdfs
+"""
+import hashlib
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from columnar import convert_csv
+from schema import infer_schema, register
+from secondary_index import drop_indexes
+from zone_maps import ZONE_BLOCK_BYTES, ColumnStats, zone_map_name
+
+LOAD_BLOCK_BYTES = 128 * 1024 * 1024
+LOAD_WORKERS = 4
+LOCAL_PREFIX = 'file://'
+
+
+class LocalTarget:
+    """
+    A local directory standing in for HDFS.
+    """
+    def __init__(self, root):
+        self.root = root
+
+    def make_dir(self, path):
+        os.makedirs(os.path.join(self.root, path), exist_ok=True)
+
+    def size(self, path):
+        full_path = os.path.join(self.root, path)
+        return os.path.getsize(full_path) if os.path.isfile(full_path) else None
+
+    def put(self, data, path):
+        # Written under a temporary name and renamed, like hadoop fs -put does,
+        # so a failed write leaves no partial file behind
+        full_path = os.path.join(self.root, path)
+        with open(full_path + '._COPYING_', 'wb') as f:
+            f.write(data)
+        os.replace(full_path + '._COPYING_', full_path)
+
+    def remove(self, path):
+        full_path = os.path.join(self.root, path)
+        if os.path.exists(full_path):
+            os.remove(full_path)
+
+
+class HdfsTarget:
+    """
+    An HDFS directory, written with hadoop fs.
+    """
+    def __init__(self, root):
+        self.root = root
+
+    def make_dir(self, path):
+        subprocess.run(["hadoop", "fs", "-mkdir", "-p", f"{self.root}/{path}"], check=True,
+                       stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    def size(self, path):
+        result = subprocess.run(["hadoop", "fs", "-stat", "%b", f"{self.root}/{path}"],
+                                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+        return int(result.stdout) if result.returncode == 0 else None
+
+    def put(self, data, path):
+        # hadoop fs -put writes <path>._COPYING_ and renames it once complete
+        subprocess.run(["hadoop", "fs", "-put", "-f", "-", f"{self.root}/{path}"], input=data, check=True,
+                       stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    def remove(self, path):
+        subprocess.run(["hadoop", "fs", "-rm", "-f", f"{self.root}/{path}"],
+                       stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+
+def load_target(target_path):
+    if target_path.startswith(LOCAL_PREFIX):
+        return LocalTarget(target_path[len(LOCAL_PREFIX):])
+    return HdfsTarget(target_path)
+
+
+def manifest_path(data_file):
+    return os.path.join(os.path.dirname(data_file), f"_{os.path.basename(data_file)}.load.json")
+
+
+def load_manifest(path, settings):
+    """
+    Returns the manifest of an earlier load of the file with the same target,
+    block size and format, or an empty one.
+    """
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            manifest = json.load(f)
+        if all(manifest.get(key) == value for key, value in settings.items()):
+            return manifest
+    return dict(settings, chunks={})
+
+
+def save_manifest(path, manifest):
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(path + '.tmp', path)
+
+
+def read_chunks(f, block_bytes):
+    """
+    Yields (offset, data) for consecutive chunks of a binary file, each
+    running to the end of the line that crosses block_bytes.
+    """
+    offset = 0
+    while True:
+        data = f.read(block_bytes)
+        if not data:
+            return
+        if not data.endswith(b'\n'):
+            data += f.readline()
+        yield offset, data
+        offset += len(data)
+
+
+def chunk_zone_map(data, columns, delimiter, has_header, block_bytes=ZONE_BLOCK_BYTES):
+    """
+    Computes the zone map of one chunk, as build_zone_map does for a whole
+    file, with offsets relative to the chunk.
+    Returns:
+        dict: {'columns': [...], 'blocks': [{'offset', 'length', 'rows', 'stats'}]}
+    """
+    blocks = []
+    lines = io.BytesIO(data)
+    offset = len(lines.readline()) if has_header else 0
+    block_start = offset
+    rows = 0
+    stats = [ColumnStats() for _ in columns]
+
+    def close_block():
+        blocks.append({
+            'offset': block_start,
+            'length': offset - block_start,
+            'rows': rows,
+            'stats': {name: column.to_dict() for name, column in zip(columns, stats)},
+        })
+
+    for raw in lines:
+        offset += len(raw)
+        line = raw.decode('utf-8').strip()
+        if line:
+            rows += 1
+            for column, value in zip(stats, line.split(delimiter)):
+                column.update(value)
+        if offset - block_start >= block_bytes:
+            close_block()
+            block_start = offset
+            rows = 0
+            stats = [ColumnStats() for _ in columns]
+    if offset > block_start:
+        close_block()
+
+    return {'columns': columns, 'blocks': blocks}
+
+
+def to_columnar(data, header, delimiter):
+    """
+    Converts a chunk to the columnar format, prefixing the header line when
+    the chunk does not start with it.
+    """
+    with tempfile.TemporaryDirectory() as work_dir:
+        csv_path = os.path.join(work_dir, 'chunk.csv')
+        columnar_path = os.path.join(work_dir, 'chunk.hcol')
+        with open(csv_path, 'wb') as f:
+            if header is not None:
+                f.write(header.encode('utf-8') + b'\n')
+            f.write(data)
+        convert_csv(csv_path, columnar_path, delimiter=delimiter)
+        with open(columnar_path, 'rb') as f:
+            return f.read()
+
+
+def load_chunk(target, path, data, schema, has_header, columnar):
+    """
+    Uploads one chunk, converted to the columnar format when `columnar`, and
+    otherwise with its zone map. The zone map goes first, so a chunk found in
+    the target always has its zone map.
+    Args:
+        schema (dict): The table's schema, for its columns, delimiter and header line.
+        has_header (bool): Whether the chunk starts with the header line.
+    Returns:
+        tuple: Size in bytes of the file written, and the chunk's row count.
+    """
+    if columnar:
+        # The columnar format keeps its own statistics per row group
+        rows = sum(1 for line in io.BytesIO(data) if line.strip()) - has_header
+        data = to_columnar(data, None if has_header else schema['header'], schema['delimiter'])
+    else:
+        zone_map = chunk_zone_map(data, schema['columns'], schema['delimiter'], has_header)
+        rows = sum(block['rows'] for block in zone_map['blocks'])
+        directory, name = path.rsplit('/', 1)
+        target.put(json.dumps(zone_map).encode('utf-8'), f"{directory}/{zone_map_name(name)}")
+    target.put(data, path)
+    return len(data), rows
+
+
+def bulk_load(data_file, target_path, workers=LOAD_WORKERS, block_bytes=LOAD_BLOCK_BYTES, columnar=False,
+              table=None):
+    """
+    Loads a CSV file into <target_path>/<file name>/ in parallel chunks and
+    registers its schema.
+    Args:
+        data_file (str): Path to the local CSV file (containing headers on the first line).
+        target_path (str): HDFS directory, or file://<dir> for a local one.
+        workers (int): Number of chunks uploaded at a time.
+        block_bytes (int): Approximate size of each chunk in bytes.
+        columnar (bool): Convert the chunks to the columnar format.
+        table (str): Table name to register; defaults to the file's name without its extension.
+    Returns:
+        dict: The registered schema, with the chunk files in 'parts' and the row count in 'rows'.
+    """
+    target = load_target(target_path)
+    file_name = os.path.basename(data_file)
+    stem = os.path.splitext(file_name)[0]
+    extension = '.hcol' if columnar else '.csv'
+    manifest_file = manifest_path(data_file)
+    manifest = load_manifest(manifest_file, {'target': target_path, 'block_bytes': block_bytes, 'columnar': columnar})
+    target.make_dir(file_name)
+
+    start = time.perf_counter()
+    schema = None
+    parts = []
+    rows = loaded = bytes_loaded = 0
+    pending = {}
+
+    def finish(futures):
+        nonlocal rows, loaded, bytes_loaded
+        for future in futures:
+            name, chunk = pending.pop(future)
+            chunk['size'], chunk['rows'] = future.result()
+            manifest['chunks'][name] = chunk
+            save_manifest(manifest_file, manifest)
+            rows += chunk['rows']
+            loaded += 1
+            bytes_loaded += chunk['length']
+
+    with open(data_file, 'rb') as f, ThreadPoolExecutor(max_workers=workers) as pool:
+        for index, (offset, data) in enumerate(read_chunks(f, block_bytes)):
+            if schema is None:
+                schema = infer_schema((raw.decode('utf-8') for raw in io.BytesIO(data)), file_name)
+            name = f"{stem}.{index:05d}{extension}"
+            path = f"{file_name}/{name}"
+            parts.append(name)
+            digest = hashlib.md5(data).hexdigest()
+            done = manifest['chunks'].get(name)
+            if (done and done['offset'] == offset and done['md5'] == digest
+                    and target.size(path) == done['size']):
+                rows += done['rows']
+                continue
+
+            # At most `workers` chunks are in flight, which bounds the memory they hold
+            while len(pending) >= workers:
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                finish(finished)
+            chunk = {'offset': offset, 'length': len(data), 'md5': digest}
+            future = pool.submit(load_chunk, target, path, data, schema, index == 0, columnar)
+            pending[future] = (name, chunk)
+        finish(list(pending))
+
+    if schema is None:
+        raise ValueError(f"{data_file} is empty")
+
+    # Chunks of an earlier, longer version of the file
+    for name in set(manifest['chunks']) - set(parts):
+        target.remove(f"{file_name}/{name}")
+        if not columnar:
+            target.remove(f"{file_name}/{zone_map_name(name)}")
+        del manifest['chunks'][name]
+    save_manifest(manifest_file, manifest)
+
+    schema['parts'] = parts
+    schema['rows'] = rows
+    register(table or stem, schema)
+    # Indexes point into the chunks as they were
+    drop_indexes(table or stem)
+
+    seconds = time.perf_counter() - start
+    print(f"Loaded {data_file} into {target_path}/{file_name}: {len(parts)} chunks, {loaded} uploaded and "
+          f"{len(parts) - loaded} already there, {rows} rows, {bytes_loaded / 1e6:.1f} MB in {seconds:.2f} s "
+          f"({bytes_loaded / 1e6 / max(seconds, 1e-9):.1f} MB/s)")
+    return schema
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print("Usage: python bulk_load.py <data_file> <target_path|file://dir> [workers] [columnar]")
+        sys.exit(1)
+
+    workers = int(sys.argv[3]) if len(sys.argv) > 3 else LOAD_WORKERS
+    columnar = len(sys.argv) > 4 and sys.argv[4] == 'columnar'
+    try:
+        bulk_load(sys.argv[1], sys.argv[2], workers, columnar=columnar)
+    except (subprocess.CalledProcessError, OSError, ValueError) as e:
+        print(f"Load failed, run it again to resume: {e}")
+        sys.exit(1)
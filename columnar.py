@@ -0,0 +1,291 @@
+"""
+Chunked columnar storage for CSV tables.
+
+A columnar file holds the rows of a CSV file in row groups. Within a row group
+every column is stored as its own chunk, so a reader only touches the bytes of
+the columns a query references. Each chunk is typed independently:
+    int32   signed 32-bit integers
+    int     signed 64-bit integers
+    float   64-bit floats, empty CSV fields become NaN and count as nulls
+    dict    text with at most 256 distinct values, stored as one byte per row
+            followed by the dictionary
+    str     UTF-8 text joined by newlines (CSV fields never contain one)
+Numeric chunks are 8-byte aligned so the reader can view them straight out of
+a memory map without copying. Float values are written back out in Python's
+shortest form, e.g. 3.10 reads back as 3.1.
+
+Layout:
+    MAGIC | chunk | chunk | ... | footer (JSON) | footer length (8 bytes) | MAGIC
+The footer records the column names, the byte order and, for every row group,
+the row count and each chunk's type, offset, length, null count and zone map
+statistics (see zone_maps.py), which let readers skip whole row groups.
+"""
+import array
+import json
+import math
+import mmap
+import os
+import struct
+import sys
+from zone_maps import ColumnStats
+
+MAGIC = b'HDBCOL1\n'
+ROWS_PER_GROUP = 65536
+# Largest number of distinct values a text chunk may have to be dictionary encoded
+MAX_DICTIONARY_SIZE = 256
+
+TYPE_CODES = {'int32': 'i', 'int': 'q', 'float': 'd'}
+
+
+def infer_type(values):
+    """
+    Picks the narrowest chunk type that can hold every value of a column chunk.
+    """
+    kind = 'int'
+    for value in values:
+        if value == '':
+            if kind == 'int':
+                kind = 'float'
+            continue
+        if kind == 'int' and value.lstrip('-').isdigit() and -2 ** 63 <= int(value) < 2 ** 63:
+            continue
+        try:
+            float(value)
+            kind = 'float'
+        except ValueError:
+            return 'str'
+    return kind
+
+
+def encode_chunk(values):
+    """
+    Encodes one column chunk.
+    Returns:
+        dict: The chunk metadata, with the encoded bytes under 'payload'.
+    """
+    kind = infer_type(values)
+    nulls = values.count('')
+    if kind == 'int':
+        data = array.array('q', map(int, values))
+        if -2 ** 31 <= min(data) and max(data) < 2 ** 31:
+            kind, data = 'int32', array.array('i', data)
+        return {'type': kind, 'payload': data.tobytes(), 'null_count': 0}
+    if kind == 'float':
+        data = array.array('d', (float(v) if v != '' else math.nan for v in values))
+        return {'type': kind, 'payload': data.tobytes(), 'null_count': nulls}
+
+    dictionary = {}
+    for value in values:
+        if value not in dictionary:
+            if len(dictionary) == MAX_DICTIONARY_SIZE:
+                break
+            dictionary[value] = len(dictionary)
+    else:
+        codes = bytes(dictionary[value] for value in values)
+        padding = b'\0' * (-len(codes) % 8)
+        return {'type': 'dict', 'payload': codes + padding + '\n'.join(dictionary).encode('utf-8'),
+                'dictionary_offset': len(codes) + len(padding), 'null_count': nulls}
+    return {'type': 'str', 'payload': '\n'.join(values).encode('utf-8'), 'null_count': nulls}
+
+
+def write_row_group(out, columns, row_group_meta):
+    meta = {'rows': len(columns[0]), 'columns': []}
+    for values in columns:
+        chunk = encode_chunk(values)
+        stats = ColumnStats()
+        for value in values:
+            stats.update(value)
+        chunk['stats'] = stats.to_dict()
+        payload = chunk.pop('payload')
+        chunk['offset'] = out.tell()
+        chunk['length'] = len(payload)
+        out.write(payload)
+        # Pad so the next chunk starts on an 8-byte boundary
+        out.write(b'\0' * (-len(payload) % 8))
+        meta['columns'].append(chunk)
+    row_group_meta.append(meta)
+
+
+def convert_csv(csv_path, output_path, rows_per_group=ROWS_PER_GROUP, delimiter=','):
+    """
+    Converts a CSV file with a header line into the columnar format.
+    Args:
+        csv_path (str): Path to the CSV file.
+        output_path (str): Path of the columnar file to write.
+        rows_per_group (int): Number of rows per row group.
+        delimiter (str): Field delimiter of the CSV file.
+    """
+    row_groups = []
+    with open(csv_path, 'r') as f, open(output_path, 'wb') as out:
+        out.write(MAGIC)
+        headers = f.readline().strip().split(delimiter)
+        columns = [[] for _ in headers]
+        for line in f:
+            line = line.rstrip('\r\n')
+            if not line:
+                continue
+            values = line.split(delimiter)
+            if len(values) != len(headers):
+                print(f"Skipping line: {line}", file=sys.stderr)
+                continue
+            for column, value in zip(columns, values):
+                column.append(value)
+            if len(columns[0]) >= rows_per_group:
+                write_row_group(out, columns, row_groups)
+                columns = [[] for _ in headers]
+        if columns[0]:
+            write_row_group(out, columns, row_groups)
+
+        footer = json.dumps({
+            'columns': headers,
+            'delimiter': delimiter,
+            'byteorder': sys.byteorder,
+            'row_groups': row_groups,
+        }).encode('utf-8')
+        out.write(footer)
+        out.write(struct.pack('<Q', len(footer)))
+        out.write(MAGIC)
+
+
+class ColumnarFile:
+    """
+    Memory-mapped reader for files written by convert_csv.
+    bytes_read counts the footer and every chunk that has been decoded, which
+    is what a scan actually pulls from disk. The *_skipped counters record the
+    row groups left out because of their zone map statistics.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[:len(MAGIC)] != MAGIC or self._map[-len(MAGIC):] != MAGIC:
+            raise ValueError(f"Not a columnar file: {path}")
+        end = len(self._map) - len(MAGIC)
+        footer_length = struct.unpack('<Q', self._map[end - 8:end])[0]
+        footer = json.loads(self._map[end - 8 - footer_length:end - 8])
+        self.columns = footer['columns']
+        self.delimiter = footer['delimiter']
+        self.row_groups = footer['row_groups']
+        self._swap = footer['byteorder'] != sys.byteorder
+        self.bytes_read = footer_length + 8 + 2 * len(MAGIC)
+        self.blocks_skipped = 0
+        self.rows_skipped = 0
+        self.bytes_skipped = 0
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def read_chunk(self, meta, rows):
+        """
+        Decodes one column chunk. Numeric chunks are returned as zero-copy
+        memoryviews over the map; text chunks as a list of str.
+        """
+        self.bytes_read += meta['length']
+        view = memoryview(self._map)[meta['offset']:meta['offset'] + meta['length']]
+        if meta['type'] == 'str':
+            text = bytes(view).decode('utf-8')
+            view.release()
+            return text.split('\n')
+        if meta['type'] == 'dict':
+            split = meta['dictionary_offset']
+            dictionary = bytes(view[split:]).decode('utf-8').split('\n')
+            values = [dictionary[code] for code in view[:rows]]
+            view.release()
+            return values
+        code = TYPE_CODES[meta['type']]
+        if self._swap:
+            data = array.array(code, bytes(view))
+            data.byteswap()
+            view.release()
+            return data
+        return view.cast(code)
+
+    def read_row_groups(self, columns=None, condition=None):
+        """
+        Yields, for each row group, a dict mapping each requested column name
+        to its decoded values. Only the requested chunks are read.
+        Args:
+            columns (iterable): Column names to decode; None means all columns.
+            condition (Condition): Optional WHERE clause; row groups whose
+                statistics rule it out are skipped without being read.
+        """
+        names = self.columns if columns is None else list(columns)
+        indices = [self.columns.index(name) for name in names]
+        for group in self.row_groups:
+            if condition is not None:
+                stats = {name: chunk.get('stats') for name, chunk in zip(self.columns, group['columns'])}
+                if not condition.can_match(stats):
+                    self.blocks_skipped += 1
+                    self.rows_skipped += group['rows']
+                    self.bytes_skipped += sum(group['columns'][i]['length'] for i in indices)
+                    continue
+            chunks = {name: self.read_chunk(group['columns'][i], group['rows']) for name, i in zip(names, indices)}
+            yield chunks
+            for chunk in chunks.values():
+                if isinstance(chunk, memoryview):
+                    chunk.release()
+
+    def rows(self, columns=None, condition=None):
+        """
+        Yields one list per row, laid out like a split CSV line. Only the
+        requested columns are filled in (with typed values); the rest are None.
+        Row groups that cannot satisfy `condition` are skipped, but rows of the
+        remaining groups still need to be checked against it.
+        """
+        width = len(self.columns)
+        names = self.columns if columns is None else list(columns)
+        indices = [self.columns.index(name) for name in names]
+        for chunks in self.read_row_groups(names, condition):
+            values = [chunks[name] for name in names]
+            for row_values in zip(*values):
+                row = [None] * width
+                for i, value in zip(indices, row_values):
+                    row[i] = value
+                yield row
+
+
+def format_value(value):
+    """
+    Formats a decoded value for text output, writing NaN nulls as empty fields.
+    """
+    if value.__class__ is float:
+        return '' if value != value else repr(value)
+    return str(value)
+
+
+def scan_report(path, columns, csv_path=None):
+    """
+    Reads the given columns of a columnar file and reports the bytes read,
+    compared with the size of the source CSV file when one is given.
+    """
+    with ColumnarFile(path) as table:
+        rows = 0
+        for chunks in table.read_row_groups(columns):
+            rows += len(next(iter(chunks.values()))) if chunks else 0
+        report = {'rows': rows, 'columns': list(columns), 'bytes_read': table.bytes_read,
+                  'file_bytes': os.path.getsize(path)}
+    if csv_path:
+        report['csv_bytes'] = os.path.getsize(csv_path)
+        report['reduction'] = round(report['csv_bytes'] / max(1, report['bytes_read']), 2)
+    return report
+
+
+if __name__ == "__main__":
+    if len(sys.argv) >= 4 and sys.argv[1] == 'convert':
+        convert_csv(sys.argv[2], sys.argv[3])
+        print(f"Converted {sys.argv[2]} ({os.path.getsize(sys.argv[2])} bytes) to {sys.argv[3]} ({os.path.getsize(sys.argv[3])} bytes)")
+    elif len(sys.argv) >= 4 and sys.argv[1] == 'scan':
+        csv_path = sys.argv[4] if len(sys.argv) > 4 else None
+        print(json.dumps(scan_report(sys.argv[2], sys.argv[3].split(','), csv_path)))
+    else:
+        print("Usage: python columnar.py convert <csv_file> <columnar_file>")
+        print("       python columnar.py scan <columnar_file> <column1,column2,...> [csv_file]")
+        sys.exit(1)
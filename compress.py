@@ -0,0 +1,134 @@
+"""
+Compression codecs for intermediate and output data.
+
+A codec name means the same on both paths: main.py sets the Hadoop codec
+class of HADOOP_CODECS for the map output (what the shuffle carries) and the
+job output, and the local runner and external sort open their spill runs and
+part files with the Python implementation in LOCAL_CODECS. snappy, lz4 and
+zstd have no implementation in the Python standard library, so they are
+available to Hadoop jobs only.
+
+Run as a script, this benchmarks the local codecs on the map output of an
+operation, the data a job shuffles:
+    python3 compress.py groupby "SELECT city, SUM(fare) FROM trips GROUPBY city" tripdata.csv
+"""
+import bz2
+import gzip
+import io
+import lzma
+import sys
+import time
+
+HADOOP_CODECS = {
+    'deflate': 'org.apache.hadoop.io.compress.DefaultCodec',
+    'gzip': 'org.apache.hadoop.io.compress.GzipCodec',
+    'bzip2': 'org.apache.hadoop.io.compress.BZip2Codec',
+    'snappy': 'org.apache.hadoop.io.compress.SnappyCodec',
+    'lz4': 'org.apache.hadoop.io.compress.Lz4Codec',
+    'zstd': 'org.apache.hadoop.io.compress.ZStandardCodec',
+}
+
+# name: (open function, file suffix); the fastest levels, since intermediate
+# data is written once and read once
+LOCAL_CODECS = {
+    'none': (lambda path, mode: open(path, mode, encoding='utf-8'), ''),
+    'gzip': (lambda path, mode: gzip.open(path, mode, encoding='utf-8', compresslevel=1), '.gz'),
+    'bzip2': (lambda path, mode: bz2.open(path, mode, encoding='utf-8', compresslevel=1), '.bz2'),
+    'xz': (lambda path, mode: lzma.open(path, mode, encoding='utf-8', preset=None if 'r' in mode else 0), '.xz'),
+}
+
+# In-memory compressors of the local codecs, for the benchmark
+COMPRESSORS = {
+    'gzip': (lambda data: gzip.compress(data, compresslevel=1), gzip.decompress),
+    'bzip2': (lambda data: bz2.compress(data, compresslevel=1), bz2.decompress),
+    'xz': (lambda data: lzma.compress(data, preset=0), lzma.decompress),
+}
+
+
+def job_properties(map_codec=None, output_codec=None):
+    """
+    Returns the -D properties that compress a job's map output and output.
+    Args:
+        map_codec (str): Name in HADOOP_CODECS, or None to leave map output uncompressed.
+        output_codec (str): Name in HADOOP_CODECS, or None to leave the output uncompressed.
+    """
+    properties = {}
+    for name, prefix in ((map_codec, 'mapreduce.map.output.compress'),
+                         (output_codec, 'mapreduce.output.fileoutputformat.compress')):
+        if name is None:
+            continue
+        if name not in HADOOP_CODECS:
+            raise ValueError(f"Unknown codec: {name}")
+        properties[prefix] = 'true'
+        properties[f"{prefix}.codec"] = HADOOP_CODECS[name]
+    return properties
+
+
+def open_text(path, mode, codec):
+    """
+    Opens a text file written, or to be written, with a local codec.
+    Args:
+        path (str): Path of the file, including its suffix.
+        mode (str): 'rt', 'wt' or 'at'.
+        codec (str): Name in LOCAL_CODECS.
+    """
+    if codec not in LOCAL_CODECS:
+        raise ValueError(f"Unknown local codec: {codec}")
+    return LOCAL_CODECS[codec][0](path, mode)
+
+
+def suffix(codec):
+    """
+    Returns the file suffix of a local codec.
+    """
+    return LOCAL_CODECS[codec][1]
+
+
+def benchmark(data, codecs=tuple(COMPRESSORS)):
+    """
+    Compresses and decompresses `data` with each codec.
+    Returns:
+        list: One dict per codec, with the uncompressed and compressed 'bytes',
+            'ratio' and the CPU seconds to 'compress' and 'decompress'.
+    """
+    results = [{'codec': 'none', 'raw_bytes': len(data), 'bytes': len(data), 'ratio': 1.0,
+                'compress': 0.0, 'decompress': 0.0}]
+    for name in codecs:
+        compress_data, decompress_data = COMPRESSORS[name]
+        start = time.process_time()
+        compressed = compress_data(data)
+        compress_seconds = time.process_time() - start
+        start = time.process_time()
+        decompress_data(compressed)
+        results.append({
+            'codec': name,
+            'raw_bytes': len(data),
+            'bytes': len(compressed),
+            'ratio': round(len(data) / max(1, len(compressed)), 2),
+            'compress': round(compress_seconds, 3),
+            'decompress': round(time.process_time() - start, 3),
+        })
+    return results
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 4:
+        print("Usage: python compress.py <query|projection|filter|groupby|join> <SQL statement> <input file> [<input file> ...]")
+        sys.exit(1)
+
+    from local_runner import input_splits, load_operation, read_split, register_tables, run_task
+
+    operation, sql_statement, inputs = sys.argv[1], sys.argv[2], sys.argv[3:]
+    register_tables(inputs)
+    tasks = load_operation(operation, sql_statement, inputs)
+    map_output = io.StringIO()
+    for path in inputs:
+        for split in input_splits(path):
+            run_task(tasks['mapper'], read_split(split), map_output)
+    data = map_output.getvalue().encode('utf-8')
+
+    print(f"{'codec':<8} {'shuffled bytes':>15} {'ratio':>7} {'compress s':>11} {'decompress s':>13}")
+    for result in benchmark(data):
+        print(f"{result['codec']:<8} {result['bytes']:>15} {result['ratio']:>7} "
+              f"{result['compress']:>11} {result['decompress']:>13}")
+    print(f"snappy, lz4 and zstd are Hadoop only: {', '.join(HADOOP_CODECS[name] for name in ('snappy', 'lz4', 'zstd'))}")
@@ -0,0 +1,80 @@
+"""
+Shared pytest fixtures.
+
+Every test runs in its own temporary working directory, since the schema
+registry, indexes and views live in the working directory.
+"""
+import io
+import os
+import sys
+
+import pytest
+
+import local_runner
+import vectorized
+from compress import open_text
+from schema import register_file
+
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+@pytest.fixture
+def write_table(workdir):
+    """
+    Writes a CSV file and registers it as the table named after it.
+    """
+    def write(name, text, register=True):
+        path = os.path.join(str(workdir), name)
+        with open(path, 'w') as f:
+            f.write(text)
+        if register:
+            register_file(path)
+        return path
+    return write
+
+
+@pytest.fixture
+def run_task(monkeypatch, capsys):
+    """
+    Runs an operator function over `text` on stdin and returns the lines it prints.
+    """
+    def run(task, text=''):
+        monkeypatch.setattr(sys, 'stdin', io.TextIOWrapper(io.BytesIO(text.encode('utf-8')), encoding='utf-8'))
+        task()
+        return capsys.readouterr().out.splitlines()
+    return run
+
+
+@pytest.fixture
+def run_local(workdir):
+    """
+    Runs an operation with the local runner and returns its output lines, sorted.
+    """
+    def run(operation, sql_statement, *inputs, output_codec='none', **options):
+        output_dir = os.path.join(str(workdir), 'output')
+        options.setdefault('workers', 2)
+        outputs = local_runner.run_local(operation, sql_statement, list(inputs), output_dir,
+                                         output_codec=output_codec, **options)
+        lines = []
+        for path in outputs:
+            with open_text(path, 'rt', output_codec) as f:
+                lines.extend(line.rstrip('\n') for line in f if line.strip())
+        return sorted(lines)
+    return run
+
+
+@pytest.fixture(params=['rows', 'batches'])
+def execution(request, monkeypatch):
+    """
+    Runs a test on the row-at-a-time path and, with NumPy installed, on the
+    batch path (see vectorized.py).
+    """
+    if request.param == 'rows':
+        monkeypatch.setattr(vectorized, 'np', None)
+    elif not vectorized.available():
+        pytest.skip("NumPy is not installed")
+    return request.param
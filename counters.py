@@ -0,0 +1,206 @@
+"""
+Task counters.
+
+Every mapper, combiner and reducer counts its work in a Counters object: rows
+and bytes read and written, rows the WHERE clause filtered out, input lines it
+could not parse, and milliseconds spent reading and parsing input, evaluating
+the WHERE clause and writing output. At the end of the task report() hands
+the counts on:
+    - under Hadoop streaming as `reporter:counter:<group>,<name>,<amount>`
+      lines on stderr, which Hadoop sums over the tasks and lists with the
+      job's counters, in one group per stage, e.g. "SQL mapper";
+    - otherwise as one JSON object per task, appended to the file named by
+      the COUNTERS_ENV environment variable (the local runner sets it and
+      sums them), or written to stderr when it is not set.
+"""
+import json
+import os
+import sys
+import time
+from itertools import islice
+
+COUNTER_NAMES = ('rows_in', 'bytes_in', 'rows_filtered', 'parse_errors', 'rows_out', 'bytes_out',
+                 'parse_ms', 'predicate_ms', 'emit_ms')
+COUNTERS_ENV = 'HADOOP_SQL_COUNTERS'
+STAGES = ('mapper', 'combiner', 'reducer')
+# Rows per clock reading when timing the parsing and the WHERE clause
+TIMING_BATCH = 256
+
+
+def counter_group(stage):
+    return f"SQL {stage}"
+
+
+class Counters:
+    __slots__ = ('stage', 'rows_in', 'bytes_in', 'rows_filtered', 'parse_errors', 'rows_out', 'bytes_out',
+                 'parse_seconds', 'predicate_seconds', 'emit_seconds')
+
+    def __init__(self, stage):
+        self.stage = stage
+        self.rows_in = 0
+        self.bytes_in = 0
+        self.rows_filtered = 0
+        self.parse_errors = 0
+        self.rows_out = 0
+        self.bytes_out = 0
+        self.parse_seconds = 0.0
+        self.predicate_seconds = 0.0
+        self.emit_seconds = 0.0
+
+    def lines(self, lines):
+        """
+        Yields input lines, counting their bytes.
+        """
+        for line in lines:
+            self.bytes_in += len(line)
+            yield line
+
+    def rows(self, rows):
+        """
+        Yields parsed input rows, counting them and the time spent producing
+        them, which includes reading the input. Rows are produced TIMING_BATCH
+        at a time, so the clock is read once per batch rather than per row.
+        """
+        rows = iter(rows)
+        while True:
+            start = time.perf_counter()
+            batch = list(islice(rows, TIMING_BATCH))
+            self.parse_seconds += time.perf_counter() - start
+            if not batch:
+                return
+            self.rows_in += len(batch)
+            yield from batch
+
+    def predicate(self, predicate):
+        """
+        Wraps a compiled WHERE clause to count the rows it rejects and the
+        time spent in it. Only every TIMING_BATCH-th call is timed, standing
+        for the whole batch, so the clock is not read for every row.
+        """
+        calls = 0
+
+        def check(row):
+            nonlocal calls
+            calls += 1
+            if calls % TIMING_BATCH:
+                matched = predicate(row)
+            else:
+                start = time.perf_counter()
+                try:
+                    matched = predicate(row)
+                finally:
+                    self.predicate_seconds += (time.perf_counter() - start) * TIMING_BATCH
+            if not matched:
+                self.rows_filtered += 1
+            return matched
+        return check
+
+    def emit(self, line):
+        """
+        Prints an output line, counting it and the time spent writing it.
+        """
+        start = time.perf_counter()
+        print(line)
+        self.emit_seconds += time.perf_counter() - start
+        self.rows_out += 1
+        self.bytes_out += len(line) + 1
+
+    def emit_lines(self, lines):
+        """
+        Writes a batch of output lines with a single write, counting them and
+        the time spent writing them.
+        """
+        if not lines:
+            return
+        start = time.perf_counter()
+        text = '\n'.join(lines) + '\n'
+        sys.stdout.write(text)
+        self.emit_seconds += time.perf_counter() - start
+        self.rows_out += len(lines)
+        self.bytes_out += len(text)
+
+    def values(self):
+        """
+        Returns the counters by name, with times in whole milliseconds.
+        """
+        return {
+            'rows_in': self.rows_in,
+            'bytes_in': self.bytes_in,
+            'rows_filtered': self.rows_filtered,
+            'parse_errors': self.parse_errors,
+            'rows_out': self.rows_out,
+            'bytes_out': self.bytes_out,
+            'parse_ms': round(self.parse_seconds * 1000),
+            'predicate_ms': round(self.predicate_seconds * 1000),
+            'emit_ms': round(self.emit_seconds * 1000),
+        }
+
+    def report(self):
+        values = self.values()
+        if 'mapreduce_task_id' in os.environ or 'mapred_task_id' in os.environ:
+            for name, amount in values.items():
+                print(f"reporter:counter:{counter_group(self.stage)},{name},{amount}", file=sys.stderr)
+        elif os.environ.get(COUNTERS_ENV):
+            with open(os.environ[COUNTERS_ENV], 'a') as f:
+                f.write(json.dumps({'stage': self.stage, **values}) + '\n')
+        else:
+            print(f"Counters: {json.dumps({'stage': self.stage, **values})}", file=sys.stderr)
+
+
+def sum_counters(records):
+    """
+    Adds up per-task counter records (dicts with 'stage' and counter values)
+    into {stage: {name: total}}, in STAGES order.
+    """
+    totals = {}
+    for record in records:
+        stage = totals.setdefault(record['stage'], dict.fromkeys(COUNTER_NAMES, 0))
+        for name in COUNTER_NAMES:
+            stage[name] += record.get(name, 0)
+    return {stage: totals[stage] for stage in sorted(totals, key=lambda s: STAGES.index(s) if s in STAGES else len(STAGES))}
+
+
+def load_counters(path):
+    """
+    Reads and sums the per-task JSON records of a local counters file.
+    """
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return sum_counters(json.loads(line) for line in f if line.strip())
+
+
+def parse_job_counters(lines):
+    """
+    Picks this project's counter groups out of a Hadoop job client's log,
+    whose counters section has group names indented by one tab and
+    `name=value` lines indented by two.
+    Returns:
+        dict: {stage: {name: total}}.
+    """
+    groups = {counter_group(stage): stage for stage in STAGES}
+    totals = {}
+    stage = None
+    for line in lines:
+        line = line.rstrip('\n')
+        if line.startswith('\t\t'):
+            name, _, value = line.strip().partition('=')
+            if stage is not None and name in COUNTER_NAMES and value.isdigit():
+                totals.setdefault(stage, dict.fromkeys(COUNTER_NAMES, 0))[name] = int(value)
+        elif line.startswith('\t'):
+            stage = groups.get(line.strip())
+    return {stage: totals[stage] for stage in STAGES if stage in totals}
+
+
+def format_summary(totals):
+    """
+    Formats summed counters as one line per stage.
+    """
+    lines = []
+    for stage, values in totals.items():
+        lines.append(f"{stage:>8}: {values['rows_in']} rows in ({values['bytes_in']} bytes), "
+                     f"{values['rows_filtered']} filtered, {values['parse_errors']} unparseable, "
+                     f"{values['rows_out']} rows out ({values['bytes_out']} bytes); "
+                     f"parse {values['parse_ms']} ms, predicate {values['predicate_ms']} ms, "
+                     f"emit {values['emit_ms']} ms")
+    return '\n'.join(lines)
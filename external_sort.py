@@ -0,0 +1,150 @@
+"""
+External merge sort for newline-terminated text lines.
+
+Lines are sorted in memory until they pass a memory budget, then the sorted
+run is spilled to a temporary file compressed with SPILL_CODEC (see
+compress.py). Reading the result k-way merges the runs with heapq.merge, at
+most `fan_in` files at a time; with more runs than that, intermediate passes
+merge groups of runs into longer ones first. The result is a generator, so a reducer can consume input far larger
+than memory. Lines compare as plain strings, the same order as `LC_ALL=C sort`.
+"""
+import heapq
+import os
+import sys
+import tempfile
+from compress import open_text, suffix
+
+# Bytes of lines held in memory before a sorted run is spilled
+SORT_MEMORY_BYTES = 64 * 1024 * 1024
+# Largest number of runs merged at once
+SORT_FAN_IN = 64
+# Codec of the run files, a name in compress.LOCAL_CODECS
+SPILL_CODEC = 'gzip'
+
+
+def write_run(lines, path, codec=SPILL_CODEC):
+    """
+    Writes sorted lines to a compressed run file.
+    """
+    with open_text(path, 'wt', codec) as f:
+        f.writelines(lines)
+
+
+def read_run(path, codec=SPILL_CODEC):
+    """
+    Yields the lines of a run file written by write_run.
+    """
+    with open_text(path, 'rt', codec) as f:
+        yield from f
+
+
+class SortStats:
+    __slots__ = ('spills', 'merge_passes')
+
+    def __init__(self):
+        self.spills = 0
+        self.merge_passes = 0
+
+    def add(self, other):
+        self.spills += other.spills
+        self.merge_passes += other.merge_passes
+
+    def report(self, label='Sort'):
+        print(f"{label} spilled {self.spills} runs and made {self.merge_passes} intermediate merge passes",
+              file=sys.stderr)
+
+
+def merge_runs(paths, work_dir, fan_in=SORT_FAN_IN, stats=None, codec=SPILL_CODEC):
+    """
+    Yields the lines of sorted run files in sorted order.
+    Args:
+        paths (list): Run files written by write_run.
+        work_dir (str): Directory for the runs of intermediate merge passes.
+        fan_in (int): Largest number of runs merged at once.
+        stats (SortStats): Counts the intermediate merge passes.
+        codec (str): Codec of the run files.
+    """
+    fan_in = max(2, fan_in)
+    paths = list(paths)
+    merged = 0
+    while len(paths) > fan_in:
+        if stats is not None:
+            stats.merge_passes += 1
+        next_paths = []
+        for i in range(0, len(paths), fan_in):
+            group = paths[i:i + fan_in]
+            if len(group) == 1:
+                next_paths.append(group[0])
+                continue
+            path = os.path.join(work_dir, f"merge-{merged:05d}{suffix(codec)}")
+            merged += 1
+            write_run(heapq.merge(*[read_run(p, codec) for p in group]), path, codec)
+            next_paths.append(path)
+        paths = next_paths
+    yield from heapq.merge(*[read_run(path, codec) for path in paths])
+
+
+class ExternalSorter:
+    """
+    Collects lines and yields them back sorted, spilling sorted runs to
+    compressed files whenever the lines held in memory pass `memory_bytes`.
+    Every line must end with a newline.
+    """
+
+    def __init__(self, work_dir=None, memory_bytes=SORT_MEMORY_BYTES, fan_in=SORT_FAN_IN, codec=SPILL_CODEC):
+        self.memory_bytes = memory_bytes
+        self.fan_in = fan_in
+        self.codec = codec
+        self.stats = SortStats()
+        self._temp = tempfile.TemporaryDirectory(dir=work_dir)
+        self._lines = []
+        self._size = 0
+        self._runs = []
+
+    def add(self, line):
+        self._lines.append(line)
+        self._size += len(line)
+        if self._size >= self.memory_bytes:
+            self._spill()
+
+    def _spill(self):
+        self._lines.sort()
+        path = os.path.join(self._temp.name, f"run-{len(self._runs):05d}{suffix(self.codec)}")
+        write_run(self._lines, path, self.codec)
+        self._runs.append(path)
+        self.stats.spills += 1
+        self._lines = []
+        self._size = 0
+
+    def sorted(self):
+        """
+        Yields every line added so far in sorted order.
+        """
+        if not self._runs:
+            self._lines.sort()
+            yield from self._lines
+            return
+        if self._lines:
+            self._spill()
+        yield from merge_runs(self._runs, self._temp.name, self.fan_in, self.stats, self.codec)
+
+    def close(self):
+        self._lines = []
+        self._temp.cleanup()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+if __name__ == "__main__":
+    # Sorts stdin to stdout, as a drop-in for `sort` in the local test pipelines
+    memory_bytes = int(sys.argv[1]) if len(sys.argv) > 1 else SORT_MEMORY_BYTES
+    fan_in = int(sys.argv[2]) if len(sys.argv) > 2 else SORT_FAN_IN
+    with ExternalSorter(memory_bytes=memory_bytes, fan_in=fan_in) as sorter:
+        for line in sys.stdin:
+            sorter.add(line if line.endswith('\n') else line + '\n')
+        sys.stdout.writelines(sorter.sorted())
+        sorter.stats.report()
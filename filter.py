@@ -1,119 +1,197 @@
 #!/usr/bin/env python3
 import re
 import sys
-import csv
+import vectorized
+from predicate import column_index, parse_where
+from top_n import parse_order_by, top_n
+from columnar import ColumnarFile, format_value
+from counters import Counters
+from schema import table_schema
+from secondary_index import find_index, read_records
+from zone_maps import ScanStats, load_zone_map, scan_lines
 
 
 def parse_sql(sql_statement):
     """
-    Parses a SQL statement to extract multiple filtering conditions including operators.
+    Parses a SQL statement to extract its filtering conditions, projections and table.
     Assumes the SQL statement is of the form: SELECT * FROM table WHERE column1 = value1 AND column2 > value2;
+    The WHERE clause is returned as a condition tree (see predicate.py) that the
+    mapper compiles once against the headers.
     """
-    where_clause = {}
-    projections = []
-    
-    # Capture all conditions in the WHERE clause, including operators and values
-    # Pattern modified to accept numeric values (e.g., 10) and alphanumeric values (e.g., value1)
-    pattern = r"(\w+)\s*([=<>!]+)\s*([^\s,]+)"
-    
-    # Extract everything after WHERE and before optional GROUP BY or ORDER BY
-    conditions = re.search(r"WHERE\s+(.*?)(?:GROUP BY|ORDER BY|$)", sql_statement, re.IGNORECASE)
-    
-    if conditions:
-        # Find all key-operator-value triplets in the conditions
-        matches = re.findall(pattern, conditions.group(1))
-        for match in matches:
-            where_clause[match[0]] = {'operator': match[1], 'value': match[2]}
-
-        # Extract everything after SELECT and before WHERE
-        projection = re.search(r"SELECT\s+((?:\*|\w+(?:\s*,\s*\w+)*))(?:\s+FROM\s+(\w+))?", sql_statement, re.IGNORECASE)
-        if projection: 
-            if projection.group(1).strip() == '*':
-                projections = ['*']
-            else:
-                projections = [col.strip() for col in projection.group(1).split(',')]
-            table = projection.group(2)
-        else:
-            raise ValueError("Invalid SQL statement format")
-    
-    if not where_clause:
+    where_clause = parse_where(sql_statement)
+    if where_clause is None:
         raise ValueError("No valid WHERE clause found")
-    
+
+    # Extract everything after SELECT and before WHERE
+    projection = re.search(r"SELECT\s+((?:\*|\w+(?:\s*,\s*\w+)*))(?:\s+FROM\s+(\w+))?", sql_statement, re.IGNORECASE)
+    if projection:
+        if projection.group(1).strip() == '*':
+            projections = ['*']
+        else:
+            projections = [col.strip() for col in projection.group(1).split(',')]
+        table = projection.group(2)
+    else:
+        raise ValueError("Invalid SQL statement format")
+
     return where_clause, projections, table
 
 
 
 
-def mapper(filters, projections, table):
-    headers = []
-    with open('/mnt/c/Users/himan/Desktop/Dump/Hadoop/headers.csv', 'r') as f:
-        reader = csv.reader(f)
-        headers = next(reader)  # Read the first row as headers
+def matching_rows(filters, headers, column_indices, source=None, extra_columns=(), counters=None, schema=None,
+                  lines=None):
+    """
+    Yields (row, output line) for the rows that satisfy the WHERE clause.
+    `extra_columns` are read from the rows besides the projection: a columnar
+    source also decodes them, and CSV rows too short to hold them are skipped,
+    like rows with missing projected fields, as parse errors. CSV input
+    is read with the table's `schema` from the registry (see schema.py), from
+    stdin or from `lines`.
+    """
+    counters = counters if counters is not None else Counters('mapper')
+    # Resolve columns, coerce constants and order the conditions once per task
+    predicate = counters.predicate(filters.compile(headers, schema['types'] if schema is not None else None))
+
+    if source is not None:
+        output_indices = column_indices if column_indices is not None else range(len(headers))
+        needed = filters.columns() | {headers[i] for i in output_indices} | set(extra_columns)
+        with ColumnarFile(source) as columnar_file:
+            for data in counters.rows(columnar_file.rows([col for col in headers if col in needed], filters)):
+                if predicate(data):
+                    data = [format_value(value) if value is not None else None for value in data]
+                    yield data, ','.join([data[i] for i in output_indices])
+            counters.bytes_in += columnar_file.bytes_read
+            print(f"Zone maps skipped {columnar_file.blocks_skipped} blocks, {columnar_file.rows_skipped} rows, "
+                  f"{columnar_file.bytes_skipped} bytes", file=sys.stderr)
+        return
+
+    scan_stats = ScanStats() if lines is None else None
+    if lines is None:
+        lines = scan_lines(filters, load_zone_map(), scan_stats=scan_stats)
+    header_line, delimiter = schema['header'], schema['delimiter']
+    width = max((headers.index(col) + 1 for col in extra_columns if col in headers), default=0)
+    lines = (line.strip() for line in counters.lines(lines))
+    for line, data in counters.rows((line, line.split(delimiter)) for line in lines if line and line != header_line):
+        if len(data) < width:
+            counters.parse_errors += 1
+            continue
+        try:
+            if not predicate(data):
+                continue
+            projection = line if column_indices is None else ','.join([data[i] for i in column_indices])
+        except (IndexError, ValueError):
+            counters.parse_errors += 1
+            continue  # Skip rows with missing fields or values that do not fit the column type
+        yield data, projection
+
+    if scan_stats is not None:
+        scan_stats.report()
+
 
-        # Detect and process headers or data
-    filter_indices = {col: headers.index(col) for col in filters if col in headers}
+def mapper(filters, projections, table, source=None, order=None):
+    """
+    Emits the rows that satisfy the WHERE clause, projected to the selected columns.
+    Args:
+        source (str): Optional path of a columnar file (see columnar.py) to read
+            instead of CSV lines on stdin. Only the columns the query references
+            are decoded.
+        order (dict): ORDER BY ... LIMIT of the statement (see top_n.py); the
+            mapper then emits only its first `limit` rows, each prefixed with
+            its ORDER BY value, for a single reducer to merge.
+    Blocks whose zone map statistics rule out the WHERE clause are skipped.
+    With NumPy installed and no ORDER BY, CSV input is filtered a batch at a
+    time (see vectorized.py).
+    """
+    schema = None
+    if source is not None:
+        with ColumnarFile(source) as columnar_file:
+            headers = columnar_file.columns
+    else:
+        schema = table_schema(table)
+        headers = schema['columns']
 
     if projections[0] != '*':
         column_indices = [headers.index(col) for col in projections if col in headers]
     else:
         column_indices = None
 
-    for line in sys.stdin:
-        line = line.strip()
-        if not line:
-            continue
-        
-        # print(f"DEBUG: filter_indices: {filter_indices}", file=sys.stderr)
-        # Process data lines after headers are processed
-        data = line.split(',')
-        num_conditions = len(filters)
-        num_passed = 0
-        for col, val in filters.items():
-            try:
-                value = float(val['value'])
-                data_val = float(data[filter_indices[col]])
-            except:
-                value = val['value']
-                data_val = data[filter_indices[col]]
-
-            if val['operator'] == '=':
-                if data_val != value:
-                    break
-            elif val['operator'] == '>=':
-                if data_val < value:
-                    break
-            elif val['operator'] == '<=':
-                if data_val > value:
-                    break
-            elif val['operator'] == '>':
-                if data_val <= value:
-                    break
-            elif val['operator'] == '<':
-                if data_val >= value:
-                    break
-            else:
-                raise ValueError(f"Unsupported operator: {val['operator']}")
-            
-            num_passed += 1
-        if num_passed == num_conditions:
-            if column_indices == None:
-                print(line)
-            else:
-                selected_values = [data[i] for i in column_indices]
-                projection = ','.join(selected_values)
-                print(projection)
-        
-        # if all(data[filter_indices[col]] == val['value'] for col, val in filters.items()):
-        #     print(line)
-        
-
-def reducer():
-    for line in sys.stdin:
-        print(line.strip())
+    counters = Counters('mapper')
+    if source is None and order is None and vectorized.available():
+        scan_stats = ScanStats()
+        for lines in vectorized.select(filters, schema, column_indices, scan_stats, counters):
+            counters.emit_lines(lines)
+        scan_stats.report()
+        counters.report()
+        return
+
+    order_index = column_index(headers, order['column']) if order and order['column'] else 0
+    rows = matching_rows(filters, headers, column_indices, source, {headers[order_index]}, counters, schema)
+    if order is None:
+        for _, line in rows:
+            counters.emit(line)
+    else:
+        for data, line in top_n(rows, order, lambda row: row[0][order_index]):
+            counters.emit(f"{data[order_index]}\t{line}")
+    counters.report()
+
+
+def index_scan(filters, projections, table, order=None, fingerprint=None):
+    """
+    Answers the statement from a secondary index of the table (see
+    secondary_index.py) when one narrows the WHERE clause down to few rows:
+    only those rows are read, with seeks into the data files, and they are
+    filtered and printed as the mapper and reducer would.
+    Args:
+        fingerprint (function): Returns the current fingerprint of the table's
+            data; indexes built from other data are dropped.
+    Returns:
+        bool: False, with nothing printed, when no index applies.
+    """
+    schema = table_schema(table)
+    locations = find_index(filters, table, schema, fingerprint)
+    if locations is None:
+        return False
+
+    headers = schema['columns']
+    if projections[0] != '*':
+        column_indices = [headers.index(col) for col in projections if col in headers]
+    else:
+        column_indices = None
+
+    counters = Counters('mapper')
+    order_index = column_index(headers, order['column']) if order and order['column'] else 0
+    rows = matching_rows(filters, headers, column_indices, extra_columns={headers[order_index]}, counters=counters,
+                         schema=schema, lines=read_records(locations))
+    if order is None:
+        for _, line in rows:
+            counters.emit(line)
+    else:
+        for _, line in top_n(rows, order, lambda row: row[0][order_index]):
+            counters.emit(line)
+    counters.report()
+    return True
+
+
+def reducer(order=None):
+    """
+    Writes the matching rows. With ORDER BY ... LIMIT the mappers' rows are
+    merged, in order, into the first `limit`.
+    """
+    counters = Counters('reducer')
+    lines = counters.rows(counters.lines(sys.stdin))
+    if order is None:
+        for line in lines:
+            counters.emit(line.strip())
+    else:
+        rows = (line.rstrip('\n').split('\t', 1) for line in lines if '\t' in line)
+        for _, line in top_n(rows, order, lambda row: row[0]):
+            counters.emit(line)
+    counters.report()
+
 
 if __name__ == "__main__":
     if len(sys.argv) < 3:
-        print("Usage: python projection.py <SQL statement> <mapper|reducer>")
+        print("Usage: python filter.py <SQL statement> <mapper|reducer> [columnar_file]")
         sys.exit(1)
 
     # Get the SQL statement from the command line argument
@@ -122,11 +200,12 @@ if __name__ == "__main__":
     print(f"SQL Statement Received: {sql_statement}", file=sys.stderr)  # Debugging line
 
     filters, projections, table = parse_sql(sql_statement)
+    order = parse_order_by(sql_statement)
 
     # Determine whether to run mapper or reducer
     if sys.argv[2] == 'mapper':
-        mapper(filters, projections, table)
+        mapper(filters, projections, table, sys.argv[3] if len(sys.argv) > 3 else None, order)
     elif sys.argv[2] == 'reducer':
-        reducer()
+        reducer(order)
     else:
         print("Invalid argument. Use 'mapper' or 'reducer'.")
\ No newline at end of file
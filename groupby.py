@@ -1,29 +1,38 @@
 #!/usr/bin/env python3
 import re
 import sys
-from collections import defaultdict
-import csv
+import vectorized
+from aggregators import NON_NUMERIC, new_accumulator, decode_accumulator
+from columnar import ColumnarFile, format_value
+from counters import Counters
+from partitioning import TOKEN_WIDTH, RangeRouter
+from predicate import parse_where
+from schema import table_schema
+from top_n import parse_order_by, top_n
+from zone_maps import ScanStats, load_zone_map, scan_lines
 
 def parse_sql(sql_statement):
     """
     Parses a SQL statement to extract filtering conditions, projections, grouping, and aggregations.
     Assumes the SQL statement is of the form: 
     SELECT [columns/aggregations] FROM table [WHERE conditions] [GROUP BY columns];
+    Aggregations are returned in SELECT order as (function, column, parameter)
+    tuples. Besides SUM, AVG, MIN, MAX and COUNT this accepts COUNT(DISTINCT col),
+    PERCENTILE(col, q) and MEDIAN(col), which are computed approximately.
     """
-    where_clause = {}
     projections = []
     group_by = []
-    aggregations = {}
+    aggregations = []
 
     # Extract everything after SELECT and before FROM
     projection_match = re.search(r"SELECT\s+(.*?)\s+FROM", sql_statement, re.IGNORECASE)
     if projection_match:
-        projection_items = [item.strip() for item in projection_match.group(1).split(',')]
+        # Split on commas that are not inside parentheses, e.g. PERCENTILE(fare, 0.9)
+        projection_items = [item.strip() for item in re.split(r",(?![^()]*\))", projection_match.group(1))]
         for item in projection_items:
             agg_match = re.match(r"(\w+)\((.*?)\)", item)
             if agg_match:
-                agg_func, agg_col = agg_match.groups()
-                aggregations[agg_col] = agg_func.upper()
+                aggregations.append(parse_aggregation(agg_match.group(1), agg_match.group(2)))
             else:
                 projections.append(item)
     
@@ -31,17 +40,11 @@ def parse_sql(sql_statement):
     table_match = re.search(r"FROM\s+(\w+)", sql_statement, re.IGNORECASE)
     table = table_match.group(1) if table_match else None
     
-    # Extract WHERE conditions without single quotes
-    where_match = re.search(r"WHERE\s+(.*?)(?:GROUPBY|$)", sql_statement, re.IGNORECASE)
-    if where_match:
-        # Pattern to match conditions without single quotes
-        condition_pattern = r"(\w+)\s*([=<>!]+)\s*([^\s,]+)"
-        matches = re.findall(condition_pattern, where_match.group(1))
-        for match in matches:
-            where_clause[match[0]] = {'operator': match[1], 'value': match[2]}
+    # Extract the WHERE conditions as a condition tree (see predicate.py)
+    where_clause = parse_where(sql_statement)
     
     # Extract GROUP BY columns
-    group_by_match = re.search(r"GROUPBY\s+(.*?)$", sql_statement, re.IGNORECASE)
+    group_by_match = re.search(r"GROUPBY\s+(.*?)(?:\s+ORDER\s+BY\b|\s+LIMIT\b|$)", sql_statement, re.IGNORECASE)
     if group_by_match:
         group_by = [col.strip() for col in group_by_match.group(1).split(',')]
     
@@ -49,106 +52,298 @@ def parse_sql(sql_statement):
 
 
 
+def parse_aggregation(agg_func, argument):
+    """
+    Turns an aggregate call such as SUM(fare) into a (function, column, parameter) tuple.
+    """
+    agg_func = agg_func.upper()
+    argument = argument.strip()
+    distinct_match = re.match(r"DISTINCT\s+(\w+)$", argument, re.IGNORECASE)
+    if agg_func == 'COUNT' and distinct_match:
+        return 'COUNT_DISTINCT', distinct_match.group(1), None
+    if agg_func == 'MEDIAN':
+        return 'PERCENTILE', argument, 0.5
+    if agg_func == 'PERCENTILE':
+        column, quantile = [part.strip() for part in argument.split(',')]
+        return 'PERCENTILE', column, float(quantile)
+    return agg_func, argument, None
+
+
 # print(where_clause)
 # print(projections)
 # print(table)
 # print(group_by)
 # print(aggregations)
 
-def mapper(where_clause, projections, table, group_by, aggregations):
-    headers = []
-    headers_processed = False
-    with open('/mnt/c/Users/himan/Desktop/Dump/Hadoop/headers.csv', 'r') as f:
-        reader = csv.reader(f)
-        headers = next(reader)
+# Upper bound on the number of distinct groups held by the in-mapper
+# aggregation table before it is flushed to stdout.
+MAX_MAPPER_GROUPS = 100000
+
+
+def encode_partials(states):
+    """
+    Serialises the accumulators of one group, one field per aggregation.
+    """
+    return ','.join(state.encode() for state in states)
+
+
+def decode_partials(value, aggregations):
+    """
+    Parses a value written by encode_partials back into accumulators.
+    """
+    return [decode_accumulator(func, text) for (func, _, _), text in zip(aggregations, value.split(','))]
+
+
+def merge_partials(states, other):
+    """
+    Merges the accumulators in `other` into `states` in place.
+    """
+    for state, part in zip(states, other):
+        state.merge(part)
+
+
+def flush_partials(partials, router=None, counters=None):
+    """
+    Writes every buffered group with its partial states and empties the table.
+    With a RangeRouter (see partitioning.py) each key goes out behind the
+    token of its reducer's range.
+    """
+    lines = []
+    for group_key, states in partials.items():
+        if router is not None:
+            group_key = router.prefix(group_key)
+        lines.append(f"{group_key}\t{encode_partials(states)}")
+    if counters is not None:
+        counters.emit_lines(lines)
+    else:
+        for line in lines:
+            print(line)
+    partials.clear()
 
-    for line in sys.stdin:
+
+def read_csv_rows(header_line, where_clause=None, scan_stats=None, counters=None, delimiter=','):
+    """
+    Yields the split data lines on stdin, skipping the header line and any
+    block whose zone map rules out the WHERE clause. Only the split at the
+    start of the file holds the header, so the header line registered for the
+    table (see schema.py) is matched rather than assumed to be the first line.
+    """
+    lines = scan_lines(where_clause, load_zone_map(), scan_stats=scan_stats)
+    for line in (counters.lines(lines) if counters is not None else lines):
         line = line.strip()
-        if not line:
+        if not line or line == header_line:
             continue
 
-        if headers_processed == False:
-            # headers = line.split(',')
-            column_indices = [headers.index(col) for col in projections if col in headers]
-            aggregation_indices = [headers.index(col) for col in aggregations if col in headers]
-            headers_processed = True
-            continue
+        yield line.split(delimiter)
 
-        values = line.split(',')
 
-        # Create the key for the GROUP BY columns
-        group_key = ','.join([values[i] for i in column_indices])
+def read_columnar_rows(columnar_file, columns, indices, where_clause=None):
+    """
+    Yields rows of a columnar file with the given columns formatted as text,
+    so null floats (NaN) become empty fields, as in CSV input.
+    """
+    for row in columnar_file.rows(columns, where_clause):
+        for i in indices:
+            row[i] = format_value(row[i])
+        yield row
+
+
+def mapper(where_clause, projections, table, group_by, aggregations, max_groups=MAX_MAPPER_GROUPS, source=None,
+           router=None):
+    """
+    Mapper with in-mapper hash aggregation.
+    Rows are folded into one accumulator per group and aggregation, so
+    the output scales with the number of distinct groups rather than rows. The
+    table is flushed whenever it holds `max_groups` groups to bound memory.
+    Rows are filtered by the WHERE clause, and blocks whose zone map statistics
+    rule it out are skipped. With NumPy installed, CSV input of SUM, COUNT,
+    AVG, MIN and MAX queries is aggregated a batch at a time (see
+    vectorized.py).
+    Args:
+        source (str): Optional path of a columnar file (see columnar.py) to read
+            instead of CSV lines on stdin. Only the grouped and aggregated
+            columns are decoded.
+        router (RangeRouter): Optional range partitioning of the keys.
+    """
+    columnar_file = None
+    schema = None
+    types = None
+    if source is not None:
+        columnar_file = ColumnarFile(source)
+        headers = columnar_file.columns
+    else:
+        schema = table_schema(table)
+        headers = schema['columns']
+        types = schema['types']
+
+    column_indices = [headers.index(col) for col in projections if col in headers]
+    aggregation_columns = []
+    for func, col, _ in aggregations:
+        if col == '*':
+            # COUNT(*) counts rows, so any column will do as its input
+            index = column_indices[0] if column_indices else 0
+        elif col in headers:
+            index = headers.index(col)
+        else:
+            raise ValueError(f"Unknown aggregation column: {col}")
+        aggregation_columns.append((index, str if func in NON_NUMERIC else float))
+
+    counters = Counters('mapper')
+    predicate = counters.predicate(where_clause.compile(headers, types)) if where_clause is not None else None
+
+    scan_stats = ScanStats()
+    partials = {}
+    if columnar_file is None and vectorized.can_aggregate(aggregations):
+        for batch_partials in vectorized.aggregate(where_clause, schema, column_indices, aggregation_columns,
+                                                   aggregations, scan_stats, counters):
+            for group_key, states in batch_partials.items():
+                existing = partials.get(group_key)
+                if existing is None:
+                    partials[group_key] = states
+                else:
+                    merge_partials(existing, states)
+                if len(partials) >= max_groups:
+                    flush_partials(partials, router, counters)
+        rows = ()
+    elif columnar_file is not None:
+        needed = {headers[i] for i in column_indices} | {headers[i] for i, _ in aggregation_columns}
+        if where_clause is not None:
+            needed |= where_clause.columns()
+        formatted = column_indices + [i for i, _ in aggregation_columns]
+        rows = read_columnar_rows(columnar_file, [col for col in headers if col in needed], formatted, where_clause)
+    else:
+        rows = read_csv_rows(schema['header'], where_clause, scan_stats, counters, schema['delimiter'])
 
-        # Create the value for the aggregation columns
-        agg_values = [values[i] for i in aggregation_indices]
+    for values in counters.rows(rows):
+        try:
+            if predicate is not None and not predicate(values):
+                continue
+        except (IndexError, ValueError):
+            counters.parse_errors += 1
+            continue  # Skip rows with missing fields or values that do not fit the column type
 
-        # Output key-value pair
-        print(f"{group_key}\t{','.join(agg_values)}")
+        # Create the key for the GROUP BY columns
+        group_key = ','.join([values[i] for i in column_indices])
 
+        try:
+            agg_values = [convert(values[i]) for i, convert in aggregation_columns]
+        except (ValueError, IndexError):
+            counters.parse_errors += 1
+            continue
 
-# Define the aggregation functions outside the loop for clarity and efficiency
-def sum_agg(values):
-    return sum(values)
+        states = partials.get(group_key)
+        if states is None:
+            states = partials[group_key] = [new_accumulator(func, param) for func, _, param in aggregations]
 
-def avg_agg(values):
-    return sum(values) / len(values) if values else 0
+        for state, v in zip(states, agg_values):
+            state.update(v)
 
-def max_agg(values):
-    return max(values)
+        if len(partials) >= max_groups:
+            flush_partials(partials, router, counters)
 
-def min_agg(values):
-    return min(values)
+    flush_partials(partials, router, counters)
+    if columnar_file is not None:
+        scan_stats.blocks_skipped = columnar_file.blocks_skipped
+        scan_stats.rows_skipped = columnar_file.rows_skipped
+        scan_stats.bytes_skipped = columnar_file.bytes_skipped
+        counters.bytes_in += columnar_file.bytes_read
+        columnar_file.close()
+    if where_clause is not None:
+        scan_stats.report()
+    counters.report()
 
-def count_agg(values):
-    return len(values)
 
-# Map of aggregation functions
-aggregation_funcs = {
-    'SUM': sum_agg,
-    'AVG': avg_agg,
-    'MAX': max_agg,
-    'MIN': min_agg,
-    'COUNT': count_agg
-}
-current_key = None
-agg_data = defaultdict(list)
-def reducer():
-    global current_key, agg_data
-    for line in sys.stdin:
+def read_partials(aggregations, counters):
+    """
+    Reads sorted `key\tpartials` lines from stdin and yields each key once
+    together with the merge of all its partial states.
+    """
+    current_key = None
+    current_states = None
+    for line in counters.rows(counters.lines(sys.stdin)):
         line = line.strip()
         if not line:
             continue
 
         try:
             key, value = line.split('\t')
-            values = list(map(float, value.split(',')))
+            states = decode_partials(value, aggregations)
         except ValueError:
-            print(f"Skipping line: {line}")
+            counters.parse_errors += 1
             continue  # Skip lines that don't properly parse
 
         if key != current_key:
             if current_key is not None:
-                # Output results for the previous key
-                results = [str(aggregation_funcs[func](agg_data[col])) for col, func in aggregations.items()]
-                print(f"{current_key}\t{','.join(results)}")
-                agg_data.clear()  # Reset the aggregation data
+                yield current_key, current_states
+            current_key = key
+            current_states = states
+        else:
+            merge_partials(current_states, states)
 
-            current_key = key  # Set the new key
+    if current_key is not None:
+        yield current_key, current_states
 
-        # Accumulate values for each column that needs aggregation
-        for col, val in zip(aggregations.keys(), values):
-            agg_data[col].append(val)
 
-    # Output the last key
-    if current_key:
-        results = [str(aggregation_funcs[func](agg_data[col])) for col, func in aggregations.items()]
-        print(f"{current_key}\t{','.join(results)}")
+def combiner(aggregations):
+    """
+    Merges the partial states of each key within a map task's sorted output.
+    """
+    counters = Counters('combiner')
+    for key, states in read_partials(aggregations, counters):
+        counters.emit(f"{key}\t{encode_partials(states)}")
+    counters.report()
 
 
+def order_field(order, projections, aggregations):
+    """
+    Returns a function that picks the ORDER BY value out of a reducer output
+    (key, results) pair. The ORDER BY column is either a grouped column or one
+    of the SELECT aggregations, e.g. SUM(fare).
+    """
+    column = order['column']
+    if column is None:
+        return lambda key, results: ''
+    if column in projections:
+        index = projections.index(column)
+        return lambda key, results: key.split(',')[index]
+    agg_match = re.match(r"(\w+)\((.*?)\)$", column)
+    if agg_match and parse_aggregation(agg_match.group(1), agg_match.group(2)) in aggregations:
+        index = aggregations.index(parse_aggregation(agg_match.group(1), agg_match.group(2)))
+        return lambda key, results: results[index]
+    raise ValueError(f"Unknown ORDER BY column: {column}")
+
+
+def reducer(aggregations, order=None, projections=(), ranged=False):
+    """
+    Merges every partial state of a key into one accumulator per aggregation as
+    lines arrive, so memory per key stays constant however many rows it has.
+    With ORDER BY ... LIMIT (see top_n.py) only the first `limit` groups are
+    kept and written in order, which needs a single reducer. `ranged` strips
+    the range tokens of a range partitioned job from the keys.
+    """
+    counters = Counters('reducer')
+    skip = TOKEN_WIDTH if ranged else 0
+    groups = ((key[skip:], states) for key, states in read_partials(aggregations, counters))
+    for key, results in group_results(groups, aggregations, order, projections):
+        counters.emit(f"{key}\t{','.join(results)}")
+    counters.report()
+
+
+def group_results(groups, aggregations, order=None, projections=()):
+    """
+    Turns (key, merged states) pairs into (key, result texts) pairs, keeping
+    only the first `limit` groups in order with ORDER BY ... LIMIT.
+    """
+    groups = ((key, [str(state.result()) for state in states]) for key, states in groups)
+    if order is not None:
+        field = order_field(order, projections, aggregations)
+        groups = top_n(groups, order, lambda group: field(*group))
+    return groups
+
 
 if __name__ == "__main__":
     if len(sys.argv) < 3:
-        print("Usage: python projection.py <SQL statement> <mapper|reducer>")
+        print("Usage: python groupby.py <SQL statement> <mapper|combiner|reducer> [columnar_file|-] [partition_file]")
         sys.exit(1)
 
     # Get the SQL statement from the command line argument
@@ -158,11 +353,18 @@ if __name__ == "__main__":
 
     where_clause, projections, table, group_by, aggregations = parse_sql(sql_statement)
 
+    # '-' reads CSV from stdin; a partition file turns on range partitioning
+    source = sys.argv[3] if len(sys.argv) > 3 and sys.argv[3] != '-' else None
+    partition_file = sys.argv[4] if len(sys.argv) > 4 else None
+
     # Determine whether to run mapper or reducer
     if sys.argv[2] == 'mapper':
-        mapper(where_clause, projections, table, group_by, aggregations)
+        mapper(where_clause, projections, table, group_by, aggregations, source=source,
+               router=RangeRouter(partition_file) if partition_file else None)
+    elif sys.argv[2] == 'combiner':
+        combiner(aggregations)
     elif sys.argv[2] == 'reducer':
-        reducer()
+        reducer(aggregations, parse_order_by(sql_statement), projections, ranged=partition_file is not None)
     else:
-        print("Invalid argument. Use 'mapper' or 'reducer'.")
+        print("Invalid argument. Use 'mapper', 'combiner' or 'reducer'.")
 
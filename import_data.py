@@ -1,9 +1,26 @@
 import subprocess
-import csv
 import sys
+from bulk_load import LOAD_WORKERS, bulk_load
+from schema import SCHEMA_FILE
 
-def import_data(file_path, hdfs_path):
+def import_data(file_path, hdfs_path, workers=LOAD_WORKERS, columnar=False):
+    """
+    Uploads a file to HDFS. A CSV file goes through the bulk loader (see
+    bulk_load.py): it is uploaded in parallel chunks, each with its zone map
+    (see zone_maps.py), and its schema is registered in schemas.json (see
+    schema.py). An interrupted CSV import resumes when it is run again.
+    :param file_path: Path to the local file (a CSV file contains headers on the first line).
+    :param hdfs_path: Destination HDFS path, or file://<dir> for a local directory.
+    :param workers: Number of chunks uploaded at a time.
+    :param columnar: Convert the chunks of a CSV file to the columnar format (see columnar.py).
+    """
     try:
+        if file_path.endswith('.csv'):
+            schema = bulk_load(file_path, hdfs_path, workers, columnar=columnar)
+            print(f"Schema saved to {SCHEMA_FILE}: " +
+                  ', '.join(f"{column} {kind}" for column, kind in zip(schema['columns'], schema['types'])))
+            return
+
         command = ["hadoop", "fs", "-put", file_path, hdfs_path]
 
         result = subprocess.run(command, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
@@ -12,37 +29,32 @@ def import_data(file_path, hdfs_path):
             print(f"Data imported successfully to {hdfs_path}")
         else:
             print(f"Failed to import data: {result.stderr.decode('utf-8')}")
-    except subprocess.CalledProcessError as e:
+    except (subprocess.CalledProcessError, OSError) as e:
         print(f"Error occurred: {e}")
 
 
-def extract_headers_and_save(data_file, output_csv):
+def import_columnar(file_path, hdfs_path, workers=LOAD_WORKERS):
     """
-    Extract headers from the first line of the data file and save it as a CSV file.
-    :param data_file: Path to the input data file (containing headers on the first line).
-    :param output_csv: Path to the output CSV file to save the headers.
+    Uploads a CSV file converted to the columnar format (see columnar.py).
+    Every chunk is converted by the worker that uploads it and stored with a
+    .hcol extension.
+    :param file_path: Path to the local CSV file (containing headers on the first line).
+    :param hdfs_path: Destination HDFS path.
+    :param workers: Number of chunks converted and uploaded at a time.
     """
-    # Open the input data file
-    with open(data_file, 'r') as f:
-        # Read the first line as the headers
-        headers = f.readline().strip().split(',')
-    
-    # Save headers to the output CSV file
-    with open(output_csv, 'w', newline='') as f:
-        writer = csv.writer(f)
-        writer.writerow(headers)
-    
-    print(f"Headers extracted and saved to {output_csv}: {headers}")
+    import_data(file_path, hdfs_path, workers, columnar=True)
+
 
 if __name__ == "__main__":
-    if len(sys.argv) != 3:
-        print("Usage: python import_data.py <data_file> <hdfs_path>")
+    if len(sys.argv) not in (3, 4, 5):
+        print("Usage: python import_data.py <data_file> <hdfs_path> [columnar] [workers]")
         sys.exit(1)
 
     data_file = sys.argv[1]
     hdfs_path = sys.argv[2]
+    workers = int(sys.argv[4]) if len(sys.argv) == 5 else LOAD_WORKERS
 
-    extract_headers_and_save(data_file, hdfs_path)
-    # import_data("headers.csv", hdfs_path)
-
-
+    if len(sys.argv) >= 4 and sys.argv[3] == 'columnar':
+        import_columnar(data_file, hdfs_path, workers)
+    else:
+        import_data(data_file, hdfs_path, workers)
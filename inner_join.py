@@ -2,6 +2,23 @@
 import re
 import sys
 import os
+import random
+import tempfile
+from collections import Counter
+from counters import Counters
+from predicate import And, conjuncts, parse_where, rename_columns
+from schema import table_of_file, table_schema
+
+# Hot keys are spread over this many reducers by appending a salt to the key
+SALT_SEPARATOR = '\x1f'
+# Separates the shipped values of a row; unlike a comma it cannot occur in a field
+VALUE_SEPARATOR = '\x1e'
+# A key is hot when it holds at least this share of the sampled rows
+HOT_KEY_SHARE = 0.01
+# Sampled rows below which no key is called hot, since a repeat is then likely chance
+HOT_KEY_MIN_SAMPLE = 1000
+# Bytes of one side's rows the reducer buffers for a key before spilling them to disk
+SPILL_BYTES = 64 * 1024 * 1024
 
 def parse_sql_inner_join(sql_statement):
     """
@@ -46,91 +63,424 @@ def parse_sql_inner_join(sql_statement):
     }
 
 
-def mapper(file_type):
+def plan_join(parsed, headers, types=None):
+    """
+    Turns the output of parse_sql_inner_join into the work each side of the join does.
+    Join columns are resolved by header name, single-table WHERE conditions are
+    pushed down to that table's mapper, and each mapper ships only the columns
+    needed for the projection and for conditions that span both tables.
+    Args:
+        parsed (dict): Output of parse_sql_inner_join, plus a 'where' condition or None.
+        headers (dict): Table name -> column names.
+        types (dict): Optional table name -> column types (see schema.py).
+    Returns:
+        dict: 'tables' (the two table names), 'sides' (per table: key_index,
+        columns, predicate), 'shipped' (number of shipped columns per side),
+        'output' (per projected column: side and position in that side's
+        shipped columns) and 'residual' (compiled condition over both sides'
+        shipped columns, or None).
+    """
+    tables = [parsed['table1'], parsed['table2']]
+    if tables[0] == tables[1]:
+        raise ValueError("Self joins are not supported")
+
+    def resolve(reference):
+        if '.' in reference:
+            table, column = reference.split('.', 1)
+            if table not in tables:
+                raise ValueError(f"Unknown table in column reference: {reference}")
+            if column not in headers[table]:
+                raise ValueError(f"Unknown column: {reference}")
+            return table, column
+        owners = [table for table in tables if reference in headers[table]]
+        if not owners:
+            raise ValueError(f"Unknown column: {reference}")
+        if len(owners) > 1:
+            raise ValueError(f"Ambiguous column, qualify it with a table name: {reference}")
+        return owners[0], reference
+
+    sides = {table: {'key_index': None, 'columns': [], 'predicate': None} for table in tables}
+    for reference in (parsed['join_condition']['left'], parsed['join_condition']['right']):
+        table, column = resolve(reference)
+        sides[table]['key_index'] = headers[table].index(column)
+    if any(side['key_index'] is None for side in sides.values()):
+        raise ValueError("The join condition must compare a column of each table")
+
+    def ship(table, column):
+        index = headers[table].index(column)
+        if index not in sides[table]['columns']:
+            sides[table]['columns'].append(index)
+        return sides[table]['columns'].index(index)
+
+    output = []
+    for projection in parsed['projections']:
+        if projection == '*':
+            for side, table in enumerate(tables):
+                output.extend((side, ship(table, column)) for column in headers[table])
+            continue
+        if projection.endswith('.*'):
+            table = projection[:-2]
+            output.extend((tables.index(table), ship(table, column)) for column in headers[table])
+            continue
+        table, column = resolve(projection)
+        output.append((tables.index(table), ship(table, column)))
+
+    # Push conditions on a single table down to its mapper
+    pushed = {table: [] for table in tables}
+    residual = []
+    for condition in conjuncts(parsed['where']) if parsed['where'] is not None else []:
+        references = {reference: resolve(reference) for reference in condition.columns()}
+        owners = {table for table, _ in references.values()}
+        if len(owners) == 1:
+            rename_columns(condition, {reference: column for reference, (_, column) in references.items()})
+            pushed[owners.pop()].append(condition)
+        else:
+            rename_columns(condition, {reference: f"{table}.{column}" for reference, (table, column) in references.items()})
+            for table, column in references.values():
+                ship(table, column)
+            residual.append(condition)
+
+    for table in tables:
+        if pushed[table]:
+            condition = pushed[table][0] if len(pushed[table]) == 1 else And(pushed[table])
+            sides[table]['predicate'] = condition.compile(headers[table], types[table] if types else None)
+
+    residual_predicate = None
+    if residual:
+        shipped_names = [f"{table}.{headers[table][i]}" for table in tables for i in sides[table]['columns']]
+        shipped_types = [types[table][i] for table in tables for i in sides[table]['columns']] if types else None
+        condition = residual[0] if len(residual) == 1 else And(residual)
+        residual_predicate = condition.compile(shipped_names, shipped_types)
+
+    return {
+        'tables': tables,
+        'sides': sides,
+        'shipped': tuple(len(sides[table]['columns']) for table in tables),
+        'output': output,
+        'residual': residual_predicate,
+    }
+
+
+def load_plan(sql_statement):
+    """
+    Parses a join statement and plans it against the tables' entries in the
+    schema registry (see schema.py), which -files ships to the tasks.
+    Returns:
+        tuple: The plan and {table: schema}.
+    """
+    parsed = parse_sql_inner_join(sql_statement)
+    parsed['where'] = parse_where(sql_statement)
+    schemas = {table: table_schema(table) for table in (parsed['table1'], parsed['table2'])}
+    headers = {table: schema['columns'] for table, schema in schemas.items()}
+    types = {table: schema['types'] for table, schema in schemas.items()}
+    return plan_join(parsed, headers, types), schemas
+
+
+def read_side(plan, schemas, table, stream, counters=None):
+    """
+    Yields (join key, shipped values) for the rows of one table that pass its
+    pushed-down conditions, skipping the header line.
+    """
+    counters = counters if counters is not None else Counters('mapper')
+    side = plan['sides'][table]
+    key_index = side['key_index']
+    columns = side['columns']
+    predicate = counters.predicate(side['predicate']) if side['predicate'] is not None else None
+    header_line, delimiter = schemas[table]['header'], schemas[table]['delimiter']
+    lines = (line.strip() for line in counters.lines(stream))
+    for fields in counters.rows(line.split(delimiter) for line in lines if line and line != header_line):
+        try:
+            if predicate is not None and not predicate(fields):
+                continue
+            yield fields[key_index], VALUE_SEPARATOR.join([fields[i] for i in columns])
+        except (IndexError, ValueError):
+            counters.parse_errors += 1
+            continue  # Skip rows with missing fields or values that do not fit the column type
+
+
+def emit_joined(plan, key, left, right, counters):
+    """
+    Prints one joined row in projection order, if it passes the conditions
+    that span both tables.
+    """
+    left_count, right_count = plan['shipped']
+    values = (left.split(VALUE_SEPARATOR) if left_count else [], right.split(VALUE_SEPARATOR) if right_count else [])
+    try:
+        passed = plan['residual'] is None or plan['residual'](values[0] + values[1])
+    except ValueError:
+        counters.parse_errors += 1
+        return
+    if not passed:
+        counters.rows_filtered += 1
+        return
+    counters.emit(f"{key}\t{','.join([values[side][i] for side, i in plan['output']])}")
+
+
+def input_table():
+    """
+    Returns the table a Hadoop map task reads, from the name of its input file
+    (e.g. hdfs://.../views.csv -> views, and for a bulk-loaded table
+    hdfs://.../views.csv/views.00001.csv -> views).
+    """
+    input_file = os.environ.get('mapreduce_map_input_file') or os.environ.get('map_input_file')
+    if not input_file:
+        raise ValueError("No table given and mapreduce_map_input_file is not set")
+    return table_of_file(input_file)
+
+
+def mapper(sql_statement, table=None, small_table=None, hot_keys=None, salts=1):
     """
     Mapper function for inner join.
-    This function determines whether the line is from 'views' or 'carts' dynamically.
+    Rows of `table` are keyed on the join column from the SQL statement and
+    tagged with the table name; only the columns the query needs are shipped.
+    The table defaults to the one named by the task's input file.
+    Each key is followed by a sort tag, 0 for the small table and 1 for the
+    other, so that within a key the small table's rows reach the reducer first.
+    Rows with a hot key are salted so the key is spread over `salts` reducers:
+    the large side sends each row to one salt, round robin, and the small side
+    sends a copy of each row to every salt.
     """
-    # Get the input file name from the environment variable
-    for line in sys.stdin:
+    plan, schemas = load_plan(sql_statement)
+    table = table or input_table()
+    if table not in plan['tables']:
+        raise ValueError(f"Table {table} is not part of the join")
+    small_table = small_table or plan['tables'][1]
+    order = 0 if table == small_table else 1
+    hot_keys = hot_keys or set()
+    next_salt = random.randrange(salts)
+    counters = Counters('mapper')
+    for key, values in read_side(plan, schemas, table, sys.stdin, counters):
+        if key in hot_keys:
+            if table == small_table:
+                for salt in range(salts):
+                    counters.emit(f"{key}{SALT_SEPARATOR}{salt}\t{order}\t{table},{values}")
+            else:
+                counters.emit(f"{key}{SALT_SEPARATOR}{next_salt}\t{order}\t{table},{values}")
+                next_salt = (next_salt + 1) % salts
+            continue
+
+        counters.emit(f"{key}\t{order}\t{table},{values}")
+    counters.report()
+
+
+def sample_hot_keys(sql_statement, table, fraction):
+    """
+    Samples a fraction of the rows of `table` on stdin and prints how often
+    each join key occurs in the sample, as `key\tcount` lines.
+    Run as a map-only job, each task counts its own split; hot_keys() merges
+    the counts of all tasks before deciding which keys are hot.
+    """
+    plan, schemas = load_plan(sql_statement)
+    key_index = plan['sides'][table]['key_index']
+    header_line, delimiter = schemas[table]['header'], schemas[table]['delimiter']
+    counts = Counter()
+    counters = Counters('mapper')
+    for line in counters.rows(counters.lines(sys.stdin)):
         line = line.strip()
-        if not line:
+        if not line or line == header_line or random.random() >= fraction:
+            continue
+        fields = line.split(delimiter)
+        if len(fields) <= key_index:
+            counters.parse_errors += 1
+            continue
+        counts[fields[key_index]] += 1
+    for key, count in counts.items():
+        counters.emit(f"{key}\t{count}")
+    counters.report()
+
+
+def hot_keys(lines, min_share=HOT_KEY_SHARE, min_sample=HOT_KEY_MIN_SAMPLE):
+    """
+    Merges the `key\tcount` lines of the sampling tasks and returns the keys
+    that hold at least `min_share` of the whole sample, sorted. A sample of
+    fewer than `min_sample` rows has no hot keys.
+    """
+    counts = Counter()
+    for line in lines:
+        key, _, count = line.rstrip('\n').rpartition('\t')
+        if key:
+            counts[key] += int(count)
+    sampled = sum(counts.values())
+    if sampled < min_sample:
+        return []
+    return sorted(key for key, count in counts.items() if count >= min_share * sampled)
+
+
+def load_hot_keys(path):
+    with open(path, 'r') as f:
+        return {line.strip() for line in f if line.strip()}
+
+
+class SpillBuffer:
+    """
+    Buffers one side's rows for a key in memory, moving them to a temporary
+    file once they pass `max_bytes`.
+    """
+
+    def __init__(self, max_bytes=SPILL_BYTES):
+        self.max_bytes = max_bytes
+        self.rows = []
+        self.size = 0
+        self.file = None
+        self.spills = 0
+
+    def append(self, row):
+        if self.file is not None:
+            self.file.write(row + '\n')
+            return
+        self.rows.append(row)
+        self.size += len(row)
+        if self.size > self.max_bytes:
+            self.file = tempfile.TemporaryFile('w+')
+            self.file.writelines(r + '\n' for r in self.rows)
+            self.rows = []
+            self.spills += 1
+
+    def __iter__(self):
+        yield from self.rows
+        if self.file is not None:
+            self.file.seek(0)
+            for row in self.file:
+                yield row.rstrip('\n')
+            self.file.seek(0, os.SEEK_END)
+
+    def __bool__(self):
+        return bool(self.rows) or self.file is not None
+
+    def clear(self):
+        self.rows = []
+        self.size = 0
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+def load_hash_index(plan, schemas, table, path):
+    """
+    Loads a table into a hash index from join key to the table's shipped values.
+    Args:
+        path (str): Local path of the table, e.g. shipped to the task with -files:
+            its file, or the directory of chunks bulk_load.py loaded it into.
+    """
+    if os.path.isdir(path):
+        paths = sorted(os.path.join(path, name) for name in os.listdir(path)
+                       if name.endswith('.csv') and not name.startswith(('_', '.')))
+    else:
+        paths = [path]
+    index = {}
+    for file_path in paths:
+        with open(file_path, 'r') as f:
+            for key, values in read_side(plan, schemas, table, f):
+                index.setdefault(key, []).append(values)
+    return index
+
+
+def broadcast_mapper(sql_statement, small_table_path, small_table):
+    """
+    Map-side (broadcast) hash join.
+    The small table is loaded into memory once and the large table is streamed
+    from stdin and probed against it, so no sort, shuffle or reducer is needed.
+    Output has the same format as the reducer's.
+    Args:
+        small_table_path (str): Local path of the small table, a file or a
+            directory of chunks (see load_hash_index).
+        small_table (str): Name of the small table in the SQL statement.
+    """
+    plan, schemas = load_plan(sql_statement)
+    large_table = [table for table in plan['tables'] if table != small_table][0]
+    index = load_hash_index(plan, schemas, small_table, small_table_path)
+    small_is_left = plan['tables'][0] == small_table
+    counters = Counters('mapper')
+    for key, values in read_side(plan, schemas, large_table, sys.stdin, counters):
+        matches = index.get(key)
+        if matches is None:
             continue
-        
-        # Split the line into fields (assuming comma-delimited CSV)
-        fields = line.split(',')
-        
-        if file_type == 'views':
-            category_id = fields[1]  # Assuming 'category_id' is the second field in views
-            print(f"{category_id}\tviews,{','.join(fields)}")
-        elif file_type == 'carts':
-            category_id = fields[1]  # Assuming 'category_id' is the second field in carts
-            print(f"{category_id}\tcarts,{','.join(fields)}")
+        for match in matches:
+            if small_is_left:
+                emit_joined(plan, key, match, values, counters)
+            else:
+                emit_joined(plan, key, values, match, counters)
+    counters.report()
 
 
-def reducer():
+def reducer(sql_statement, spill_bytes=SPILL_BYTES):
     """
     Reducer function for inner join.
-    It performs the join between two datasets based on a shared key (category_id).
+    It performs the join between two datasets based on a shared key.
+    The input is sorted on key and then sort tag, so each key's rows from the
+    small table (tag 0) arrive before those from the other table (tag 1).
+    Only the small table's rows are buffered, spilling to a temporary file
+    past `spill_bytes`; the other table's rows are joined as they stream past.
+    Salts added by the mapper are removed from the output keys.
     """
-    current_category_id = None
-    views_data = []
-    carts_data = []
+    plan, _ = load_plan(sql_statement)
+    left_table = plan['tables'][0]
+    current_key = None
+    output_key = None
+    buffered = SpillBuffer(spill_bytes)
+    buffered_left = True
+    counters = Counters('reducer')
 
-    for line in sys.stdin:
+    for line in counters.rows(counters.lines(sys.stdin)):
         line = line.strip()
         if not line:
             continue
-        
-        # Split the line into key and value
-        category_id, value = line.split('\t', 1)
+
+        # Split the line into key, sort tag and value
+        key, tag, value = line.split('\t', 2)
         dataset_id, data = value.split(',', 1)
 
-        # If this is a new category_id, process the previous one
-        if current_category_id != category_id:
-            if current_category_id:
-                # Perform the join between views and carts on the previous category_id
-                for view in views_data:
-                    for cart in carts_data:
-                        print(f"{current_category_id}\t{view},{cart}")
-            
-            # Reset for new category_id
-            current_category_id = category_id
-            views_data = []
-            carts_data = []
-
-        # Add data to the respective dataset list
-        if dataset_id == "views":
-            views_data.append(data)
-        elif dataset_id == "carts":
-            carts_data.append(data)
-    
-    # Process the last category_id
-    if current_category_id:
-        for view in views_data:
-            for cart in carts_data:
-                print(f"{current_category_id}\t{view},{cart}")
+        # If this is a new key, drop the previous key's buffered rows
+        if current_key != key:
+            buffered.clear()
+            current_key = key
+            output_key = key.split(SALT_SEPARATOR, 1)[0]
+
+        if tag == '0':
+            buffered.append(data)
+            buffered_left = dataset_id == left_table
+        elif buffered:
+            for match in buffered:
+                if buffered_left:
+                    emit_joined(plan, output_key, match, data, counters)
+                else:
+                    emit_joined(plan, output_key, data, match, counters)
+
+    buffered.clear()
+    if buffered.spills:
+        print(f"Spilled {buffered.spills} keys to disk", file=sys.stderr)
+    counters.report()
 
 
 if __name__ == "__main__":
-    if len(sys.argv) > 2:
-        if sys.argv[1] == 'mapper':
-            mapper(sys.argv[2])  # Pass the file type ('views' or 'carts')
-        elif sys.argv[1] == 'reducer':
-            reducer()
-        else:
-            print("Invalid argument. Use 'mapper' or 'reducer'.", file=sys.stderr)
-    elif len(sys.argv) == 2:
-        # If only 'mapper' or 'reducer' is provided, use a default for the mapper
-        if sys.argv[1] == 'mapper':
-            mapper('views')  # Default to 'views' if no file type is provided
-        elif sys.argv[1] == 'reducer':
-            reducer()
+    if len(sys.argv) < 3:
+        print("Usage: python inner_join.py <SQL statement> <mapper|reducer|broadcast|sample> [arguments]", file=sys.stderr)
+        print("  mapper [<table>|auto] [<small table>] [<hot keys file> <salts>]", file=sys.stderr)
+        print("  reducer [<spill bytes>]", file=sys.stderr)
+        print("  broadcast <small table file> <small table>", file=sys.stderr)
+        print("  sample <table> <fraction>", file=sys.stderr)
+        sys.exit(1)
+
+    # Get the SQL statement from the command line argument
+    sql_statement = sys.argv[1]
+    mode = sys.argv[2]
+    args = sys.argv[3:]
+
+    print(f"SQL Statement Received: {sql_statement}", file=sys.stderr)  # Debugging line
+
+    if mode == 'mapper':
+        # 'auto' takes the table from the task's input file
+        table = args[0] if args and args[0] != 'auto' else None
+        small_table = args[1] if len(args) > 1 else None
+        if len(args) > 3:
+            mapper(sql_statement, table, small_table, load_hot_keys(args[2]), int(args[3]))
         else:
-            print("Invalid argument. Use 'mapper' or 'reducer'.", file=sys.stderr)
+            mapper(sql_statement, table, small_table)
+    elif mode == 'reducer':
+        reducer(sql_statement, int(args[0]) if args else SPILL_BYTES)
+    elif mode == 'broadcast' and len(args) >= 2:
+        broadcast_mapper(sql_statement, args[0], args[1])  # Pass the small table's path and name
+    elif mode == 'sample' and len(args) >= 2:
+        sample_hot_keys(sql_statement, args[0], float(args[1]))
     else:
-        # Default to reducer if no arguments provided and stdin is piped
-        if not sys.stdin.isatty():
-            reducer()
-        else:
-            print("No arguments provided. Use 'mapper' or 'reducer' and the file type.", file=sys.stderr)
+        print("Invalid argument. Use 'mapper', 'reducer', 'broadcast' or 'sample'.", file=sys.stderr)
@@ -0,0 +1,454 @@
+"""
+Local multi-core runner for the MapReduce operators.
+
+Runs the same mapper, combiner and reducer functions a Hadoop streaming job
+runs, without Hadoop and without a single-threaded `| sort |` pipeline:
+    1. Every input file is cut into byte-range splits aligned to line
+       boundaries, and each split is mapped in a worker process.
+    2. Map output is hash partitioned on its key (the text before the first
+       tab) and each partition is sorted with an external sort, and combined
+       when the operator has a combiner, into a run file compressed with the
+       spill codec.
+    3. Each partition's sorted map outputs are merged (see external_sort.py)
+       and streamed to a reducer, with the reducers also running in parallel.
+The operator modules are imported and their functions called directly; stdin
+and stdout are redirected around each call. Every map task sees the same
+mapreduce_map_input_* environment variables Hadoop streaming sets. Part files
+can be compressed with an output codec (see compress.py).
+"""
+import contextlib
+import io
+import itertools
+import os
+import sys
+import tempfile
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import filter as row_filter
+from compress import open_text, suffix
+from counters import COUNTERS_ENV, format_summary, load_counters
+from external_sort import SORT_FAN_IN, SORT_MEMORY_BYTES, SPILL_CODEC, ExternalSorter, SortStats, merge_runs, write_run
+import groupby
+import inner_join
+import projection
+import query
+from schema import register_file, table_of_file
+import secondary_index
+from top_n import parse_order_by
+
+# Task counters (see counters.py) are collected in this file of the output directory
+COUNTERS_FILE = '_counters.jsonl'
+# Size of the byte ranges the input files are split into
+SPLIT_BYTES = 64 * 1024 * 1024
+LOCAL_WORKERS = os.cpu_count() or 1
+
+OPERATIONS = ('query', 'projection', 'filter', 'groupby', 'groupby_state', 'join', 'index')
+
+
+def load_operation(operation, sql_statement, inputs):
+    """
+    Binds an operator's tasks to a SQL statement.
+    Args:
+        operation (str): One of OPERATIONS.
+        sql_statement (str): SQL statement for the operation.
+        inputs (list): Paths of the input files.
+    Returns:
+        dict: The 'mapper', 'combiner' (or None) and 'reducer' (None for a
+            map-only operation) callables and, optionally, 'reducers', a
+            reducer count the operation requires, and 'input_offsets', whether
+            the mapper reads each line's byte offset before it.
+    """
+    if operation == 'query':
+        plan = query.plan_query(sql_statement)
+        return {'mapper': partial(query.mapper, plan), 'reducers': query.reducer_count(plan),
+                'combiner': partial(query.combiner, plan) if plan['aggregations'] else None,
+                'reducer': partial(query.reducer, plan) if query.needs_reducer(plan) else None}
+    if operation == 'projection':
+        columns, table, distinct = projection.parse_sql(sql_statement)
+        return {'mapper': partial(projection.mapper, columns, None, distinct, table), 'combiner': None,
+                'reducer': projection.reducer if distinct else None}
+    if operation == 'filter':
+        filters, projections, table = row_filter.parse_sql(sql_statement)
+        order = parse_order_by(sql_statement)
+        return {'mapper': partial(row_filter.mapper, filters, projections, table, None, order), 'combiner': None,
+                'reducer': partial(row_filter.reducer, order),
+                'reducers': 1 if order else None}
+    if operation == 'groupby':
+        where_clause, projections, table, group_by, aggregations = groupby.parse_sql(sql_statement)
+        order = parse_order_by(sql_statement)
+        return {'mapper': partial(groupby.mapper, where_clause, projections, table, group_by, aggregations),
+                'combiner': partial(groupby.combiner, aggregations),
+                'reducer': partial(groupby.reducer, aggregations, order, projections),
+                'reducers': 1 if order else None}
+    if operation == 'groupby_state':
+        # Reducers write each group's merged partial states rather than its results (see materialized.py)
+        where_clause, projections, table, group_by, aggregations = groupby.parse_sql(sql_statement)
+        return {'mapper': partial(groupby.mapper, where_clause, projections, table, group_by, aggregations),
+                'combiner': partial(groupby.combiner, aggregations),
+                'reducer': partial(groupby.combiner, aggregations)}
+    if operation == 'join':
+        # The smaller table is the side the reducer buffers; a bulk-loaded table is the sum of its chunks
+        sizes = {}
+        for path in inputs:
+            table = table_of_file(path)
+            sizes[table] = sizes.get(table, 0) + os.path.getsize(path)
+        small_table = min(sizes, key=sizes.get)
+        return {'mapper': partial(inner_join.mapper, sql_statement, None, small_table), 'combiner': None,
+                'reducer': partial(inner_join.reducer, sql_statement)}
+    if operation == 'index':
+        # One reducer writes the whole index in key order
+        kind, table, column = secondary_index.parse_create_index(sql_statement)
+        return {'mapper': partial(secondary_index.mapper, kind, table, column), 'combiner': None,
+                'reducer': secondary_index.reducer, 'reducers': 1, 'input_offsets': True}
+    raise ValueError(f"Unknown operation: {operation}")
+
+
+def input_splits(path, split_bytes=SPLIT_BYTES, start=0, end=None):
+    """
+    Cuts a file, or its bytes from `start` (a line start) to `end`, into
+    (path, start, length) byte ranges of about `split_bytes`, each ending at
+    a line boundary.
+    """
+    size = os.path.getsize(path) if end is None else end
+    splits = []
+    with open(path, 'rb') as f:
+        while start < size:
+            f.seek(min(start + split_bytes, size))
+            f.readline()
+            split_end = min(f.tell(), size)
+            splits.append((path, start, split_end - start))
+            start = split_end
+    return splits
+
+
+def partition(key, num_partitions):
+    """
+    Returns the partition of a key. crc32 is used rather than hash(), which is
+    salted differently in every process.
+    """
+    return zlib.crc32(key.encode('utf-8')) % num_partitions
+
+
+class LineWriter(io.TextIOBase):
+    """
+    Text stream that hands every complete line written to it to `emit`.
+    """
+
+    def __init__(self, emit):
+        self.emit = emit
+        self.pending = []
+
+    def write(self, text):
+        if '\n' not in text:
+            self.pending.append(text)
+            return len(text)
+        lines = text.split('\n')
+        self.pending.append(lines[0])
+        self.emit(''.join(self.pending) + '\n')
+        for line in lines[1:-1]:
+            self.emit(line + '\n')
+        self.pending = [lines[-1]] if lines[-1] else []
+        return len(text)
+
+    def flush(self):
+        if self.pending:
+            self.emit(''.join(self.pending) + '\n')
+            self.pending = []
+
+
+def run_task(task, stdin, stdout):
+    """
+    Runs an operator function with `stdin` (bytes or an iterable of lines) as
+    its input, writing what it prints to `stdout`.
+    """
+    if isinstance(stdin, bytes):
+        stdin = io.TextIOWrapper(io.BytesIO(stdin), encoding='utf-8')
+    saved_stdin = sys.stdin
+    sys.stdin = stdin
+    try:
+        with contextlib.redirect_stdout(stdout):
+            task()
+        stdout.flush()
+    finally:
+        sys.stdin = saved_stdin
+
+
+def wall_seconds(intervals):
+    """
+    Returns the seconds covered by at least one of the (start, end) intervals,
+    i.e. the wall time of a phase whose tasks ran in parallel.
+    """
+    total = 0.0
+    covered = None
+    for start, end in sorted(intervals):
+        if covered is None or start > covered:
+            total += end - start
+            covered = end
+        elif end > covered:
+            total += end - covered
+            covered = end
+    return total
+
+
+def read_split(split, offsets=False):
+    """
+    Reads an input split and sets the mapreduce_map_input_* variables for it.
+    As under Hadoop, only the first split of a file holds its header line.
+    With `offsets`, every line is prefixed with its byte offset in the file
+    and a tab, as Hadoop streaming does when stream.map.input.ignoreKey is false.
+    """
+    path, start, length = split
+    with open(path, 'rb') as f:
+        f.seek(start)
+        data = f.read(length)
+    if offsets:
+        lines = []
+        offset = start
+        for raw in io.BytesIO(data):
+            lines.append(b'%d\t%s\n' % (offset, raw.rstrip(b'\r\n')))
+            offset += len(raw)
+        data = b''.join(lines)
+
+    os.environ['mapreduce_map_input_file'] = path
+    os.environ['mapreduce_map_input_start'] = str(start)
+    os.environ['mapreduce_map_input_length'] = str(length)
+    return data
+
+
+def map_only_task(operation, sql_statement, inputs, split, output_path, output_codec='none'):
+    """
+    Maps one input split of a map-only operation straight into `output_path`.
+    Returns:
+        tuple: The output path and the task's (start, end) time per phase.
+    """
+    start = time.time()
+    tasks = load_operation(operation, sql_statement, inputs)
+    data = read_split(split, tasks.get('input_offsets', False))
+    with open_text(output_path, 'wt', output_codec) as out:
+        run_task(tasks['mapper'], data, out)
+    return output_path, {'map': (start, time.time())}
+
+
+def map_task(operation, sql_statement, inputs, split, num_partitions, work_dir, task_id,
+             memory_bytes=SORT_MEMORY_BYTES, fan_in=SORT_FAN_IN, spill_codec=SPILL_CODEC):
+    """
+    Maps one input split and writes its output as one sorted, compressed run
+    file per partition. The partitions share a sort budget of `memory_bytes`.
+    Returns:
+        tuple: The partition file paths, indexed by partition, the SortStats,
+            and the task's (start, end) time per phase: 'map' for the mapper,
+            which includes spilling, and 'sort' for the final sort, combine
+            and write.
+    """
+    start = time.time()
+    tasks = load_operation(operation, sql_statement, inputs)
+    data = read_split(split, tasks.get('input_offsets', False))
+
+    stats = SortStats()
+    with contextlib.ExitStack() as stack:
+        sorters = [stack.enter_context(ExternalSorter(work_dir, memory_bytes // num_partitions, fan_in, spill_codec))
+                   for _ in range(num_partitions)]
+
+        def emit(line):
+            if line.strip():
+                sorters[partition(line.split('\t', 1)[0].rstrip('\n'), num_partitions)].add(line)
+
+        run_task(tasks['mapper'], data, LineWriter(emit))
+        mapped = time.time()
+
+        paths = []
+        for number, sorter in enumerate(sorters):
+            partition_path = os.path.join(work_dir, f"map-{task_id:05d}-{number:05d}{suffix(spill_codec)}")
+            lines = sorter.sorted()
+            if tasks['combiner'] is not None:
+                # The combiner emits one line per key in input order, so its output stays sorted
+                output = io.StringIO()
+                run_task(tasks['combiner'], lines, output)
+                lines = output.getvalue().splitlines(keepends=True)
+            write_run(lines, partition_path, spill_codec)
+            paths.append(partition_path)
+            stats.add(sorter.stats)
+    return paths, stats, {'map': (start, mapped), 'sort': (mapped, time.time())}
+
+
+def reduce_task(operation, sql_statement, inputs, partition_paths, output_path, work_dir,
+                fan_in=SORT_FAN_IN, spill_codec=SPILL_CODEC, output_codec='none'):
+    """
+    Merges the sorted map outputs of one partition and streams them through
+    the reducer into `output_path`.
+    Returns:
+        tuple: The SortStats of the intermediate merge passes needed for the
+            partition, and the task's (start, end) time per phase: 'sort' for
+            the merge passes up to the first merged line and 'reduce' for the
+            rest, in which the last merge pass feeds the reducer, as in Hadoop.
+    """
+    start = time.time()
+    tasks = load_operation(operation, sql_statement, inputs)
+    stats = SortStats()
+    with tempfile.TemporaryDirectory(dir=work_dir) as merge_dir, open_text(output_path, 'wt', output_codec) as out:
+        merged = merge_runs(partition_paths, merge_dir, fan_in, stats, spill_codec)
+        first = next(merged, None)
+        sorted_at = time.time()
+        run_task(tasks['reducer'], itertools.chain([first] if first is not None else [], merged), out)
+    return stats, {'sort': (start, sorted_at), 'reduce': (sorted_at, time.time())}
+
+
+def register_tables(inputs):
+    """
+    Registers each input in the schema registry of the working directory (see
+    schema.py), as the table named after its file, for the tasks to read. The
+    chunks of a bulk-loaded table are left to the table's entry.
+    """
+    for path in inputs:
+        if table_of_file(path) == os.path.splitext(os.path.basename(path))[0]:
+            register_file(path)
+
+
+def index_task(sql_statement, inputs, output_path, output_codec='none'):
+    """
+    Answers a filter statement from a secondary index of its table (see
+    secondary_index.py) into `output_path`, when one applies.
+    Returns:
+        bool: Whether the index answered the statement.
+    """
+    filters, projections, table = row_filter.parse_sql(sql_statement)
+    with open_text(output_path, 'wt', output_codec) as out, contextlib.redirect_stdout(out):
+        answered = row_filter.index_scan(filters, projections, table, parse_order_by(sql_statement),
+                                         partial(secondary_index.local_fingerprint, inputs))
+    if not answered:
+        os.remove(output_path)
+    return answered
+
+
+def run_local(operation, sql_statement, inputs, output_dir, workers=LOCAL_WORKERS,
+              num_reducers=None, split_bytes=SPLIT_BYTES, memory_bytes=SORT_MEMORY_BYTES,
+              fan_in=SORT_FAN_IN, spill_codec=SPILL_CODEC, output_codec='none', phase_seconds=None,
+              task_seconds=None, job_counters=None, splits=None):
+    """
+    Runs an operation over local files with a pool of worker processes.
+    Args:
+        operation (str): One of OPERATIONS.
+        sql_statement (str): SQL statement for the operation.
+        inputs (list): Paths of the input files.
+        output_dir (str): Directory the part-NNNNN output files are written to.
+        workers (int): Number of worker processes.
+        num_reducers (int): Number of partitions and reduce tasks; defaults to `workers`.
+        split_bytes (int): Approximate size of each map task's input.
+        memory_bytes (int): Sort budget of each map task before it spills to disk.
+        fan_in (int): Largest number of sorted runs merged at once.
+        spill_codec (str): Codec of the map output and sort runs, a name in
+            compress.LOCAL_CODECS.
+        output_codec (str): Codec of the part files.
+        phase_seconds (dict): When given, receives the wall seconds of the
+            'map', 'sort' and 'reduce' phases: the time during which at least
+            one task was in the phase. The phases of parallel tasks overlap,
+            so they may add up to more than the run.
+        task_seconds (dict): When given, receives the seconds the tasks spent
+            in each phase, summed over tasks.
+        job_counters (dict): When given, receives the task counters summed per
+            stage, as also written per task to <output_dir>/_counters.jsonl.
+        splits (list): The (path, start, length) ranges of the inputs to map,
+            when not all of their bytes; see input_splits().
+    Returns:
+        list: The output file paths.
+    """
+    num_reducers = num_reducers or workers
+    intervals = {'map': [], 'sort': [], 'reduce': []}
+
+    def add_intervals(times):
+        for phase, interval in times.items():
+            intervals[phase].append(interval)
+
+    def report_seconds():
+        for phase, phase_intervals in intervals.items():
+            if phase_seconds is not None:
+                phase_seconds[phase] = wall_seconds(phase_intervals)
+            if task_seconds is not None:
+                task_seconds[phase] = sum(end - start for start, end in phase_intervals)
+
+    register_tables(inputs)
+    os.makedirs(output_dir, exist_ok=True)
+    if operation == 'filter':
+        output_path = os.path.join(output_dir, f"part-00000{suffix(output_codec)}")
+        if index_task(sql_statement, inputs, output_path, output_codec):
+            report_seconds()
+            return [output_path]
+    if splits is None:
+        splits = [split for path in inputs for split in input_splits(path, split_bytes)]
+    counters_path = os.path.abspath(os.path.join(output_dir, COUNTERS_FILE))
+    if os.path.exists(counters_path):
+        os.remove(counters_path)
+    # The workers' tasks append their counters to the file
+    pool_args = {'initializer': set_counters_file, 'initargs': (counters_path,)}
+
+    tasks = load_operation(operation, sql_statement, inputs)
+    num_reducers = tasks.get('reducers') or num_reducers
+    if tasks['reducer'] is None:
+        outputs = [os.path.join(output_dir, f"part-m-{task_id:05d}{suffix(output_codec)}")
+                   for task_id in range(len(splits))]
+        with ProcessPoolExecutor(workers, **pool_args) as pool:
+            futures = [pool.submit(map_only_task, operation, sql_statement, inputs, split, output_path, output_codec)
+                       for split, output_path in zip(splits, outputs)]
+            for future in futures:
+                add_intervals(future.result()[1])
+        report_seconds()
+        report_counters(counters_path, job_counters)
+        return outputs
+
+    outputs = [os.path.join(output_dir, f"part-{number:05d}{suffix(output_codec)}") for number in range(num_reducers)]
+
+    sort_stats = SortStats()
+    with tempfile.TemporaryDirectory() as work_dir, ProcessPoolExecutor(workers, **pool_args) as pool:
+        map_futures = [pool.submit(map_task, operation, sql_statement, inputs, split,
+                                   num_reducers, work_dir, task_id, memory_bytes, fan_in, spill_codec)
+                       for task_id, split in enumerate(splits)]
+        map_outputs = []
+        for future in map_futures:
+            paths, stats, times = future.result()
+            map_outputs.append(paths)
+            sort_stats.add(stats)
+            add_intervals(times)
+
+        reduce_futures = [pool.submit(reduce_task, operation, sql_statement, inputs,
+                                      [paths[number] for paths in map_outputs],
+                                      outputs[number], work_dir, fan_in, spill_codec, output_codec)
+                          for number in range(num_reducers)]
+        for future in reduce_futures:
+            stats, times = future.result()
+            sort_stats.add(stats)
+            add_intervals(times)
+
+    report_seconds()
+    sort_stats.report('Shuffle sort')
+    report_counters(counters_path, job_counters)
+    return outputs
+
+
+def set_counters_file(path):
+    os.environ[COUNTERS_ENV] = path
+
+
+def report_counters(counters_path, job_counters=None):
+    """
+    Sums the task counters of a run, prints them per stage on stderr and
+    copies them into `job_counters` when it is given.
+    """
+    totals = load_counters(counters_path)
+    print(format_summary(totals), file=sys.stderr)
+    if job_counters is not None:
+        job_counters.update(totals)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 5 or sys.argv[1] not in OPERATIONS:
+        print("Usage: python local_runner.py <query|projection|filter|groupby|groupby_state|join|index> <SQL statement> <output dir> <input file> [<input file> ...]")
+        sys.exit(1)
+
+    outputs = run_local(sys.argv[1], sys.argv[2], sys.argv[4:], sys.argv[3])
+    if sys.argv[1] == 'index':
+        with open(outputs[0], 'r') as f:
+            secondary_index.save_index(sys.argv[2], f, secondary_index.local_fingerprint(sys.argv[4:]))
+    print(f"Wrote {len(outputs)} output files to {sys.argv[3]}", file=sys.stderr)
@@ -1,6 +1,44 @@
+import contextlib
+import shlex
 import subprocess
 import sys
 import os
+from bulk_load import bulk_load
+from compress import job_properties
+from counters import format_summary, parse_job_counters
+from inner_join import hot_keys, parse_sql_inner_join
+from query_cache import cache_entry, load_result, store_result
+from query import needs_reducer, plan_query, range_partitioned, reducer_count
+from partitioning import PARTITIONER_OPTIONS, plan_reducers, write_partition_file
+from top_n import parse_order_by
+from filter import index_scan, parse_sql as parse_filter
+from materialized import load_view, plan_refresh, refresh
+from secondary_index import parse_create_index, read_range, save_index
+from schema import SCHEMA_FILE, SCHEMA_SAMPLE_ROWS, infer_schema, load_registry, register
+
+STREAMING_JAR = "/home/hadoop/hadoop/share/hadoop/tools/lib/hadoop-streaming-3.3.6.jar"
+
+# Tables whose hash table is estimated to take at most this much memory are
+# broadcast to the mappers for a map-side join (see table_memory_bytes)
+BROADCAST_JOIN_BYTES = 64 * 1024 * 1024
+# Bytes of text per byte stored, by file extension: compressed files take
+# several times their size once read back as CSV rows
+TEXT_EXPANSION = {'.gz': 4.0, '.deflate': 4.0, '.bz2': 5.0, '.xz': 5.0, '.zst': 4.0, '.snappy': 2.5, '.lz4': 2.5}
+# Memory a row takes in the broadcast hash table beyond its text: the key, and
+# the list and string objects of the row
+HASH_ROW_BYTES = 200
+# Lines read to measure the average row width of a table
+WIDTH_SAMPLE_ROWS = 1000
+# Number of reducers of a reduce-side join; hot keys are salted across all of them
+JOIN_REDUCERS = 8
+# Fraction of the large join table sampled to find hot keys
+JOIN_SAMPLE_FRACTION = 0.01
+# Fraction of the input sampled to plan the reducers of an aggregate query
+QUERY_SAMPLE_FRACTION = 0.01
+# Codecs (see compress.py) of the map output, which is what the shuffle carries,
+# and of the job output; None leaves the data uncompressed
+MAP_OUTPUT_CODEC = 'snappy'
+OUTPUT_CODEC = 'gzip'
 
 # Function to run a bash command via subprocess
 def run_bash_command(command):
@@ -16,89 +54,582 @@ def run_bash_command(command):
         sys.exit(1)
 
 
+def run_job(command):
+    """
+    Runs a Hadoop streaming job, echoing its log, and prints a per-stage
+    summary of the task counters (see counters.py) listed at the end of it.
+    Args:
+        command (str): The streaming command.
+    Returns:
+        dict: The counters summed per stage.
+    """
+    log = []
+    with subprocess.Popen(command, shell=True, stderr=subprocess.PIPE, text=True) as job:
+        for line in job.stderr:
+            sys.stderr.write(line)
+            log.append(line)
+    if job.returncode != 0:
+        print(f"Error running command: {command}")
+        sys.exit(1)
+
+    totals = parse_job_counters(log)
+    if totals:
+        print("Task counters:")
+        print(format_summary(totals))
+    return totals
+
+
 def upload_to_hadoop(local_path, hadoop_path):
     """
     Uploads a file or directory to Hadoop HDFS.
+    CSV files go through the bulk loader (see bulk_load.py), which uploads
+    them in parallel chunks with their zone maps and registers their schemas;
+    a directory's other files are uploaded as they are.
     Args:
         local_path (str): The local path to the file or directory.
         hadoop_path (str): The destination HDFS path.
     """
-    command = f"hadoop fs -put {local_path} {hadoop_path}"
     print(f"Uploading {local_path} to {hadoop_path}...")
     run_bash_command(f"hadoop fs -mkdir -p {hadoop_path}")
-    run_bash_command(command)
+    if os.path.isdir(local_path):
+        # Like hadoop fs -put, a directory is uploaded into a directory of the same name
+        destination = f"{hadoop_path}/{os.path.basename(os.path.normpath(local_path))}"
+        run_bash_command(f"hadoop fs -mkdir -p {destination}")
+        for name in sorted(os.listdir(local_path)):
+            path = os.path.join(local_path, name)
+            if name.endswith('.csv'):
+                bulk_load(path, destination)
+            elif os.path.isfile(path) and not name.startswith('_'):
+                run_bash_command(f"hadoop fs -put -f {path} {destination}")
+    elif local_path.endswith('.csv'):
+        bulk_load(local_path, hadoop_path)
+    else:
+        run_bash_command(f"hadoop fs -put {local_path} {hadoop_path}")
     print(f"Upload complete.")
 
 
-def run_projection(input_path, output_path, sql_statement):
+def hdfs_uri(path):
+    """
+    Qualifies an HDFS path with the hdfs:// scheme, which -files needs to
+    tell it from a local path. Paths with a scheme are returned as they are.
+    """
+    return path if '://' in path else f"hdfs://{path}"
+
+
+def zone_map_files(input_path):
+    """
+    Lists the zone map sidecars stored in an HDFS directory and in the table
+    directories bulk_load.py writes into it, as hdfs:// URIs, so they can be
+    shipped to the map tasks with -files.
+    Args:
+        input_path (str): HDFS directory holding the data files.
+    """
+    result = subprocess.run(f"hadoop fs -ls -C {input_path}/_*.zonemap.json {input_path}/*/_*.zonemap.json", shell=True,
+                            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    return [hdfs_uri(path) for path in result.stdout.split()]
+
+
+def task_command(script, sql_statement, *args):
+    """
+    Builds the command a streaming task runs: python3 <script> "<SQL statement>" <args>.
+    """
+    # Escape double quotes in the SQL statement
+    sql_statement_escaped = sql_statement.replace('"', '\\"')
+    return ' '.join([f'python3 {script} "{sql_statement_escaped}"'] + [str(arg) for arg in args])
+
+
+def streaming_command(inputs, output_path, mapper, reducer=None, combiner=None, files=(),
+                      cache_files=(), properties=None, partitioner=None, num_reducers=None,
+                      map_codec=MAP_OUTPUT_CODEC, output_codec=OUTPUT_CODEC):
+    """
+    Builds a Hadoop streaming command.
+    Args:
+        inputs (list): HDFS input paths.
+        output_path (str): HDFS output path.
+        mapper (str): Mapper command.
+        reducer (str): Reducer command; None makes a map-only job.
+        combiner (str): Combiner command.
+        files (list): Local files shipped to the tasks with -file.
+        cache_files (list): HDFS files shipped to the tasks with -files.
+        properties (dict): Job configuration passed with -D.
+        partitioner (str): Partitioner class.
+        num_reducers (int): Number of reduce tasks; None leaves Hadoop's default.
+        map_codec (str): Codec of the map output, or None.
+        output_codec (str): Codec of the job output, or None. Read compressed
+            output with `hadoop fs -text`.
+    """
+    properties = {**job_properties(map_codec if reducer else None, output_codec), **(properties or {})}
+    # Generic options (-D, -files) have to come before the streaming options
+    parts = [f"hadoop jar {STREAMING_JAR}"]
+    for name, value in properties.items():
+        parts.append(f"-D {name}={shlex.quote(str(value))}")
+    if cache_files:
+        parts.append(f"-files {','.join(cache_files)}")
+    parts += [f"-input {path}" for path in inputs]
+    parts.append(f"-output {output_path}")
+    parts.append(f"-mapper {shlex.quote(mapper)}")
+    if combiner:
+        parts.append(f"-combiner {shlex.quote(combiner)}")
+    if reducer:
+        parts.append(f"-reducer {shlex.quote(reducer)}")
+    else:
+        num_reducers = 0
+    if partitioner:
+        parts.append(f"-partitioner {partitioner}")
+    if num_reducers is not None:
+        parts.append(f"-numReduceTasks {num_reducers}")
+    parts += [f"-file {path}" for path in files]
+    return ' '.join(parts)
+
+
+def table_memory_bytes(table_path, table):
     """
-    Runs the projection operation on the specified input file.
+    Estimates the memory the broadcast join's hash table of a table takes,
+    as its size as text plus HASH_ROW_BYTES per row. Bytes on disk understate
+    it: the size as text scales each data file by the expansion of its codec
+    or format (TEXT_EXPANSION). The row count is the one bulk_load.py
+    registered for the table, or else the size as text over the average
+    width of the table's first WIDTH_SAMPLE_ROWS rows.
     Args:
+        table_path (str): HDFS file or directory of the table.
+        table (str): The table's name in the schema registry.
+    """
+    files = hdfs_files(table_path)
+    text_bytes = sum(size * TEXT_EXPANSION.get(os.path.splitext(path)[1], 1.0) for path, size in files.items())
+    rows = load_registry().get(table, {}).get('rows')
+    if rows is None and files:
+        # -text decompresses the file
+        result = subprocess.run(f"hadoop fs -text {min(files)} | head -n {WIDTH_SAMPLE_ROWS + 1}", shell=True,
+                                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+        widths = [len(line.encode('utf-8')) + 1 for line in result.stdout.splitlines()[1:] if line.strip()]
+        rows = text_bytes / (sum(widths) / len(widths)) if widths else 0
+    return int(text_bytes + (rows or 0) * HASH_ROW_BYTES)
+
+
+def hdfs_fingerprint(path):
+    """
+    Fingerprints an HDFS file, or every file under an HDFS directory, as lines
+    of "path mtime length" followed by the files' HDFS checksums. The files
+    are listed recursively, so a chunk appended to a bulk-loaded table's
+    directory changes the fingerprint; -checksum only takes files.
+    """
+    result = subprocess.run(f"hadoop fs -ls -R {path}", shell=True, check=True,
+                            stdout=subprocess.PIPE, text=True)
+    # permissions replication owner group length date time path; directories start with 'd'
+    files = sorted(fields[7] for fields in (line.split(None, 7) for line in result.stdout.splitlines())
+                   if len(fields) == 8 and not fields[0].startswith('d'))
+    if not files:
+        return ''
+    quoted = ' '.join(shlex.quote(file_path) for file_path in files)
+    stats = subprocess.run(f'hadoop fs -stat "%Y %b" {quoted}', shell=True, check=True,
+                           stdout=subprocess.PIPE, text=True).stdout.splitlines()
+    checksums = subprocess.run(f"hadoop fs -checksum {quoted}", shell=True, check=True,
+                               stdout=subprocess.PIPE, text=True).stdout.splitlines()
+    return '\n'.join([f"{file_path} {stat}" for file_path, stat in zip(files, stats)] + sorted(checksums))
+
+
+def cache_inputs(run, input_path, sql_statement):
+    """
+    Returns the HDFS paths of the tables an operation reads, which its cached
+    result is keyed on: the two tables of a join, or the table of any other
+    statement (see table_input).
+    """
+    if run is run_inner_join:
+        return [f"{input_path}/{table}.csv" for table in join_tables(sql_statement)]
+    return [table_input(input_path, plan_query(sql_statement)['table'])]
+
+
+def run_cached(run, input_path, output_path, sql_statement):
+    """
+    Runs an operation, unless the query cache already holds its result for the
+    current contents of the tables it reads.
+    Args:
+        run (function): One of the run_* functions.
         input_path (str): HDFS input path.
+        output_path (str): HDFS output path; it is removed before a job runs.
+        sql_statement (str): SQL statement for the operation.
+    Returns:
+        str: The local path of the result.
+    """
+    entry = cache_entry(sql_statement, cache_inputs(run, input_path, sql_statement), hdfs_fingerprint)
+    result = load_result(entry)
+    if result is not None:
+        print(f"Returning the cached result of this query ({result}).")
+        return result
+
+    subprocess.run(f"hadoop fs -rm -r -f {output_path}", shell=True)
+    run(input_path, output_path, sql_statement)
+    # -text decompresses the part files
+    run_bash_command(f"hadoop fs -text {output_path.rstrip('/')}/part-* > query_result.txt")
+    return store_result(entry, 'query_result.txt')
+
+
+def ensure_schema(table_path, table):
+    """
+    Registers a table already in HDFS in the schema registry (see schema.py),
+    unless it is there, inferring the column types from the file's first rows.
+    The tasks read schemas.json, shipped with -files, to resolve columns.
+    """
+    if table in load_registry():
+        return
+    is_dir = subprocess.run(f"hadoop fs -test -d {table_path}", shell=True).returncode == 0
+    source = f"{table_path}/*.csv" if is_dir else table_path
+    result = subprocess.run(f"hadoop fs -cat {source} | head -n {SCHEMA_SAMPLE_ROWS + 1}", shell=True,
+                            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    schema = register(table, infer_schema(result.stdout.splitlines(), os.path.basename(table_path)))
+    print(f"Registered table {table}: " + ', '.join(f"{column} {kind}" for column, kind in
+                                                     zip(schema['columns'], schema['types'])))
+
+
+def run_broadcast_join(large_path, small_path, small_table, output_path, sql_statement):
+    """
+    Runs a map-only broadcast hash join.
+    The small table is shipped to every map task through the distributed cache
+    and each mapper joins its split of the large table against it.
+    Args:
+        large_path (str): HDFS path of the large table.
+        small_path (str): HDFS path of the small table; -files ships a
+            directory of bulk-loaded chunks as a directory.
+        small_table (str): Name of the small table in the SQL statement.
         output_path (str): HDFS output path.
+        sql_statement (str): SQL statement for the join.
     """
-    command = f"hadoop jar /home/hadoop/hadoop/share/hadoop/tools/lib/hadoop-streaming-3.3.6.jar -input {input_path} -output {output_path} -mapper 'python3 projection.py \"{sql_statement}\" mapper' -reducer 'python3 projection.py \"{sql_statement}\" reducer' -file projection.py"
-    run_bash_command(command)
-    print("Projection operation complete.")
+    small_file = os.path.basename(small_path)
+    command = streaming_command(
+        [large_path], output_path,
+        mapper=task_command('inner_join.py', sql_statement, 'broadcast', small_file, small_table),
+        files=['inner_join.py', 'predicate.py', 'counters.py', 'schema.py', SCHEMA_FILE],
+        cache_files=[hdfs_uri(small_path)],
+    )
+    run_job(command)
 
 
-def run_inner_join():
+def join_tables(sql_statement):
+    """
+    Returns the names of the two tables of a join statement.
+    """
+    parsed = parse_sql_inner_join(sql_statement)
+    return parsed['table1'], parsed['table2']
+
+
+def run_inner_join(input_path, output_path, sql_statement, num_reducers=JOIN_REDUCERS):
     """
     Runs the inner join operation on two input files.
+    The tables are read from <input_path>/<table>.csv, with the table names,
+    join columns, projections and WHERE conditions taken from the SQL statement.
+    When the hash table of the smaller table is estimated to take at most
+    BROADCAST_JOIN_BYTES of memory (see table_memory_bytes) it is broadcast to
+    the mappers and joined map-side. Otherwise both tables are the inputs of
+    one reduce-side join job: mappers tag each row with the table named by
+    their input file, the join key alone picks the reducer, and the key plus
+    a side tag is sorted so that each key's smaller-table rows arrive first.
+    Keys that a sampling job finds hot are salted across the reducers, with
+    the smaller table's rows for them replicated to each salt.
     Args:
-        input_path1 (str): HDFS path to the first file.
-        input_path2 (str): HDFS path to the second file.
+        input_path (str): HDFS directory holding the tables.
         output_path (str): HDFS output path.
+        sql_statement (str): SQL statement for the join.
+        num_reducers (int): Number of reduce tasks of a reduce-side join.
     """
+    tables = join_tables(sql_statement)
+    paths = {table: f"{input_path}/{table}.csv" for table in tables}
+    for table in tables:
+        csv_files(paths[table], 'the join')
+        ensure_schema(paths[table], table)
+    sizes = {table: table_memory_bytes(paths[table], table) for table in tables}
+    small_table, large_table = sorted(tables, key=lambda table: sizes[table])
+
+    if sizes[small_table] <= BROADCAST_JOIN_BYTES:
+        print(f"{small_table}.csv (about {sizes[small_table]} bytes in memory) fits, running a broadcast join.")
+        run_broadcast_join(paths[large_table], paths[small_table], small_table, output_path, sql_statement)
+        print("Inner join operation complete.")
+        return
 
-    run_bash_command("hadoop fs -cat /home/hadoop/hadoopdata/hdfs/data/views.csv | python3 inner_join.py mapper views > temp_views_output.txt")
-    run_bash_command("hadoop fs -cat /home/hadoop/hadoopdata/hdfs/data/carts.csv | python3 inner_join.py mapper carts > temp_carts_output.txt")
-    run_bash_command("cat temp_views_output.txt temp_carts_output.txt | sort > sorted_output.txt")
-    run_bash_command("hadoop fs -cat /home/hadoop/hadoopdata/hdfs/data/carts.csv | python3 inner_join.py mapper carts > temp_carts_output.txt")
-    run_bash_command("cat sorted_output.txt | python3 inner_join.py reducer")
+    # Sample the larger table for hot keys with a map-only job
+    sample_path = f"{output_path.rstrip('/')}_sample"
+    subprocess.run(f"hadoop fs -rm -r -f {sample_path}", shell=True)
+    run_job(streaming_command(
+        [paths[large_table]], sample_path,
+        mapper=task_command('inner_join.py', sql_statement, 'sample', large_table, JOIN_SAMPLE_FRACTION),
+        files=['inner_join.py', 'predicate.py', 'counters.py', 'schema.py', SCHEMA_FILE],
+    ))
+    # The threshold applies to the sample of the whole table, not of each split
+    result = subprocess.run(f"hadoop fs -text {sample_path}/part-*", shell=True, check=True,
+                            stdout=subprocess.PIPE, text=True)
+    keys = hot_keys(result.stdout.splitlines())
+    with open('hot_keys.txt', 'w') as f:
+        f.writelines(f"{key}\n" for key in keys)
+    run_bash_command(f"hadoop fs -rm -r -f {sample_path}")
+    print(f"Hot keys salted across {num_reducers} reducers: {keys}")
+
+    # Map output is key<TAB>side<TAB>row: partition on the key, sort on key then side
+    properties = {
+        'stream.num.map.output.key.fields': 2,
+        'mapreduce.partition.keypartitioner.options': '-k1,1',
+        'mapreduce.job.output.key.comparator.class': 'org.apache.hadoop.mapreduce.lib.partition.KeyFieldBasedComparator',
+        'mapreduce.partition.keycomparator.options': '-k1,1 -k2,2n',
+    }
+    command = streaming_command(
+        [paths[small_table], paths[large_table]], output_path,
+        mapper=task_command('inner_join.py', sql_statement, 'mapper', 'auto', small_table, 'hot_keys.txt', num_reducers),
+        reducer=task_command('inner_join.py', sql_statement, 'reducer'),
+        files=['inner_join.py', 'predicate.py', 'counters.py', 'schema.py', SCHEMA_FILE, 'hot_keys.txt'],
+        properties=properties,
+        partitioner='org.apache.hadoop.mapred.lib.KeyFieldBasedPartitioner',
+        num_reducers=num_reducers,
+    )
+    run_job(command)
     print("Inner join operation complete.")
 
 
+def run_create_index(input_path, output_path, sql_statement):
+    """
+    Builds a secondary index (see secondary_index.py) with a streaming job
+    whose mappers read every line's byte offset, and stores it locally in
+    secondary_index.INDEX_DIR with the fingerprint of the table's data.
+    Args:
+        input_path (str): HDFS directory holding the table.
+        output_path (str): HDFS path for the job's output, removed afterwards.
+        sql_statement (str): CREATE [HASH] INDEX ON <table> (<column>).
+    """
+    _, table, _ = parse_create_index(sql_statement)
+    table_path = table_input(input_path, table)
+    csv_files(table_path, 'an index build')
+    ensure_schema(table_path, table)
+    subprocess.run(f"hadoop fs -rm -r -f {output_path}", shell=True)
+    command = streaming_command(
+        [table_path], output_path,
+        mapper=task_command('secondary_index.py', sql_statement, 'mapper'),
+        reducer=task_command('secondary_index.py', sql_statement, 'reducer'),
+        files=['secondary_index.py', 'predicate.py', 'counters.py', 'schema.py', SCHEMA_FILE],
+        properties={'stream.map.input.ignoreKey': 'false'},
+        # One reducer writes the whole index in key order
+        num_reducers=1,
+    )
+    run_job(command)
+    with subprocess.Popen(f"hadoop fs -text {output_path.rstrip('/')}/part-*", shell=True,
+                          stdout=subprocess.PIPE, text=True) as entries:
+        save_index(sql_statement, entries.stdout, hdfs_fingerprint(table_path))
+    run_bash_command(f"hadoop fs -rm -r -f {output_path}")
+    print("Index created.")
+
+
+def run_indexed(table_path, output_path, sql_statement):
+    """
+    Answers a filter statement from a secondary index of its table, without
+    a job, when one narrows the WHERE clause down to few rows. The rows are
+    read from HDFS with seeks and written to <output_path>/part-00000.
+    Returns:
+        bool: Whether the index answered the statement.
+    """
+    filters, projections, table = parse_filter(sql_statement)
+    with open('index_result.txt', 'w') as out, contextlib.redirect_stdout(out):
+        answered = index_scan(filters, projections, table, parse_order_by(sql_statement),
+                              lambda: hdfs_fingerprint(table_path))
+    if answered:
+        run_bash_command(f"hadoop fs -mkdir -p {output_path}")
+        run_bash_command(f"hadoop fs -put -f index_result.txt {output_path.rstrip('/')}/part-00000")
+    return answered
+
+
+# Function to run the groupby operation
+def groupby_command(inputs, output_path, sql_statement, stage, cache_files=(), num_reducers=None):
+    """
+    Builds the streaming command of a groupby job whose reducers run `stage`
+    of groupby.py: 'reducer' for the results, 'combiner' for merged partial states.
+    """
+    return streaming_command(
+        inputs, output_path,
+        mapper=task_command('groupby.py', sql_statement, 'mapper'),
+        combiner=task_command('groupby.py', sql_statement, 'combiner'),
+        reducer=task_command('groupby.py', sql_statement, stage),
+        files=['groupby.py', 'aggregators.py', 'columnar.py', 'predicate.py', 'zone_maps.py', 'top_n.py',
+               'partitioning.py', 'counters.py', 'vectorized.py', 'schema.py', SCHEMA_FILE],
+        cache_files=cache_files,
+        num_reducers=num_reducers,
+    )
+
+
+def hdfs_files(path):
+    """
+    Returns {hdfs:// URI: length} of an HDFS file, or of the data files in an
+    HDFS directory.
+    """
+    result = subprocess.run(f"hadoop fs -du {path}", shell=True, check=True,
+                            stdout=subprocess.PIPE, text=True)
+    files = {}
+    for line in result.stdout.splitlines():
+        fields = line.split()
+        if fields and not os.path.basename(fields[-1]).startswith(('_', '.')):
+            files[hdfs_uri(fields[-1])] = int(fields[0])
+    return files
+
+
+def csv_files(table_path, operation):
+    """
+    Returns hdfs_files() of a table, rejecting a table bulk_load.py loaded in
+    the columnar format: streaming jobs read their input through
+    TextInputFormat, which would hand the binary chunks to the CSV mappers
+    line by line.
+    Args:
+        table_path (str): HDFS file or directory of the table.
+        operation (str): Name of the operation, for the error message.
+    """
+    files = hdfs_files(table_path)
+    if any(path.endswith('.hcol') for path in files):
+        raise ValueError(f"{table_path} holds columnar chunks, which {operation} cannot read from HDFS; "
+                         "load the table as CSV")
+    return files
+
 
-# Function to run the filter operation
-def run_filter(input_path, output_path, sql_statement):
+def run_groupby(input_path, output_path, sql_statement, num_reducers=None):
     """
-    Runs the filter operation on the specified input file.
+    Runs the groupby operation on the specified input file, incrementally:
+    the groups' partial states are kept as a materialized view (see
+    materialized.py), and only the lines appended to the table since the last
+    run are aggregated, by a job whose reducers write merged partial states,
+    and merged into the view. Appended tails of files the view already covers
+    are read through WebHDFS and staged in HDFS as the job's input. The
+    results, computed from the view, go to <output_path>/part-00000. The view
+    tracks byte offsets of CSV files, so a table loaded in the columnar format
+    is rejected.
+    The combiner merges the mappers' partial aggregates before the shuffle, so
+    the shuffle carries one record per group per map task instead of every row.
     Args:
         input_path (str): HDFS input path.
         output_path (str): HDFS output path.
-        sql_statement (str): SQL statement for filtering.
+        sql_statement (str): SQL statement with the aggregations and GROUPBY columns.
+        num_reducers (int): Number of reduce tasks; None leaves Hadoop's default.
     """
-    # Escape double quotes in the SQL statement
-    sql_statement_escaped = sql_statement.replace('"', '\\"')
+    table = plan_query(sql_statement)['table']
+    table_path = table_input(input_path, table)
+    files = csv_files(table_path, 'groupby')
+    ensure_schema(table_path, table)
 
-    # Construct the Hadoop streaming command
-    command = (
-        f"hadoop jar /home/hadoop/hadoop/share/hadoop/tools/lib/hadoop-streaming-3.3.6.jar "
-        f"-input {input_path} "
-        f"-output {output_path} "
-        f"-mapper 'python3 filter.py \"{sql_statement_escaped}\" mapper' "
-        f"-reducer 'python3 filter.py \"{sql_statement_escaped}\" reducer' "
-        f"-file filter.py"
-    )
-    
-    # Run the command
-    run_bash_command(command)
-    print("Filter operation complete.")
+    inputs = [table_path]
+    ranges, rebuild = plan_refresh(load_view(sql_statement, inputs), files)
+    delta_path = f"{output_path.rstrip('/')}_delta"
+    state_path = f"{output_path.rstrip('/')}_state"
+    subprocess.run(f"hadoop fs -rm -r -f {delta_path} {state_path}", shell=True)
+    job_inputs = []
+    for number, (path, start, end) in enumerate(ranges):
+        if start == 0 and end == files[path]:
+            job_inputs.append(path)
+            continue
+        # Only the bytes past the watermark, up to the last complete line
+        staged = f"{delta_path}/delta-{number:05d}.csv"
+        run_bash_command(f"hadoop fs -mkdir -p {delta_path}")
+        subprocess.run(["hadoop", "fs", "-put", "-f", "-", staged], input=read_range(path, start, end - start),
+                       check=True)
+        job_inputs.append(staged)
 
-# Function to run the groupby operation
-def run_groupby(input_path,sql_statement):
+    delta_lines = []
+    if job_inputs:
+        run_job(groupby_command(job_inputs, state_path, sql_statement, 'combiner', zone_map_files(input_path),
+                                num_reducers))
+        result = subprocess.run(f"hadoop fs -text {state_path}/part-*", shell=True, check=True,
+                                stdout=subprocess.PIPE, text=True)
+        delta_lines = [line for line in result.stdout.splitlines() if line.strip()]
+        run_bash_command(f"hadoop fs -rm -r -f {delta_path} {state_path}")
+
+    groups = refresh(sql_statement, inputs, delta_lines, ranges, rebuild, 'groupby_result.txt')
+    run_bash_command(f"hadoop fs -mkdir -p {output_path}")
+    run_bash_command(f"hadoop fs -put -f groupby_result.txt {output_path.rstrip('/')}/part-00000")
+    print(f"Groupby operation complete ({'rebuilt' if rebuild else 'refreshed'} the view from "
+          f"{sum(end - start for _, start, end in ranges)} new bytes, {groups} groups).")
+
+
+def table_input(input_path, table):
+    """
+    Returns <input_path>/<table>.csv when the table has its own file in HDFS,
+    and the whole input path otherwise.
     """
-    Runs the groupby operation on the specified input file.
+    result = subprocess.run(f"hadoop fs -test -e {input_path}/{table}.csv", shell=True)
+    return f"{input_path}/{table}.csv" if result.returncode == 0 else input_path
+
+
+def sample_partitions(table_path, output_path, sql_statement, files, cache_files):
+    """
+    Plans the reducers of an aggregate query from a map-only job that samples
+    QUERY_SAMPLE_FRACTION of its rows, and writes partitions.txt for the
+    ranges when it picks more than one reducer (see partitioning.py).
+    Returns:
+        int: The reducer count.
+    """
+    sample_path = f"{output_path.rstrip('/')}_sample"
+    subprocess.run(f"hadoop fs -rm -r -f {sample_path}", shell=True)
+    run_job(streaming_command(
+        [table_path], sample_path,
+        mapper=task_command('query.py', sql_statement, 'sample', QUERY_SAMPLE_FRACTION),
+        files=files, cache_files=cache_files,
+    ))
+    with subprocess.Popen(f"hadoop fs -text {sample_path}/part-*", shell=True,
+                          stdout=subprocess.PIPE, text=True) as sample:
+        decision = plan_reducers((line.rstrip('\n') for line in sample.stdout), QUERY_SAMPLE_FRACTION)
+    run_bash_command(f"hadoop fs -rm -r -f {sample_path}")
+
+    print(f"Sampled {decision['sampled_rows']} rows in {decision['sampled_groups']} groups "
+          f"(most frequent group {decision['top_key_share']:.1%} of rows); "
+          f"estimated {decision['estimated_groups']} groups, using {decision['reducers']} reducer(s).")
+    if decision['reducers'] > 1:
+        write_partition_file('partitions.txt', decision['boundaries'])
+        print(f"Range partitioned at {decision['boundaries']}, so the output is globally sorted.")
+    return decision['reducers']
+
+
+def run_query(input_path, output_path, sql_statement, num_reducers=None):
+    """
+    Runs a single-table query (any mix of projection, WHERE and GROUPBY) as one
+    streaming job, with the plan's WHERE clause and columns pushed into the scan.
+    Queries without aggregates or DISTINCT run map-only, or are answered
+    from a secondary index when one narrows their WHERE clause down to few
+    rows (see secondary_index.py). Unless num_reducers is
+    given, aggregates sample their input first to choose the reducer count,
+    and split the groups over the reducers in sorted key ranges.
     Args:
-        input_path (str): HDFS input path.
+        input_path (str): HDFS directory holding the table.
         output_path (str): HDFS output path.
-        groupby_column (str): The column to group by.
+        sql_statement (str): SQL statement of the query.
+        num_reducers (int): Number of reduce tasks; None picks it from a sample,
+            or leaves Hadoop's default for queries without aggregates.
     """
-    command = f"hadoop fs -cat {input_path}/tripdata.csv | python3 groupby.py '{sql_statement}' mapper | sort | python3 groupby.py '{sql_statement}' reducer"
-    run_bash_command(command)
-    print("Groupby operation complete.")
+    plan = plan_query(sql_statement)
+    table_path = table_input(input_path, plan['table'])
+    csv_files(table_path, 'a query')
+    ensure_schema(table_path, plan['table'])
+    if (plan['where'] is not None and not plan['aggregations'] and not plan['distinct']
+            and run_indexed(table_path, output_path, sql_statement)):
+        print("Query complete (from an index).")
+        return
+    files = ['query.py', 'groupby.py', 'projection.py', 'aggregators.py', 'columnar.py', 'predicate.py',
+             'zone_maps.py', 'top_n.py', 'partitioning.py', 'counters.py', 'vectorized.py', 'schema.py', SCHEMA_FILE]
+    cache_files = zone_map_files(input_path)
+
+    task_args = []
+    properties = None
+    partitioner = None
+    if range_partitioned(plan) and num_reducers is None:
+        num_reducers = sample_partitions(table_path, output_path, sql_statement, files, cache_files)
+        if num_reducers > 1:
+            # Keys carry their range's token, which alone picks the reducer
+            task_args = ['-', 'partitions.txt']
+            files = files + ['partitions.txt']
+            properties = {'mapreduce.partition.keypartitioner.options': PARTITIONER_OPTIONS}
+            partitioner = 'org.apache.hadoop.mapred.lib.KeyFieldBasedPartitioner'
 
+    command = streaming_command(
+        [table_path], output_path,
+        mapper=task_command('query.py', sql_statement, 'mapper', *task_args),
+        combiner=task_command('query.py', sql_statement, 'combiner') if plan['aggregations'] else None,
+        reducer=task_command('query.py', sql_statement, 'reducer', *task_args) if needs_reducer(plan) else None,
+        files=files,
+        cache_files=cache_files,
+        properties=properties,
+        partitioner=partitioner,
+        num_reducers=reducer_count(plan, num_reducers),
+    )
+    run_job(command)
+    print("Query complete.")
 
 
 # Main function to control the SQL operations
@@ -110,6 +641,7 @@ def main():
     print("2. Inner Join")
     print("3. Filter")
     print("4. Groupby")
+    print("5. Create index")
 
     has_uploaded = input("Have you already uploaded the data to HDFS? (yes/no): ")
     hadoop_path = "/home/hadoop/hadoopdata/hdfs/data"
@@ -119,40 +651,22 @@ def main():
         upload_to_hadoop(data_path, hadoop_path)
 
     operation = input("Enter the number corresponding to the operation: ")
-    if operation == '1':
-        sql_statement = input("Enter the sql statement: ")
-        output_file = "/home/hadoop/hadoopdata/hdfs/output/"
-        try:
-            run_bash_command("hadoop fs -rm -r /home/hadoop/hadoopdata/hdfs/output")
-        except:
-            pass
-        run_projection(hadoop_path, output_file, sql_statement)
-        show_output = input("Would you like to view the output? {yes/no} ")
-        if show_output == "yes":
-            run_bash_command("hadoop fs -cat /home/hadoop/hadoopdata/hdfs/output/part-*")
-    
-    elif operation == '2':
-        run_inner_join()
-    
-    elif operation == '3':
-        sql_statement = input("Enter the sql statement: ")
-        output_file = "/home/hadoop/hadoopdata/hdfs/output/"
-        try:
-            run_bash_command("hadoop fs -rm -r /home/hadoop/hadoopdata/hdfs/output")
-        except:
-            pass
-        run_filter(hadoop_path, output_file, sql_statement)
-        show_output = input("Would you like to view the output? {yes/no} ")
-        if show_output == "yes":
-            run_bash_command("hadoop fs -cat /home/hadoop/hadoopdata/hdfs/output/part-*")
-
-    
-    elif operation == '4':
-        sql_statement = input("Enter the sql statement: ")
-        run_groupby(hadoop_path, sql_statement)
-    
-    else:
+    # Projection and filter statements run through the fused single-table query job, and groupby
+    # statements refresh their materialized view
+    operations = {'1': run_query, '2': run_inner_join, '3': run_query, '4': run_groupby}
+    if operation not in operations and operation != '5':
         print("Invalid operation selected. Exiting.")
+        return
+
+    sql_statement = input("Enter the sql statement: ")
+    output_file = "/home/hadoop/hadoopdata/hdfs/output/"
+    if operation == '5':
+        run_create_index(hadoop_path, output_file, sql_statement)
+        return
+    result = run_cached(operations[operation], hadoop_path, output_file, sql_statement)
+    show_output = input("Would you like to view the output? {yes/no} ")
+    if show_output == "yes":
+        run_bash_command(f"cat {result}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,226 @@
+"""
+Materialized groupby views over append-only data.
+
+The view of a groupby statement keeps, in VIEW_DIR, the merged partial states
+of every group (see aggregators.py), as the key-sorted `key\tpartials` lines
+groupby.combiner writes, together with a watermark: for every input file, how
+many bytes the states cover and the CRC32 of the last TAIL_BYTES of them.
+Refreshing the view reads only what lies past the watermarks, new files and
+the lines appended to known ones, aggregates it into partial states with the
+groupby mapper and combiner, and merges those into the stored states, so a
+daily refresh costs in proportion to the day's data rather than the history.
+The results are computed from the merged states.
+
+A watermark stops at the last complete line, so a line still being written is
+read by the next refresh. An input that disappeared, shrank or whose covered
+bytes changed (its tail checksum differs) is not append-only; the view is
+then rebuilt from all of the input.
+
+    python3 materialized.py "SELECT city, SUM(fare), COUNT(*) FROM trips GROUPBY city" result.txt tripdata.csv
+"""
+import hashlib
+import heapq
+import json
+import os
+import re
+import sys
+import tempfile
+import time
+import zlib
+from operator import itemgetter
+
+from groupby import decode_partials, encode_partials, group_results, merge_partials, parse_sql
+from local_runner import LOCAL_WORKERS, SPLIT_BYTES, input_splits, run_local
+from query_cache import normalize_sql
+from secondary_index import read_range
+from top_n import parse_order_by
+
+VIEW_DIR = 'views'
+# Bytes before a watermark whose checksum detects a rewritten file
+TAIL_BYTES = 4096
+
+
+def view_name(sql_statement, inputs):
+    """
+    Names the view of a statement over a set of inputs. ORDER BY ... LIMIT
+    only shapes the results, so statements differing in it share a view.
+    """
+    statement = re.split(r"\s+(?:ORDER\s+BY|LIMIT)\b", sql_statement, flags=re.IGNORECASE)[0]
+    text = '\n'.join([normalize_sql(statement)] + sorted(inputs))
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()[:32]
+
+
+def load_view(sql_statement, inputs, view_dir=VIEW_DIR):
+    """
+    Returns the metadata of a statement's view, or None when there is none yet.
+    """
+    path = os.path.join(view_dir, f"{view_name(sql_statement, inputs)}.json")
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def tail_checksum(path, end):
+    start = max(end - TAIL_BYTES, 0)
+    return f"{zlib.crc32(read_range(path, start, end - start)):08x}"
+
+
+def line_end(path, start, size):
+    """
+    Returns the offset just past the last complete line between `start` and
+    `size`, or `start` when there is none.
+    """
+    window = TAIL_BYTES
+    while True:
+        window_start = max(size - window, start)
+        newline = read_range(path, window_start, size - window_start).rfind(b'\n')
+        if newline >= 0:
+            return window_start + newline + 1
+        if window_start == start:
+            return start
+        window *= 4
+
+
+def plan_refresh(view, files):
+    """
+    Works out what a refresh has to read.
+    Args:
+        view (dict): The view's metadata, or None when there is none yet.
+        files (dict): Path -> size in bytes of every input file.
+    Returns:
+        tuple: The (path, start, end) byte ranges past the watermarks, and
+            whether the view has to be rebuilt, in which case the ranges
+            cover all of the input.
+    """
+    watermark = view['watermark'] if view is not None else {}
+    rebuild = view is None or any(
+        path not in files or files[path] < mark['bytes'] or tail_checksum(path, mark['bytes']) != mark['tail']
+        for path, mark in watermark.items())
+    if rebuild:
+        watermark = {}
+
+    ranges = []
+    for path, size in sorted(files.items()):
+        start = watermark[path]['bytes'] if path in watermark else 0
+        end = line_end(path, start, size) if size > start else start
+        if end > start:
+            ranges.append((path, start, end))
+    return ranges, rebuild
+
+
+def read_states(path, aggregations):
+    with open(path, 'r') as f:
+        for line in f:
+            key, value = line.rstrip('\n').split('\t')
+            yield key, decode_partials(value, aggregations)
+
+
+def merge_states(stored, delta):
+    """
+    Merges two key-sorted streams of (key, states) pairs, yielding each key
+    once with its states merged.
+    """
+    current_key = current_states = None
+    for key, states in heapq.merge(stored, delta, key=itemgetter(0)):
+        if key != current_key:
+            if current_key is not None:
+                yield current_key, current_states
+            current_key, current_states = key, states
+        else:
+            merge_partials(current_states, states)
+    if current_key is not None:
+        yield current_key, current_states
+
+
+def refresh(sql_statement, inputs, delta_lines, ranges, rebuild, output_path, view_dir=VIEW_DIR):
+    """
+    Merges the partial states of the data past the watermarks into a view,
+    stores it with its new watermarks and writes the statement's results.
+    The new states are written under a new name and the metadata pointing to
+    them is replaced last, so an interrupted refresh leaves the view as it was.
+    Args:
+        sql_statement (str): The groupby statement.
+        inputs (list): The inputs the view is over.
+        delta_lines (iterable): `key\tpartials` lines of the new data, one per
+            group, as groupby.combiner writes them, in any order.
+        ranges (list): The (path, start, end) ranges they were computed from, see plan_refresh().
+        rebuild (bool): Discard the stored states.
+        output_path (str): Local file the `key\tresults` lines are written to.
+    Returns:
+        int: Number of groups in the view.
+    """
+    _, projections, _, _, aggregations = parse_sql(sql_statement)
+    name = view_name(sql_statement, inputs)
+    previous = load_view(sql_statement, inputs, view_dir)
+    view = None if rebuild else previous
+    watermark = dict(view['watermark']) if view is not None else {}
+    for path, _, end in ranges:
+        watermark[path] = {'bytes': end, 'tail': tail_checksum(path, end)}
+
+    delta = []
+    for line in delta_lines:
+        key, value = line.rstrip('\n').split('\t')
+        delta.append((key, decode_partials(value, aggregations)))
+    delta.sort(key=itemgetter(0))
+
+    os.makedirs(view_dir, exist_ok=True)
+    states_file = f"{name}.{time.time_ns()}.partials"
+    stored = read_states(os.path.join(view_dir, view['states']), aggregations) if view is not None else iter(())
+    groups = 0
+    with open(os.path.join(view_dir, states_file), 'w') as states_out, open(output_path, 'w') as output:
+
+        def store(merged):
+            nonlocal groups
+            for key, states in merged:
+                states_out.write(f"{key}\t{encode_partials(states)}\n")
+                groups += 1
+                yield key, states
+
+        merged = store(merge_states(stored, delta))
+        for key, results in group_results(merged, aggregations, parse_order_by(sql_statement), projections):
+            output.write(f"{key}\t{','.join(results)}\n")
+        # LIMIT without an ORDER BY column stops reading the groups early
+        for _ in merged:
+            pass
+
+    meta_file = os.path.join(view_dir, f"{name}.json")
+    with open(meta_file + '.tmp', 'w') as f:
+        json.dump({'sql': sql_statement, 'inputs': sorted(inputs), 'states': states_file, 'groups': groups,
+                   'watermark': watermark}, f, indent=2)
+    os.replace(meta_file + '.tmp', meta_file)
+    if previous is not None and os.path.exists(os.path.join(view_dir, previous['states'])):
+        os.remove(os.path.join(view_dir, previous['states']))
+    return groups
+
+
+def refresh_local(sql_statement, inputs, output_path, workers=LOCAL_WORKERS):
+    """
+    Refreshes the view of a statement over local files, running the groupby
+    mapper and combiner over the new bytes with the local runner, and writes
+    the statement's results.
+    Returns:
+        int: Number of groups in the view.
+    """
+    files = {path: os.path.getsize(path) for path in inputs}
+    ranges, rebuild = plan_refresh(load_view(sql_statement, inputs), files)
+    delta_lines = []
+    if ranges:
+        splits = [split for path, start, end in ranges for split in input_splits(path, SPLIT_BYTES, start, end)]
+        with tempfile.TemporaryDirectory() as job_dir:
+            for output in run_local('groupby_state', sql_statement, inputs, job_dir, workers,
+                                    splits=splits):
+                with open(output, 'r') as f:
+                    delta_lines.extend(line for line in f if line.strip())
+    groups = refresh(sql_statement, inputs, delta_lines, ranges, rebuild, output_path)
+    print(f"{'Rebuilt' if rebuild else 'Refreshed'} view from {sum(end - start for _, start, end in ranges)} "
+          f"new bytes in {len(ranges)} files: {groups} groups", file=sys.stderr)
+    return groups
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 4:
+        print("Usage: python materialized.py <SQL statement> <output file> <input file> [<input file> ...]")
+        sys.exit(1)
+
+    refresh_local(sys.argv[1], sys.argv[3:], sys.argv[2])
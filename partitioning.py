@@ -0,0 +1,163 @@
+"""
+Reducer planning for groupby jobs.
+
+A map-only pre-pass samples the group keys of a fraction of the input rows.
+From the sample we estimate how many groups there are and how skewed they
+are, choose a reducer count, and split the key space into that many ranges
+holding equal numbers of estimated groups (the in-mapper aggregation sends
+each reducer about one record per group, so groups, not rows, are its load).
+
+Hadoop's TotalOrderPartitioner needs a SequenceFile partition list, which the
+streaming scripts cannot write. Instead each range gets a token whose
+KeyFieldBasedPartitioner hash lands on that range's reducer. Mappers prefix
+every key with its range's token, the job partitions on the first
+TOKEN_WIDTH characters of the key (PARTITIONER_OPTIONS), and the reducer strips
+the token again. Reducer i then receives exactly range i, so the part files,
+read in order, hold the groups in globally sorted order.
+
+The partition file has one line per reducer: the token and the first key of
+the range, empty for the first range.
+"""
+import math
+import sys
+from bisect import bisect_right
+from collections import Counter
+
+# Groups each reducer should receive
+GROUPS_PER_REDUCER = 200000
+MAX_REDUCERS = 64
+# Range tokens are this many hex digits, so the partitioner can hash them alone
+TOKEN_WIDTH = 4
+PARTITIONER_OPTIONS = f"-k1.1,1.{TOKEN_WIDTH}"
+
+
+def key_field_hash(text):
+    """
+    The hash Hadoop's KeyFieldBasedPartitioner computes over a key field:
+    h = 31 * h + b over the field's UTF-8 bytes (as signed bytes) in Java int
+    arithmetic.
+    """
+    h = 0
+    for b in text.encode('utf-8'):
+        if b > 127:
+            b -= 256
+        h = (31 * h + b) & 0xFFFFFFFF
+    return h
+
+
+def partition_of(text, num_reducers):
+    """
+    The reducer KeyFieldBasedPartitioner sends a key field to.
+    """
+    return (key_field_hash(text) & 0x7FFFFFFF) % num_reducers
+
+
+def range_tokens(num_reducers):
+    """
+    Returns one token per reducer, such that partition_of(tokens[i]) == i.
+    """
+    tokens = [None] * num_reducers
+    missing = num_reducers
+    candidate = 0
+    while missing:
+        token = f"{candidate:0{TOKEN_WIDTH}x}"
+        target = partition_of(token, num_reducers)
+        if tokens[target] is None:
+            tokens[target] = token
+            missing -= 1
+        candidate += 1
+    return tokens
+
+
+def estimate_groups(counts, fraction):
+    """
+    Estimates the number of distinct keys in the whole input from the key
+    counts of a sample that holds `fraction` of the rows. Keys seen once are
+    scaled up by 1/sqrt(fraction) (the GEE estimator); keys seen more often
+    are assumed to be all there is of them.
+    """
+    seen_once = sum(1 for count in counts.values() if count == 1)
+    return int(seen_once * math.sqrt(1 / fraction) + (len(counts) - seen_once))
+
+
+def plan_reducers(keys, fraction, groups_per_reducer=GROUPS_PER_REDUCER, max_reducers=MAX_REDUCERS):
+    """
+    Plans the reduce side of a groupby from a sample of its group keys.
+    Args:
+        keys (iterable): The sampled group keys, one per sampled row.
+        fraction (float): Fraction of the input rows that was sampled.
+    Returns:
+        dict: 'reducers', the reducer count; 'boundaries', the first key of
+            every range after the first; and the estimates behind them:
+            'sampled_rows', 'sampled_groups', 'estimated_groups' and
+            'top_key_share', the share of sampled rows held by the most
+            frequent key.
+    """
+    counts = Counter(keys)
+    sampled_rows = sum(counts.values())
+    estimated_groups = estimate_groups(counts, fraction) if counts else 0
+    reducers = max(1, min(max_reducers, len(counts), math.ceil(estimated_groups / groups_per_reducer)))
+
+    # Ranges hold equal estimated groups: a key seen once stands for the
+    # unsampled keys around it, as in estimate_groups
+    scale = math.sqrt(1 / fraction)
+    boundaries = []
+    seen = 0
+    for key in sorted(counts):
+        if len(boundaries) < reducers - 1 and seen >= estimated_groups * (len(boundaries) + 1) / reducers:
+            boundaries.append(key)
+        seen += scale if counts[key] == 1 else 1
+    return {
+        'reducers': reducers,
+        'boundaries': boundaries,
+        'sampled_rows': sampled_rows,
+        'sampled_groups': len(counts),
+        'estimated_groups': estimated_groups,
+        'top_key_share': round(counts.most_common(1)[0][1] / sampled_rows, 4) if counts else 0,
+    }
+
+
+def write_partition_file(path, boundaries):
+    """
+    Writes the partition file for a list of range boundaries.
+    """
+    tokens = range_tokens(len(boundaries) + 1)
+    with open(path, 'w') as f:
+        for token, first_key in zip(tokens, [''] + boundaries):
+            f.write(f"{token}\t{first_key}\n")
+
+
+class RangeRouter:
+    """
+    Maps a group key to the token of its range, as read from a partition file.
+    """
+
+    def __init__(self, path):
+        tokens = []
+        first_keys = []
+        with open(path, 'r') as f:
+            for line in f:
+                token, first_key = line.rstrip('\n').split('\t', 1)
+                tokens.append(token)
+                first_keys.append(first_key)
+        self.tokens = tokens
+        self.boundaries = first_keys[1:]
+
+    def prefix(self, key):
+        """
+        Returns the key behind the token of its range.
+        """
+        return self.tokens[bisect_right(self.boundaries, key)] + key
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print("Usage: python partitioning.py <sample fraction> <partition file> < sampled keys")
+        sys.exit(1)
+
+    plan = plan_reducers((line.rstrip('\n') for line in sys.stdin), float(sys.argv[1]))
+    write_partition_file(sys.argv[2], plan['boundaries'])
+    print(plan['reducers'])
+    print(f"Sampled {plan['sampled_rows']} rows in {plan['sampled_groups']} groups, "
+          f"estimated {plan['estimated_groups']} groups, top key share {plan['top_key_share']}, "
+          f"{plan['reducers']} reducers", file=sys.stderr)
@@ -0,0 +1,565 @@
+"""
+WHERE clause parsing and compilation.
+parse_where() turns the WHERE clause of a SQL statement into a tree of condition
+nodes. Calling compile(headers) on the tree resolves column names to indices
+once and returns a plain function row -> bool, with constants already coerced
+and operators bound to functions from the operator module, so mappers do no
+per-row interpretation of the clause. Given the column types of the schema
+registry, compile(headers, types) also treats empty fields as nulls that match
+nothing. The types never decide how a field compares: they are inferred from
+a sample, so a column typed str may still hold numbers and one typed int may
+hold a stray word.
+
+can_match(stats) answers whether any row of a block could satisfy the clause,
+given per-column block statistics (see zone_maps.py). It only returns False
+when the statistics prove that no row matches.
+
+Supported syntax: =, !=, <>, <, <=, >, >=, [NOT] IN (...), [NOT] BETWEEN x AND y,
+[NOT] LIKE 'pattern', AND, OR, NOT and parentheses. String literals may be
+quoted with single or double quotes; unquoted values are taken as numbers when
+they parse as one and as strings otherwise. The right-hand side of a comparison
+may also be a qualified column, e.g. views.product_id != carts.product_id.
+"""
+import operator
+import re
+
+# Estimated fraction of rows that pass each kind of condition; used to order
+# AND/OR operands so that the cheapest way to decide a row is tried first.
+SELECTIVITY = {
+    '=': 0.1,
+    '!=': 0.9,
+    '<': 1 / 3,
+    '<=': 1 / 3,
+    '>': 1 / 3,
+    '>=': 1 / 3,
+    'BETWEEN': 0.25,
+    'LIKE': 0.25,
+}
+
+OPERATORS = {
+    '=': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+}
+
+# Keywords that end a WHERE clause
+CLAUSE_END = {'GROUP', 'GROUPBY', 'ORDER', 'LIMIT'}
+
+TOKEN_PATTERN = re.compile(r"""
+    \s*(?:
+        (?P<string>'(?:[^']|'')*'|"(?:[^"]|"")*")
+      | (?P<op><>|!=|<=|>=|=|<|>)
+      | (?P<punct>[(),;])
+      | (?P<word>[^\s'"(),;=<>!]+)
+    )""", re.VERBOSE)
+
+
+def tokenize(text):
+    """
+    Splits SQL text into (kind, value) tokens.
+    """
+    tokens = []
+    position = 0
+    text = text.rstrip()
+    while position < len(text):
+        match = TOKEN_PATTERN.match(text, position)
+        if not match:
+            raise ValueError(f"Unexpected character in SQL statement: {text[position:]}")
+        position = match.end()
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == 'string':
+            value = value[1:-1].replace(value[0] * 2, value[0])
+        elif kind == 'op' and value == '<>':
+            value = '!='
+        tokens.append((kind, value))
+    return tokens
+
+
+class Literal:
+    """
+    A constant from the WHERE clause, pre-coerced to float when it is numeric.
+    """
+    __slots__ = ('text', 'number')
+
+    def __init__(self, text, quoted):
+        self.text = text
+        self.number = None
+        if not quoted:
+            try:
+                self.number = float(text)
+            except ValueError:
+                pass
+
+
+class ColumnRef:
+    """
+    A table-qualified column on the right-hand side of a comparison.
+    """
+    __slots__ = ('column',)
+
+    def __init__(self, column):
+        self.column = column
+
+
+class Condition:
+    """
+    Base class of all WHERE clause nodes.
+    """
+
+    def selectivity(self):
+        raise NotImplementedError
+
+    def columns(self):
+        raise NotImplementedError
+
+    def compile(self, headers, types=None):
+        """
+        Returns a function that takes a split row and reports whether it matches.
+        Args:
+            headers (list): Column names in file order.
+            types (list): Optional column types from the schema registry (see
+                schema.py). Empty fields are then nulls that match nothing.
+                Either way an unquoted number compares with the fields that
+                parse as numbers numerically and with the others as text.
+        """
+        raise NotImplementedError
+
+    def can_match(self, stats):
+        """
+        Reports whether any row of a block could match.
+        Args:
+            stats (dict): Column name -> statistics with the keys numeric, min,
+                max, min_text, max_text, null_count and distinct.
+        """
+        return True
+
+
+def column_index(headers, column):
+    if column not in headers and '.' in column:
+        # Accept table.column against a single table's headers
+        column = column.split('.', 1)[1]
+    if column not in headers:
+        raise ValueError(f"Unknown column in WHERE clause: {column}")
+    return headers.index(column)
+
+
+def numeric_test(i, op, number, text):
+    """
+    Builds a test that compares the field numerically, falling back to a string
+    comparison for fields that are not numbers.
+    """
+    def test(row):
+        field = row[i]
+        try:
+            return op(float(field), number)
+        except ValueError:
+            return op(field, text)
+    return test
+
+
+def non_null(i, test):
+    """
+    Wraps a test so that an empty field in column i matches nothing.
+    """
+    return lambda row: row[i] != '' and test(row)
+
+
+def range_may_satisfy(op, low, high, value):
+    """
+    Reports whether some x with low <= x <= high can satisfy `x op value`.
+    """
+    if op == '=':
+        return low <= value <= high
+    if op == '!=':
+        return not (low == high == value)
+    if op == '<':
+        return low < value
+    if op == '<=':
+        return low <= value
+    if op == '>':
+        return high > value
+    return high >= value
+
+
+def literal_may_match(stats, op, literal):
+    """
+    Checks `column op literal` against one column's block statistics, following
+    the same numeric-then-text comparison rules as the compiled tests.
+    """
+    if stats is None or isinstance(literal, ColumnRef):
+        return True
+    if literal.number is None:
+        if stats['min_text'] is None:
+            return True
+        return range_may_satisfy(op, stats['min_text'], stats['max_text'], literal.text)
+    if not stats['numeric']:
+        return True
+    # Empty fields fail float() and fall back to a text comparison
+    if stats['null_count'] and OPERATORS[op]('', literal.text):
+        return True
+    if stats['min'] is None:
+        return False
+    return range_may_satisfy(op, stats['min'], stats['max'], literal.number)
+
+
+class Comparison(Condition):
+    def __init__(self, column, op, literal):
+        self.column = column
+        self.op = op
+        self.literal = literal
+
+    def selectivity(self):
+        return SELECTIVITY[self.op]
+
+    def columns(self):
+        if isinstance(self.literal, ColumnRef):
+            return {self.column, self.literal.column}
+        return {self.column}
+
+    def compile(self, headers, types=None):
+        i = column_index(headers, self.column)
+        op = OPERATORS[self.op]
+        if isinstance(self.literal, ColumnRef):
+            j = column_index(headers, self.literal.column)
+
+            def test(row):
+                left, right = row[i], row[j]
+                try:
+                    return op(float(left), float(right))
+                except ValueError:
+                    return op(left, right)
+            return test if types is None else non_null(i, non_null(j, test))
+        if self.literal.number is not None:
+            test = numeric_test(i, op, self.literal.number, self.literal.text)
+            return test if types is None else non_null(i, test)
+        text = self.literal.text
+        return lambda row: op(row[i], text)
+
+    def can_match(self, stats):
+        return literal_may_match(stats.get(self.column), self.op, self.literal)
+
+
+class InList(Condition):
+    def __init__(self, column, literals):
+        self.column = column
+        self.literals = literals
+
+    def selectivity(self):
+        return min(0.5, SELECTIVITY['='] * len(self.literals))
+
+    def columns(self):
+        return {self.column}
+
+    def compile(self, headers, types=None):
+        i = column_index(headers, self.column)
+        texts = frozenset(literal.text for literal in self.literals)
+        numbers = frozenset(literal.number for literal in self.literals if literal.number is not None)
+        if not numbers:
+            return lambda row: row[i] in texts
+
+        def test(row):
+            field = row[i]
+            if field in texts:
+                return True
+            try:
+                return float(field) in numbers
+            except ValueError:
+                return False
+        return test
+
+    def can_match(self, stats):
+        column_stats = stats.get(self.column)
+        return any(literal_may_match(column_stats, '=', literal) for literal in self.literals)
+
+
+class Between(Condition):
+    def __init__(self, column, low, high):
+        self.column = column
+        self.low = low
+        self.high = high
+
+    def selectivity(self):
+        return SELECTIVITY['BETWEEN']
+
+    def columns(self):
+        return {self.column}
+
+    def compile(self, headers, types=None):
+        i = column_index(headers, self.column)
+        if self.low.number is not None and self.high.number is not None:
+            low, high = self.low.number, self.high.number
+
+            def test(row):
+                try:
+                    return low <= float(row[i]) <= high
+                except ValueError:
+                    return False
+            return test
+        low, high = self.low.text, self.high.text
+        return lambda row: low <= row[i] <= high
+
+    def can_match(self, stats):
+        column_stats = stats.get(self.column)
+        return literal_may_match(column_stats, '>=', self.low) and literal_may_match(column_stats, '<=', self.high)
+
+
+class Like(Condition):
+    def __init__(self, column, pattern):
+        self.column = column
+        self.pattern = pattern
+
+    def selectivity(self):
+        return SELECTIVITY['LIKE']
+
+    def columns(self):
+        return {self.column}
+
+    def compile(self, headers, types=None):
+        i = column_index(headers, self.column)
+        pattern = self.pattern
+        body = pattern.rstrip('%')
+        # 'abc%' is by far the most common pattern; startswith beats a regex
+        if body and '%' not in body and '_' not in body:
+            if body == pattern:
+                return lambda row: row[i] == body
+            return lambda row: row[i].startswith(body)
+        regex = ''.join('.*' if c == '%' else '.' if c == '_' else re.escape(c) for c in pattern)
+        match = re.compile(regex, re.DOTALL).fullmatch
+        return lambda row: match(row[i]) is not None
+
+    def can_match(self, stats):
+        column_stats = stats.get(self.column)
+        prefix = re.split(r"[%_]", self.pattern, 1)[0]
+        if column_stats is None or column_stats['min_text'] is None or not prefix:
+            return True
+        # Every match starts with the prefix, so it lies in [prefix, prefix + U+10FFFF)
+        return column_stats['min_text'] < prefix + '\U0010ffff' and column_stats['max_text'] >= prefix
+
+
+class Not(Condition):
+    def __init__(self, child):
+        self.child = child
+
+    def selectivity(self):
+        return 1 - self.child.selectivity()
+
+    def columns(self):
+        return self.child.columns()
+
+    def compile(self, headers, types=None):
+        test = self.child.compile(headers, types)
+        return lambda row: not test(row)
+
+
+class And(Condition):
+    def __init__(self, children):
+        # Most selective first, so rows are rejected as early as possible
+        self.children = sorted(children, key=lambda child: child.selectivity())
+
+    def selectivity(self):
+        result = 1.0
+        for child in self.children:
+            result *= child.selectivity()
+        return result
+
+    def columns(self):
+        return set().union(*(child.columns() for child in self.children))
+
+    def compile(self, headers, types=None):
+        tests = [child.compile(headers, types) for child in self.children]
+        if len(tests) == 2:
+            first, second = tests
+            return lambda row: first(row) and second(row)
+
+        def test(row):
+            for t in tests:
+                if not t(row):
+                    return False
+            return True
+        return test
+
+    def can_match(self, stats):
+        return all(child.can_match(stats) for child in self.children)
+
+
+class Or(Condition):
+    def __init__(self, children):
+        # Least selective first, so rows are accepted as early as possible
+        self.children = sorted(children, key=lambda child: child.selectivity(), reverse=True)
+
+    def selectivity(self):
+        result = 1.0
+        for child in self.children:
+            result *= 1 - child.selectivity()
+        return 1 - result
+
+    def columns(self):
+        return set().union(*(child.columns() for child in self.children))
+
+    def compile(self, headers, types=None):
+        tests = [child.compile(headers, types) for child in self.children]
+        if len(tests) == 2:
+            first, second = tests
+            return lambda row: first(row) or second(row)
+
+        def test(row):
+            for t in tests:
+                if t(row):
+                    return True
+            return False
+        return test
+
+    def can_match(self, stats):
+        return any(child.can_match(stats) for child in self.children)
+
+
+class Parser:
+    """
+    Recursive descent parser over the tokens of a WHERE clause.
+    """
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.position = 0
+
+    def peek(self):
+        if self.position < len(self.tokens):
+            return self.tokens[self.position]
+        return None, None
+
+    def keyword(self):
+        kind, value = self.peek()
+        return value.upper() if kind == 'word' else None
+
+    def advance(self):
+        token = self.peek()
+        self.position += 1
+        return token
+
+    def expect(self, kind, value=None):
+        token_kind, token_value = self.advance()
+        if token_kind != kind or (value is not None and token_value.upper() != value):
+            raise ValueError(f"Expected {value or kind} in WHERE clause, found {token_value}")
+        return token_value
+
+    def at_end(self):
+        kind, value = self.peek()
+        return kind is None or value == ';' or self.keyword() in CLAUSE_END
+
+    def parse(self):
+        condition = self.parse_or()
+        if not self.at_end():
+            raise ValueError(f"Unexpected token in WHERE clause: {self.peek()[1]}")
+        return condition
+
+    def parse_or(self):
+        children = [self.parse_and()]
+        while self.keyword() == 'OR':
+            self.advance()
+            children.append(self.parse_and())
+        return children[0] if len(children) == 1 else Or(children)
+
+    def parse_and(self):
+        children = [self.parse_not()]
+        while self.keyword() == 'AND':
+            self.advance()
+            children.append(self.parse_not())
+        return children[0] if len(children) == 1 else And(children)
+
+    def parse_not(self):
+        if self.keyword() == 'NOT':
+            self.advance()
+            return Not(self.parse_not())
+        if self.peek() == ('punct', '('):
+            self.advance()
+            condition = self.parse_or()
+            self.expect('punct', ')')
+            return condition
+        return self.parse_predicate()
+
+    def parse_literal(self, allow_column=False):
+        kind, value = self.advance()
+        if kind not in ('string', 'word'):
+            raise ValueError(f"Expected a value in WHERE clause, found {value}")
+        if allow_column and kind == 'word' and re.fullmatch(r"[A-Za-z_]\w*\.[A-Za-z_]\w*", value):
+            return ColumnRef(value)
+        return Literal(value, kind == 'string')
+
+    def parse_predicate(self):
+        column = self.expect('word')
+        negate = False
+        if self.keyword() == 'NOT':
+            self.advance()
+            negate = True
+
+        keyword = self.keyword()
+        if keyword == 'IN':
+            self.advance()
+            self.expect('punct', '(')
+            literals = [self.parse_literal()]
+            while self.peek() == ('punct', ','):
+                self.advance()
+                literals.append(self.parse_literal())
+            self.expect('punct', ')')
+            condition = InList(column, literals)
+        elif keyword == 'BETWEEN':
+            self.advance()
+            low = self.parse_literal()
+            self.expect('word', 'AND')
+            condition = Between(column, low, self.parse_literal())
+        elif keyword == 'LIKE':
+            self.advance()
+            condition = Like(column, self.parse_literal().text)
+        elif negate:
+            raise ValueError("NOT must be followed by IN, BETWEEN or LIKE")
+        else:
+            op = self.expect('op')
+            condition = Comparison(column, op, self.parse_literal(allow_column=True))
+
+        return Not(condition) if negate else condition
+
+
+def conjuncts(condition):
+    """
+    Splits a condition into the operands of its top-level AND.
+    """
+    if isinstance(condition, And):
+        return list(condition.children)
+    return [condition]
+
+
+def rename_columns(condition, mapping):
+    """
+    Renames the columns a condition refers to, in place.
+    Args:
+        mapping (dict): Old column name -> new column name; others are kept.
+    """
+    if isinstance(condition, (And, Or)):
+        for child in condition.children:
+            rename_columns(child, mapping)
+    elif isinstance(condition, Not):
+        rename_columns(condition.child, mapping)
+    else:
+        condition.column = mapping.get(condition.column, condition.column)
+        if isinstance(getattr(condition, 'literal', None), ColumnRef):
+            condition.literal.column = mapping.get(condition.literal.column, condition.literal.column)
+    return condition
+
+
+def parse_where(sql_statement):
+    """
+    Parses the WHERE clause of a SQL statement.
+    Args:
+        sql_statement (str): The full SQL statement.
+    Returns:
+        Condition: The root of the condition tree, or None if there is no WHERE clause.
+    """
+    tokens = tokenize(sql_statement)
+    for position, (kind, value) in enumerate(tokens):
+        if kind == 'word' and value.upper() == 'WHERE':
+            return Parser(tokens[position + 1:]).parse()
+    return None
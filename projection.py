@@ -1,68 +1,129 @@
 #!/usr/bin/env python3
 import re
 import sys
+from collections import OrderedDict
+from columnar import ColumnarFile, format_value
+from counters import Counters
+from schema import table_schema
+
+# Number of distinct rows each SELECT DISTINCT mapper remembers
+MAX_DISTINCT_ROWS = 100000
 
 
 def parse_sql(sql_statement):
     """
     Parses a simple SQL statement to extract the column names and the table.
-    Assumes the SQL statement is of the form: SELECT column1, column2, ... FROM table; 
+    Assumes the SQL statement is of the form: SELECT [DISTINCT] column1, column2, ... FROM table; 
+    Returns:
+        tuple: (columns, table, distinct)
     """
     # Regular expression to match the columns and table name
-    match = re.search(r"SELECT\s+((?:\*|\w+(?:\s*,\s*\w+)*))(?:\s+FROM\s+(\w+))?", sql_statement, re.IGNORECASE)
+    match = re.search(r"SELECT\s+(DISTINCT\s+)?((?:\*|\w+(?:\s*,\s*\w+)*))(?:\s+FROM\s+(\w+))?", sql_statement, re.IGNORECASE)
 
     if match:
-        if match.group(1).strip() == '*':
+        if match.group(2).strip() == '*':
             columns = ['*']
         else:
-            columns = [col.strip() for col in match.group(1).split(',')]
-        table = match.group(2)
-        return columns, table
+            columns = [col.strip() for col in match.group(2).split(',')]
+        table = match.group(3)
+        return columns, table, match.group(1) is not None
     else:
         raise ValueError("Invalid SQL statement format")
 
 
-def mapper(columns):
-    headers = None
-    column_indices = None
+def distinct_rows(rows, max_rows=MAX_DISTINCT_ROWS):
+    """
+    Drops rows seen recently, remembering at most `max_rows` of them in LRU
+    order. Duplicates further apart than that are removed by the reducer.
+    """
+    seen = OrderedDict()
+    for row in rows:
+        if row in seen:
+            seen.move_to_end(row)
+            continue
+        seen[row] = None
+        if len(seen) > max_rows:
+            seen.popitem(last=False)
+        yield row
+
 
-    for line in sys.stdin:
+def projected_rows(columns, source=None, counters=None, table=None):
+    """
+    Yields the selected columns of every row as a CSV line. CSV input is read
+    with the table's entry in the schema registry (see schema.py), so only a
+    line equal to the registered header is skipped, in whichever split it is.
+    """
+    counters = counters if counters is not None else Counters('mapper')
+    if source is not None:
+        with ColumnarFile(source) as columnar_file:
+            selected = columnar_file.columns if columns == ['*'] else [col for col in columns if col in columnar_file.columns]
+            for chunks in columnar_file.read_row_groups(selected):
+                for values in zip(*[chunks[col] for col in selected]):
+                    yield ','.join([format_value(value) for value in values])
+            counters.bytes_in += columnar_file.bytes_read
+        return
+
+    schema = table_schema(table)
+    headers = schema['columns']
+    header_line, delimiter = schema['header'], schema['delimiter']
+    if columns == ['*']:
+        column_indices = [i for i in range(len(headers))]
+    else:
+        column_indices = [headers.index(col) for col in columns if col in headers]
+    for line in counters.lines(sys.stdin):
         line = line.strip()
-        if not line:
+        if not line or line == header_line:
             continue
 
-        if headers is None:
-            headers = line.split(',')
-            if columns == ['*']:
-                column_indices = [i for i in range(len(headers))]
-            else:
-                column_indices = [headers.index(col) for col in columns if col in headers]
-            continue
+        values = line.split(delimiter)
+        try:
+            selected_values = [values[i] for i in column_indices]
+        except IndexError:
+            counters.parse_errors += 1
+            continue  # Skip rows with missing fields
+        yield ','.join(selected_values)
 
-        values = line.split(',')
-        selected_values = [values[i] for i in column_indices]
-        projection = ','.join(selected_values)
-        print(f"{projection}\t{projection}")
+
+def mapper(columns, source=None, distinct=False, table=None):
+    """
+    Emits the selected columns of every row. A plain SELECT is map-only and
+    its output is final. For SELECT DISTINCT the rows are emitted as keys, with
+    recently seen duplicates dropped in the mapper, for the reducer to dedup.
+    Args:
+        source (str): Optional path of a columnar file (see columnar.py) to read
+            instead of CSV lines on stdin. Only the selected columns are decoded.
+        distinct (bool): Whether the statement is a SELECT DISTINCT.
+        table (str): The statement's table, looked up in the schema registry.
+    """
+    counters = Counters('mapper')
+    rows = counters.rows(projected_rows(columns, source, counters, table))
+    if distinct:
+        rows = distinct_rows(rows)
+    for projection in rows:
+        counters.emit(projection)
+    counters.report()
 
 
 def reducer():
+    """
+    Key-only reducer for SELECT DISTINCT. Its input is sorted, so every
+    duplicate directly follows the first copy of its row.
+    """
+    counters = Counters('reducer')
     last_key = None
 
-    for line in sys.stdin:
-        line = line.strip()
-        parts = line.split('\t', 1)
-
-        if len(parts) < 2:  # Check if the line is incorrectly formatted
-            continue  # Skip this line or handle the error differently
-
-        key, _ = parts
-
-        print(key)
+    for line in counters.rows(counters.lines(sys.stdin)):
+        key = line.rstrip('\n').split('\t', 1)[0]
+        if not key or key == last_key:
+            continue
+        last_key = key
+        counters.emit(key)
+    counters.report()
 
 
 if __name__ == "__main__":
     if len(sys.argv) < 3:
-        print("Usage: python projection.py <SQL statement> <mapper|reducer>")
+        print("Usage: python projection.py <SQL statement> <mapper|reducer> [columnar_file]")
         sys.exit(1)
 
     # Get the SQL statement from the command line argument
@@ -70,11 +131,11 @@ if __name__ == "__main__":
 
     print(f"SQL Statement Received: {sql_statement}", file=sys.stderr)  # Debugging line
 
-    columns, table = parse_sql(sql_statement)
+    columns, table, distinct = parse_sql(sql_statement)
 
     # Determine whether to run mapper or reducer
     if sys.argv[2] == 'mapper':
-        mapper(columns)
+        mapper(columns, sys.argv[3] if len(sys.argv) > 3 else None, distinct, table)
     elif sys.argv[2] == 'reducer':
         reducer()
     else:
@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+"""
+Single SQL front-end for queries over one table.
+
+plan_query() turns any of the statements projection.py, filter.py and
+groupby.py accept, or a mix of them such as
+    SELECT city, SUM(fare) FROM trips WHERE fare > 10 GROUPBY city
+into one logical plan. The WHERE clause and the set of referenced columns are
+pushed down into the scan, which skips zone map blocks and columnar row groups
+that cannot match and decodes only the referenced columns. The plan then runs
+as a single MapReduce job: a fused scan, filter and project (or aggregate)
+mapper, plus the groupby combiner and reducer for aggregates or a dedup
+reducer for SELECT DISTINCT. Other queries are map-only.
+"""
+import random
+import re
+import sys
+import groupby
+import vectorized
+from projection import distinct_rows, reducer as projection_reducer
+from columnar import ColumnarFile, format_value
+from counters import Counters
+from partitioning import RangeRouter
+from predicate import column_index, parse_where
+from schema import table_schema
+from top_n import parse_order_by, top_n, top_n_distinct
+from zone_maps import ScanStats, load_zone_map, scan_lines
+
+
+def plan_query(sql_statement):
+    """
+    Builds the logical plan of a single-table SELECT statement.
+    Returns:
+        dict: 'table'; 'where', the WHERE condition tree or None; 'columns',
+            the plain SELECT columns (['*'] for all); 'distinct', whether
+            duplicate output rows are removed; 'group_by', the
+            grouping columns; 'aggregations', (function, column, parameter)
+            tuples in SELECT order; 'order', the ORDER BY ... LIMIT (see
+            top_n.py) or None; and 'scan', the columns the scan has to read,
+            or None for all of them.
+    """
+    select_match = re.search(r"SELECT\s+(.*?)\s+FROM\s+(\w+)", sql_statement, re.IGNORECASE)
+    if not select_match:
+        raise ValueError("Invalid SQL statement format")
+
+    select_list = select_match.group(1)
+    distinct_match = re.match(r"DISTINCT\s+", select_list, re.IGNORECASE)
+    if distinct_match:
+        select_list = select_list[distinct_match.end():]
+
+    columns = []
+    aggregations = []
+    # Split on commas that are not inside parentheses, e.g. PERCENTILE(fare, 0.9)
+    for item in re.split(r",(?![^()]*\))", select_list):
+        item = item.strip()
+        agg_match = re.match(r"(\w+)\((.*?)\)$", item)
+        if agg_match:
+            aggregations.append(groupby.parse_aggregation(agg_match.group(1), agg_match.group(2)))
+        elif item:
+            columns.append(item)
+
+    group_by = []
+    group_by_match = re.search(r"GROUP\s*BY\s+(.*?)(?:\s+ORDER\s+BY\b|\s+LIMIT\b|$)", sql_statement, re.IGNORECASE)
+    if group_by_match:
+        group_by = [col.strip() for col in group_by_match.group(1).split(',')]
+    if group_by and not aggregations:
+        raise ValueError("GROUP BY needs at least one aggregation")
+    if aggregations and '*' in columns:
+        raise ValueError("SELECT * cannot be combined with aggregations")
+
+    where_clause = parse_where(sql_statement)
+    order = parse_order_by(sql_statement)
+    if (distinct_match and not aggregations and order is not None and order['column'] is not None
+            and '*' not in columns and order['column'] not in columns):
+        raise ValueError("ORDER BY of a SELECT DISTINCT must be one of the selected columns")
+
+    scan = None
+    if '*' not in columns:
+        scan = set(columns) | set(group_by)
+        scan |= {col for _, col, _ in aggregations if col != '*'}
+        if where_clause is not None:
+            scan |= where_clause.columns()
+        if order is not None and order['column'] is not None and not aggregations:
+            scan.add(order['column'])
+
+    return {
+        'table': select_match.group(2),
+        'where': where_clause,
+        'columns': columns,
+        'distinct': bool(distinct_match) and not aggregations,
+        'group_by': group_by,
+        'aggregations': aggregations,
+        'order': order,
+        'scan': scan,
+    }
+
+
+def read_schema(plan, source=None):
+    """
+    Returns the columns of the plan's table and, for CSV input, its entry in
+    the schema registry (see schema.py); a columnar file carries its own.
+    """
+    if source is not None:
+        with ColumnarFile(source) as columnar_file:
+            return columnar_file.columns, None
+    schema = table_schema(plan['table'])
+    return schema['columns'], schema
+
+
+def scan_rows(plan, headers, source=None, counters=None, schema=None):
+    """
+    Yields the rows of the input that pass the plan's WHERE clause, as lists
+    laid out like the headers. With a columnar source only the plan's scan
+    columns are decoded and the rest are None. CSV lines are split and typed
+    as the table's `schema` says.
+    """
+    counters = counters if counters is not None else Counters('mapper')
+    where_clause = plan['where']
+    types = schema['types'] if schema is not None else None
+    predicate = counters.predicate(where_clause.compile(headers, types)) if where_clause is not None else None
+    scan_stats = ScanStats()
+
+    if source is not None:
+        with ColumnarFile(source) as columnar_file:
+            needed = headers if plan['scan'] is None else [col for col in headers if col in plan['scan']]
+            for row in counters.rows(columnar_file.rows(needed, where_clause)):
+                if predicate is None or predicate(row):
+                    yield [format_value(value) if value is not None else None for value in row]
+            scan_stats.blocks_skipped = columnar_file.blocks_skipped
+            scan_stats.rows_skipped = columnar_file.rows_skipped
+            scan_stats.bytes_skipped = columnar_file.bytes_skipped
+            counters.bytes_in += columnar_file.bytes_read
+    else:
+        header_line, delimiter = schema['header'], schema['delimiter']
+        lines = (line.strip() for line in counters.lines(scan_lines(where_clause, load_zone_map(), scan_stats=scan_stats)))
+        for row in counters.rows(line.split(delimiter) for line in lines if line and line != header_line):
+            try:
+                if predicate is not None and not predicate(row):
+                    continue
+            except (IndexError, ValueError):
+                counters.parse_errors += 1
+                continue  # Skip rows with missing fields or values that do not fit the column type
+            yield row
+
+    if where_clause is not None:
+        scan_stats.report()
+
+
+def project_rows(rows, indices, counters, order_index=None):
+    """
+    Yields the selected fields of each row joined by commas or, with an
+    `order_index`, (ORDER BY value, joined fields) pairs. Rows too short to
+    hold the fields are skipped and counted as parse errors.
+    """
+    for row in rows:
+        try:
+            line = ','.join([row[i] for i in indices])
+            value = row[order_index] if order_index is not None else None
+        except IndexError:
+            counters.parse_errors += 1
+            continue
+        yield line if order_index is None else (value, line)
+
+
+def mapper(plan, source=None, router=None):
+    """
+    Fused mapper: scans the input, applies the WHERE clause and either emits
+    the projected rows or, for aggregates, the groupby partial states. With
+    NumPy installed, CSV scans without ORDER BY or DISTINCT run a batch at a
+    time (see vectorized.py).
+    Args:
+        source (str): Optional path of a columnar file (see columnar.py) to read
+            instead of CSV lines on stdin.
+        router (RangeRouter): Optional range partitioning of the group keys
+            (see partitioning.py).
+    """
+    if plan['aggregations']:
+        group_columns = plan['group_by'] or plan['columns']
+        groupby.mapper(plan['where'], group_columns, plan['table'], plan['group_by'],
+                       plan['aggregations'], source=source, router=router)
+        return
+
+    headers, schema = read_schema(plan, source)
+    if plan['columns'] == ['*']:
+        indices = list(range(len(headers)))
+    else:
+        unknown = [col for col in plan['columns'] if col not in headers]
+        if unknown:
+            raise ValueError(f"Unknown columns: {', '.join(unknown)}")
+        indices = [headers.index(col) for col in plan['columns']]
+
+    counters = Counters('mapper')
+    order = plan['order']
+    if source is None and order is None and not plan['distinct'] and vectorized.available():
+        scan_stats = ScanStats()
+        for lines in vectorized.select(plan['where'], schema, indices, scan_stats, counters):
+            counters.emit_lines(lines)
+        if plan['where'] is not None:
+            scan_stats.report()
+        counters.report()
+        return
+
+    if order is None:
+        rows = project_rows(scan_rows(plan, headers, source, counters, schema), indices, counters)
+        if plan['distinct']:
+            rows = distinct_rows(rows)
+        for row in rows:
+            counters.emit(row)
+        counters.report()
+        return
+
+    # With ORDER BY ... LIMIT each row goes out behind its ORDER BY value
+    order_index = column_index(headers, order['column']) if order['column'] is not None else 0
+    rows = project_rows(scan_rows(plan, headers, source, counters, schema), indices, counters, order_index)
+    choose = top_n_distinct if plan['distinct'] else top_n
+    for value, row in choose(rows, order, lambda row: row[0]):
+        counters.emit(f"{value}\t{row}")
+    counters.report()
+
+
+def sample(plan, fraction, source=None):
+    """
+    Sampling mapper for reducer planning: emits the group key of a random
+    `fraction` of the rows that pass the WHERE clause.
+    """
+    headers, schema = read_schema(plan, source)
+    indices = [headers.index(col) for col in plan['group_by'] or plan['columns'] if col in headers]
+    counters = Counters('mapper')
+    for key in project_rows(scan_rows(plan, headers, source, counters, schema), indices, counters):
+        if random.random() < fraction:
+            counters.emit(key)
+    counters.report()
+
+
+def range_partitioned(plan):
+    """
+    Returns whether a plan can spread its groups over range partitioned
+    reducers: aggregates without ORDER BY ... LIMIT, which needs one reducer.
+    """
+    return bool(plan['aggregations']) and plan['order'] is None
+
+
+def needs_reducer(plan):
+    """
+    Returns whether a plan needs a reduce phase; other plans run map-only.
+    """
+    return bool(plan['aggregations']) or plan['distinct'] or plan['order'] is not None
+
+
+def reducer_count(plan, num_reducers=None):
+    """
+    Returns the number of reduce tasks for a plan: ORDER BY ... LIMIT makes
+    its final merge in a single reducer.
+    """
+    return 1 if plan['order'] is not None else num_reducers
+
+
+def combiner(plan):
+    groupby.combiner(plan['aggregations'])
+
+
+def reducer(plan, ranged=False):
+    if plan['aggregations']:
+        groupby.reducer(plan['aggregations'], plan['order'], plan['group_by'] or plan['columns'], ranged)
+    elif plan['order'] is not None:
+        counters = Counters('reducer')
+        rows = (tuple(line.rstrip('\n').split('\t', 1)) for line in counters.rows(counters.lines(sys.stdin))
+                if '\t' in line)
+        # Hadoop sorts on the ORDER BY value only, so copies of a row need not be adjacent
+        choose = top_n_distinct if plan['distinct'] else top_n
+        for _, row in choose(rows, plan['order'], lambda row: row[0]):
+            counters.emit(row)
+        counters.report()
+    else:
+        projection_reducer()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print("Usage: python query.py <SQL statement> <mapper|combiner|reducer> [columnar_file|-] [partition_file]")
+        print("       python query.py <SQL statement> sample <fraction> [columnar_file]")
+        sys.exit(1)
+
+    # Get the SQL statement from the command line argument
+    sql_statement = sys.argv[1]
+
+    print(f"SQL Statement Received: {sql_statement}", file=sys.stderr)  # Debugging line
+
+    plan = plan_query(sql_statement)
+
+    # '-' reads CSV from stdin; a partition file turns on range partitioning
+    source = sys.argv[3] if len(sys.argv) > 3 and sys.argv[3] != '-' else None
+    partition_file = sys.argv[4] if len(sys.argv) > 4 else None
+
+    if sys.argv[2] == 'mapper':
+        mapper(plan, source, RangeRouter(partition_file) if partition_file else None)
+    elif sys.argv[2] == 'combiner':
+        combiner(plan)
+    elif sys.argv[2] == 'reducer':
+        reducer(plan, ranged=partition_file is not None)
+    elif sys.argv[2] == 'sample':
+        sample(plan, float(sys.argv[3]), sys.argv[4] if len(sys.argv) > 4 else None)
+    else:
+        print("Invalid argument. Use 'mapper', 'combiner', 'reducer' or 'sample'.")
@@ -0,0 +1,150 @@
+"""
+Persistent cache of query results.
+
+A result is stored under a key made from the normalised SQL statement and a
+fingerprint of the query's inputs: the modification time, length and checksum
+of every input file. A repeated query on unchanged inputs is answered from
+the cache without running a job. Any change to an input changes its
+fingerprint, and looking up a query drops the entries stored for older
+versions of the same inputs. The cache is kept under CACHE_MAX_BYTES by
+evicting the least recently used results.
+"""
+import glob
+import hashlib
+import json
+import os
+import re
+import shutil
+import zlib
+
+CACHE_DIR = os.path.expanduser('~/.hadoop_sql_cache')
+CACHE_MAX_BYTES = 1024 * 1024 * 1024
+
+# Words whose case does not matter; column and table names are case sensitive
+SQL_KEYWORDS = {
+    'SELECT', 'FROM', 'WHERE', 'AND', 'OR', 'NOT', 'IN', 'BETWEEN', 'LIKE', 'IS', 'NULL',
+    'GROUP', 'GROUPBY', 'BY', 'ORDER', 'LIMIT', 'ASC', 'DESC', 'DISTINCT', 'AS',
+    'INNER', 'JOIN', 'ON', 'SUM', 'AVG', 'MIN', 'MAX', 'COUNT', 'MEDIAN', 'PERCENTILE',
+}
+
+
+def normalize_sql(sql_statement):
+    """
+    Normalises a SQL statement for use as a cache key: runs of whitespace
+    become one space, keywords are upper-cased and a trailing ';' is dropped.
+    Quoted literals are left untouched.
+    """
+    parts = re.split(r"('(?:[^']|'')*'|\"[^\"]*\")", sql_statement.strip().rstrip(';').strip())
+    for i in range(0, len(parts), 2):
+        text = re.sub(r'\s+', ' ', parts[i])
+        text = re.sub(r'\s*([(),=<>!]+)\s*', r'\1', text)
+        parts[i] = re.sub(r'\w+', lambda m: m.group(0).upper() if m.group(0).upper() in SQL_KEYWORDS else m.group(0), text)
+    return ''.join(parts)
+
+
+def file_checksum(path):
+    """
+    Returns the CRC32 of a local file's contents.
+    """
+    crc = 0
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            crc = zlib.crc32(block, crc)
+    return f"{crc:08x}"
+
+
+def local_fingerprint(path, cache_dir=CACHE_DIR):
+    """
+    Fingerprints a local file, or every file under a directory, as lines of
+    "path mtime length checksum". Checksums are remembered per (path, mtime,
+    length) in the cache directory, so unchanged files are not read again.
+    """
+    if os.path.isdir(path):
+        files = sorted(os.path.join(root, name) for root, _, names in os.walk(path) for name in names)
+    else:
+        files = [path]
+
+    checksums_path = os.path.join(cache_dir, '_checksums.json')
+    try:
+        with open(checksums_path) as f:
+            checksums = json.load(f)
+    except (OSError, ValueError):
+        checksums = {}
+
+    lines = []
+    changed = False
+    for file_path in files:
+        stat = os.stat(file_path)
+        stamp = f"{os.path.abspath(file_path)} {stat.st_mtime_ns} {stat.st_size}"
+        if stamp not in checksums:
+            checksums[stamp] = file_checksum(file_path)
+            changed = True
+        lines.append(f"{stamp} {checksums[stamp]}")
+
+    if changed:
+        os.makedirs(cache_dir, exist_ok=True)
+        # Forget the checksums of older versions of these files
+        current = {line.rsplit(' ', 1)[0] for line in lines}
+        paths = {os.path.abspath(file_path) for file_path in files}
+        checksums = {stamp: value for stamp, value in checksums.items()
+                     if stamp in current or stamp.rsplit(' ', 2)[0] not in paths}
+        with open(checksums_path, 'w') as f:
+            json.dump(checksums, f)
+    return '\n'.join(lines)
+
+
+def _digest(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()[:32]
+
+
+def cache_entry(sql_statement, inputs, fingerprint=local_fingerprint, cache_dir=CACHE_DIR):
+    """
+    Returns the path under which the result of a query on its current inputs
+    is cached, whether or not it exists yet. Entries for other versions of
+    the same inputs are deleted.
+    Args:
+        sql_statement (str): SQL statement of the query.
+        inputs (list): Input paths of the query.
+        fingerprint (function): Maps an input path to a text that changes
+            whenever the input does.
+        cache_dir (str): Directory holding the cache.
+    """
+    inputs_key = _digest('\n'.join(inputs))
+    version_key = _digest('\n'.join(fingerprint(path) for path in inputs))
+    for path in glob.glob(os.path.join(cache_dir, f"{inputs_key}-*.out")):
+        if not os.path.basename(path).startswith(f"{inputs_key}-{version_key}-"):
+            os.remove(path)
+    return os.path.join(cache_dir, f"{inputs_key}-{version_key}-{_digest(normalize_sql(sql_statement))}.out")
+
+
+def load_result(entry):
+    """
+    Returns the cached result file of an entry, or None on a miss. A hit marks
+    the entry as recently used.
+    """
+    if not os.path.exists(entry):
+        return None
+    os.utime(entry)
+    return entry
+
+
+def store_result(entry, result_path, max_bytes=CACHE_MAX_BYTES):
+    """
+    Moves a result file into the cache and evicts the least recently used
+    entries until the cache is at most `max_bytes`.
+    Returns:
+        str: The path of the cached result.
+    """
+    os.makedirs(os.path.dirname(entry), exist_ok=True)
+    shutil.move(result_path, entry)
+    os.utime(entry)
+    entries = sorted(glob.glob(os.path.join(os.path.dirname(entry), '*.out')), key=os.path.getmtime)
+    total = sum(os.path.getsize(path) for path in entries)
+    for path in entries:
+        if total <= max_bytes:
+            break
+        if path == entry:
+            continue
+        total -= os.path.getsize(path)
+        os.remove(path)
+    return entry
@@ -0,0 +1,182 @@
+"""
+Schema registry.
+
+schemas.json holds, for every table, the column names, the type of each
+column (int, float or str), the field delimiter and the file's header line
+exactly as written. A table is registered when its file is imported
+(import_data.py, main.py), with the types inferred from its first
+SCHEMA_SAMPLE_ROWS rows. Jobs ship schemas.json to their tasks with -files,
+and the mappers look their table up once per task: column indices and types
+are resolved before the first row, only the line equal to the registered
+header is skipped, whichever split it is in, and WHERE clauses treat empty
+fields as nulls (see predicate.py). The types are inferred from a sample, so
+they are hints: a field of an int column may still turn out to be a word.
+
+    python3 schema.py tripdata.csv trips     # register tripdata.csv as table trips
+    python3 schema.py                        # list the registered tables
+"""
+import csv
+import json
+import os
+import sys
+from itertools import islice
+
+SCHEMA_FILE = 'schemas.json'
+# Rows read to infer the column types
+SCHEMA_SAMPLE_ROWS = 10000
+# Candidate delimiters, most likely first
+DELIMITERS = ',\t;|'
+NUMERIC_TYPES = {'int', 'float'}
+
+
+def infer_type(values):
+    """
+    Returns the narrowest of int, float and str that holds every value.
+    Empty values are nulls and do not decide the type; a column of nulls is str.
+    """
+    kind = None
+    for value in values:
+        if value == '':
+            continue
+        if kind in (None, 'int'):
+            try:
+                int(value)
+                kind = 'int'
+                continue
+            except ValueError:
+                kind = 'float'
+        try:
+            float(value)
+        except ValueError:
+            return 'str'
+    return kind or 'str'
+
+
+def sniff_delimiter(header_line):
+    """
+    Picks the candidate delimiter that occurs most often in the header line.
+    """
+    counts = [(header_line.count(delimiter), -i, delimiter) for i, delimiter in enumerate(DELIMITERS)]
+    count, _, delimiter = max(counts)
+    return delimiter if count else ','
+
+
+def infer_schema(lines, file_name, delimiter=None, sample_rows=SCHEMA_SAMPLE_ROWS):
+    """
+    Infers a table's schema from its lines, the header line first.
+    Args:
+        lines (iterable): Text lines of the table's file.
+        file_name (str): Base name of the table's file.
+        delimiter (str): Field delimiter; sniffed from the header line when None.
+    Returns:
+        dict: 'file', 'columns', 'types', 'delimiter' and 'header'.
+    """
+    lines = iter(lines)
+    header = next(lines, '').rstrip('\r\n')
+    # A byte order mark stays in the header line, which is matched as written
+    names = header[1:] if header.startswith('\ufeff') else header
+    if not names:
+        raise ValueError(f"{file_name} has no header line")
+    delimiter = delimiter or sniff_delimiter(names)
+    columns = [column.strip() for column in next(csv.reader([names], delimiter=delimiter))]
+
+    samples = [[] for _ in columns]
+    for line in islice(lines, sample_rows):
+        for sample, field in zip(samples, line.rstrip('\r\n').split(delimiter)):
+            sample.append(field.strip())
+    return {
+        'file': file_name,
+        'columns': columns,
+        'types': [infer_type(sample) for sample in samples],
+        'delimiter': delimiter,
+        'header': header,
+    }
+
+
+def load_registry(path=SCHEMA_FILE):
+    """
+    Returns {table: schema} from a registry file, empty when there is none.
+    """
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def register(table, schema, path=SCHEMA_FILE):
+    """
+    Adds or replaces a table's schema in the registry file.
+    """
+    registry = load_registry(path)
+    registry[table] = schema
+    with open(path, 'w') as f:
+        json.dump(registry, f, indent=2)
+    return schema
+
+
+def register_file(data_file, table=None, path=SCHEMA_FILE, delimiter=None):
+    """
+    Infers the schema of a local CSV file and registers it, by default under
+    the file's name without its extension.
+    """
+    file_name = os.path.basename(data_file)
+    table = table or os.path.splitext(file_name)[0]
+    with open(data_file, 'r', encoding='utf-8', newline='') as f:
+        return register(table, infer_schema(f, file_name, delimiter), path)
+
+
+def table_schema(table=None, path=SCHEMA_FILE):
+    """
+    Looks a table up in the registry: by name, then by the file the task is
+    reading (the mapreduce_map_input_file Hadoop streaming sets), which is the
+    table's file or one of the chunks bulk_load.py cut it into, then, with a
+    single registered table, that one.
+    """
+    registry = load_registry(path)
+    if table in registry:
+        return registry[table]
+    input_file = os.environ.get('mapreduce_map_input_file') or os.environ.get('map_input_file')
+    if input_file:
+        file_name = os.path.basename(input_file)
+        for schema in registry.values():
+            if file_name == schema['file'] or file_name in schema.get('parts', ()):
+                return schema
+    if len(registry) == 1:
+        return next(iter(registry.values()))
+    raise ValueError(f"No schema for table {table} in {path}; register it with: python3 schema.py <file> {table}")
+
+
+def table_of_file(data_file, path=SCHEMA_FILE):
+    """
+    Returns the name of the table a data file holds: for one of the chunks
+    bulk_load.py cuts a table into (e.g. views.csv/views.00001.csv), the
+    table it is registered under or else the name of its directory; for any
+    other file, its name without the extension.
+    """
+    file_name = os.path.basename(data_file)
+    for table, schema in load_registry(path).items():
+        if file_name in schema.get('parts', ()):
+            return table
+    directory = os.path.basename(os.path.dirname(data_file))
+    if directory.endswith('.csv'):
+        return os.path.splitext(directory)[0]
+    return os.path.splitext(file_name)[0]
+
+
+def column_types(schema, columns):
+    """
+    Returns the types of the named columns of a schema.
+    """
+    return [schema['types'][schema['columns'].index(column)] for column in columns]
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        schema = register_file(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else None)
+        print(f"Registered {sys.argv[1]}: " + ', '.join(f"{column} {kind}" for column, kind in
+                                                         zip(schema['columns'], schema['types'])))
+        sys.exit(0)
+
+    for table, schema in load_registry().items():
+        print(f"{table} ({schema['file']}, {schema['delimiter']!r}): " +
+              ', '.join(f"{column} {kind}" for column, kind in zip(schema['columns'], schema['types'])))
@@ -0,0 +1,430 @@
+#!/usr/bin/env python3
+"""
+Secondary indexes.
+
+`CREATE INDEX ON trips (trip_id)` builds a sorted index of a column with a
+MapReduce job; `CREATE HASH INDEX ON trips (trip_id)` builds a hash index,
+which serves = and IN but not ranges. The mapper reads its split with the
+byte offset of every line, which Hadoop streaming passes before a tab when
+stream.map.input.ignoreKey is false, and emits
+    <key>\t<file>\t<offset>\t<length>
+for every row with a value in the column. The key is the value encoded so
+that text order is value order (see sort_key), with the values of a numeric
+column that are not numbers after all the numbers; a hash index prefixes it
+with the value's bucket. A single reducer writes the entries in key order, and
+save_index() stores them in INDEX_DIR as <table>.<column>.idx, next to
+<table>.<column>.json: the column's type, the entry count, the fingerprint of
+the data the index was built from and either a fence (key, offset) every
+FENCE_ENTRIES entries of a sorted index or the byte range of every bucket of
+a hash index.
+
+find_index() derives key ranges from the conjuncts of a WHERE clause on an
+indexed column (=, IN, BETWEEN, <, <=, >, >=) and uses the index when they
+cover at most INDEX_MAX_FRACTION of its entries. The rows are then read with
+seeks into the data files (read_records) and the whole WHERE clause is
+checked on them, so the index only has to find a superset of the matches.
+An index whose fingerprint no longer matches the table's data is dropped and
+the query scans the table.
+"""
+import bisect
+import glob
+import json
+import os
+import re
+import struct
+import sys
+import urllib.parse
+import urllib.request
+import zlib
+from itertools import groupby
+from operator import itemgetter
+
+from counters import Counters
+from predicate import Between, ColumnRef, Comparison, InList, column_index, conjuncts
+from schema import NUMERIC_TYPES, column_types, table_schema
+
+INDEX_DIR = 'indexes'
+# A sorted index keeps the key and offset of every FENCE_ENTRIES-th entry
+FENCE_ENTRIES = 1024
+HASH_BUCKETS = 4096
+# Above this fraction of the entries, scanning the table is cheaper than seeking
+INDEX_MAX_FRACTION = 0.05
+# Records less than this far apart in a data file are read with one request
+COALESCE_BYTES = 64 * 1024
+WEBHDFS_URL = os.environ.get('WEBHDFS_URL', 'http://localhost:9870/webhdfs/v1')
+# Prefix of the keys of a numeric column's values that are not numbers; it
+# sorts after the hex digits of the numbers' keys
+UNPARSED = '~'
+
+
+def parse_create_index(sql_statement):
+    """
+    Parses CREATE [SORTED|HASH] INDEX ON <table> (<column>).
+    Returns:
+        tuple: (kind, table, column), kind being 'sorted' or 'hash'.
+    """
+    match = re.match(r"\s*CREATE\s+(?:(SORTED|HASH)\s+)?INDEX\s+ON\s+(\w+)\s*\(\s*(\w+)\s*\)",
+                     sql_statement, re.IGNORECASE)
+    if not match:
+        raise ValueError("Invalid CREATE INDEX statement, expected CREATE [HASH] INDEX ON <table> (<column>)")
+    return (match.group(1) or 'sorted').lower(), match.group(2), match.group(3)
+
+
+def sort_key(value, column_type):
+    """
+    Encodes a value so that comparing encodings as text compares the values.
+    Numbers become the 16 hex digits of their IEEE 754 bits, with the sign
+    bit flipped and negative numbers inverted; text stays as it is. A value
+    of a numeric column that is not a number is kept behind UNPARSED, since
+    an unquoted number compares with it as text (see predicate.py).
+    """
+    if column_type not in NUMERIC_TYPES:
+        return value
+    try:
+        # Adding 0.0 turns -0.0 into 0.0, so both have one key
+        number = float(value) + 0.0
+    except ValueError:
+        return UNPARSED + value
+    bits = struct.unpack('>Q', struct.pack('>d', number))[0]
+    bits = bits ^ 0xFFFFFFFFFFFFFFFF if bits >> 63 else bits | 1 << 63
+    return f"{bits:016x}"
+
+
+def bucket_of(key):
+    return f"{zlib.crc32(key.encode('utf-8')) % HASH_BUCKETS:05d}"
+
+
+def index_key(value, kind, column_type):
+    key = sort_key(value, column_type)
+    return f"{bucket_of(key)}:{key}" if kind == 'hash' else key
+
+
+def index_path(table, column, index_dir=INDEX_DIR):
+    return os.path.join(index_dir, f"{table}.{column}.idx")
+
+
+def meta_path(table, column, index_dir=INDEX_DIR):
+    return os.path.join(index_dir, f"{table}.{column}.json")
+
+
+def mapper(kind, table, column):
+    """
+    Emits an index entry for every row of the split with a value in the
+    column. Input lines are <byte offset>\t<line>.
+    """
+    schema = table_schema(table)
+    i = column_index(schema['columns'], column)
+    column_type = schema['types'][i]
+    header_line, delimiter = schema['header'], schema['delimiter']
+    input_file = os.environ.get('mapreduce_map_input_file') or os.environ.get('map_input_file')
+
+    counters = Counters('mapper')
+    records = (line.rstrip('\r\n').split('\t', 1) for line in counters.lines(sys.stdin))
+    for offset, line in counters.rows(record for record in records if len(record) == 2):
+        if not line.strip() or line == header_line:
+            continue
+        try:
+            value = line.strip().split(delimiter)[i]
+            key = index_key(value, kind, column_type) if value != '' and '\t' not in value else None
+        except IndexError:
+            counters.parse_errors += 1
+            continue  # Skip rows with missing fields
+        if key is None:
+            counters.rows_filtered += 1
+            continue  # Nulls are not indexed
+        counters.emit(f"{key}\t{input_file}\t{offset}\t{len(line.encode('utf-8'))}")
+    counters.report()
+
+
+def reducer():
+    """
+    Writes the entries, which arrive sorted by key.
+    """
+    counters = Counters('reducer')
+    for line in counters.rows(counters.lines(sys.stdin)):
+        counters.emit(line.rstrip('\n'))
+    counters.report()
+
+
+def save_index(sql_statement, lines, fingerprint, index_dir=INDEX_DIR):
+    """
+    Stores the sorted entries of an index build in INDEX_DIR, with its fences
+    or bucket ranges.
+    Args:
+        sql_statement (str): The CREATE INDEX statement.
+        lines (iterable): The index job's output lines, in key order.
+        fingerprint (str): Fingerprint of the table's data the job read.
+    Returns:
+        dict: The index's metadata.
+    """
+    kind, table, column = parse_create_index(sql_statement)
+    column_type = column_types(table_schema(table), [column])[0]
+    meta = {'table': table, 'column': column, 'kind': kind, 'type': column_type, 'entries': 0,
+            'fingerprint': fingerprint}
+    fences = []
+    buckets = {}
+    os.makedirs(index_dir, exist_ok=True)
+    path = index_path(table, column, index_dir)
+    offset = 0
+    with open(path + '.tmp', 'wb') as out:
+        for line in lines:
+            line = line.rstrip('\n')
+            if not line:
+                continue
+            key = line.split('\t', 1)[0]
+            data = (line + '\n').encode('utf-8')
+            if kind == 'hash':
+                start, length = buckets.get(key.split(':', 1)[0], (offset, 0))
+                buckets[key.split(':', 1)[0]] = (start, length + len(data))
+            elif meta['entries'] % FENCE_ENTRIES == 0:
+                fences.append((key, offset))
+            out.write(data)
+            offset += len(data)
+            meta['entries'] += 1
+    os.replace(path + '.tmp', path)
+
+    meta['bytes'] = offset
+    if kind == 'hash':
+        meta['buckets'] = buckets
+    else:
+        meta['fences'] = fences
+    # The metadata is written last, so an index with metadata is complete
+    with open(meta_path(table, column, index_dir), 'w') as f:
+        json.dump(meta, f)
+    print(f"Index {table}.{column} ({kind}): {meta['entries']} entries, {offset} bytes", file=sys.stderr)
+    return meta
+
+
+def table_indexes(table, index_dir=INDEX_DIR):
+    """
+    Returns the metadata of the indexes of a table.
+    """
+    indexes = []
+    for path in sorted(glob.glob(os.path.join(index_dir, f"{glob.escape(table)}.*.json"))):
+        with open(path, 'r') as f:
+            meta = json.load(f)
+        if meta['table'] == table:
+            indexes.append(meta)
+    return indexes
+
+
+def drop_index(table, column, index_dir=INDEX_DIR):
+    for path in (meta_path(table, column, index_dir), index_path(table, column, index_dir)):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def drop_indexes(table, index_dir=INDEX_DIR):
+    """
+    Drops every index of a table, e.g. when its data is loaded again.
+    """
+    for meta in table_indexes(table, index_dir):
+        drop_index(table, meta['column'], index_dir)
+
+
+def local_fingerprint(paths):
+    """
+    Fingerprints local files by their path, modification time and length.
+    """
+    return '\n'.join(sorted(f"{path} {os.stat(path).st_mtime_ns} {os.path.getsize(path)}" for path in paths))
+
+
+def intersect(ranges, others):
+    """
+    Intersects two lists of (low, high) key ranges, None being an open end.
+    """
+    result = []
+    for low, high in ranges:
+        for other_low, other_high in others:
+            new_low = other_low if low is None else low if other_low is None else max(low, other_low)
+            new_high = other_high if high is None else high if other_high is None else min(high, other_high)
+            if new_low is None or new_high is None or new_low <= new_high:
+                result.append((new_low, new_high))
+    return result
+
+
+def key_ranges(condition, column, column_type):
+    """
+    Derives, from the conjuncts of a WHERE clause on `column`, key ranges
+    that hold every matching row: a list of (low, high), None being an open
+    end, and empty when no row can match.
+    Returns None when no conjunct narrows the column down. Strict bounds are
+    kept inclusive, since the WHERE clause is checked on the rows anyway.
+    """
+    numeric = column_type in NUMERIC_TYPES
+    # < and <= compare the non-numbers of a numeric column as text, so their
+    # keys are read along with the range
+    unparsed = [(UNPARSED, None)] if numeric else []
+
+    def key(literal):
+        # Quoted text compares as text and an unquoted number as a number;
+        # only the column's own order narrows it down
+        if numeric:
+            return None if literal.number is None else sort_key(literal.number, column_type)
+        return literal.text if literal.number is None else None
+
+    ranges = None
+    for conjunct in conjuncts(condition):
+        if getattr(conjunct, 'column', None) != column:
+            continue
+        if isinstance(conjunct, Comparison):
+            if isinstance(conjunct.literal, ColumnRef) or conjunct.op == '!=' or key(conjunct.literal) is None:
+                continue
+            bound = key(conjunct.literal)
+            found = [{'=': (bound, bound), '<': (None, bound), '<=': (None, bound),
+                      '>': (bound, None), '>=': (bound, None)}[conjunct.op]]
+            if conjunct.op in ('<', '<='):
+                found += unparsed
+        elif isinstance(conjunct, InList):
+            keys = [key(literal) for literal in conjunct.literals]
+            if None in keys:
+                continue
+            found = [(bound, bound) for bound in sorted(set(keys))]
+        elif isinstance(conjunct, Between):
+            low, high = key(conjunct.low), key(conjunct.high)
+            if low is None or high is None:
+                continue
+            found = [(low, high)]
+        else:
+            continue
+        ranges = found if ranges is None else intersect(ranges, found)
+    return ranges
+
+
+def index_segments(meta, ranges):
+    """
+    Returns the byte ranges of the index file that hold the entries in the
+    key ranges, as (start, end, low, high), or None when a hash index cannot
+    serve them.
+    """
+    if meta['kind'] == 'hash':
+        if any(low is None or low != high for low, high in ranges):
+            return None
+        segments = []
+        for low, _ in ranges:
+            bucket = bucket_of(low)
+            if bucket in meta['buckets']:
+                start, length = meta['buckets'][bucket]
+                key = f"{bucket}:{low}"
+                segments.append((start, start + length, key, key))
+        return segments
+
+    keys = [key for key, _ in meta['fences']]
+    segments = []
+    for low, high in ranges:
+        # Entries equal to `low` may start before the first fence whose key is `low`
+        first = max(bisect.bisect_left(keys, low) - 1, 0) if low is not None else 0
+        last = bisect.bisect_right(keys, high) if high is not None else len(keys)
+        if last > first:
+            end = meta['fences'][last][1] if last < len(keys) else meta['bytes']
+            segments.append((meta['fences'][first][1], end, low, high))
+    return segments
+
+
+def find_index(condition, table, schema, fingerprint, index_dir=INDEX_DIR):
+    """
+    Looks the rows a WHERE clause needs up in the table's indexes.
+    Args:
+        condition (Condition): The WHERE clause.
+        table (str): The table name.
+        schema (dict): The table's schema (see schema.py).
+        fingerprint (function): Returns the current fingerprint of the
+            table's data; an index built from other data is dropped.
+    Returns:
+        list: Sorted (file, offset, length) of the candidate rows, or None
+            when no index narrows the clause down enough to pay off.
+    """
+    best = None
+    current = None
+    for meta in table_indexes(table, index_dir):
+        if meta['column'] not in schema['columns']:
+            continue
+        ranges = key_ranges(condition, meta['column'], meta['type'])
+        if ranges is None:
+            continue
+        segments = index_segments(meta, ranges)
+        if segments is None:
+            continue
+        current = current if current is not None else fingerprint()
+        if meta['fingerprint'] != current:
+            drop_index(table, meta['column'], index_dir)
+            print(f"Dropped index {table}.{meta['column']}: the table's data changed since it was built",
+                  file=sys.stderr)
+            continue
+        estimate = sum(end - start for start, end, _, _ in segments) * meta['entries'] / max(meta['bytes'], 1)
+        if estimate <= INDEX_MAX_FRACTION * meta['entries'] and (best is None or estimate < best[0]):
+            best = (estimate, meta, segments)
+    if best is None:
+        return None
+
+    _, meta, segments = best
+    locations = set()
+    with open(index_path(table, meta['column'], index_dir), 'rb') as f:
+        for start, end, low, high in segments:
+            f.seek(start)
+            for line in f.read(end - start).decode('utf-8').splitlines():
+                key, file, offset, length = line.split('\t')
+                if (low is None or key >= low) and (high is None or key <= high):
+                    locations.add((file, int(offset), int(length)))
+    print(f"Using index {table}.{meta['column']}: {len(locations)} of {meta['entries']} rows to read",
+          file=sys.stderr)
+    return sorted(locations)
+
+
+def read_range(file, offset, length):
+    """
+    Reads `length` bytes at `offset` of a local file, or of an HDFS file
+    through WebHDFS.
+    """
+    parsed = urllib.parse.urlparse(file)
+    if parsed.scheme in ('', 'file') or len(parsed.scheme) == 1:
+        with open(parsed.path if parsed.scheme == 'file' else file, 'rb') as f:
+            f.seek(offset)
+            return f.read(length)
+    url = f"{WEBHDFS_URL}{urllib.parse.quote(parsed.path)}?op=OPEN&offset={offset}&length={length}"
+    with urllib.request.urlopen(url) as response:
+        return response.read()
+
+
+def read_records(locations):
+    """
+    Yields the lines at sorted (file, offset, length) locations. Records
+    less than COALESCE_BYTES apart are read with one seek or request.
+    """
+    for file, records in groupby(locations, key=itemgetter(0)):
+        run = []
+        for record in records:
+            if run and record[1] - (run[-1][1] + run[-1][2]) > COALESCE_BYTES:
+                yield from read_run(file, run)
+                run = []
+            run.append(record)
+        if run:
+            yield from read_run(file, run)
+
+
+def read_run(file, run):
+    start = run[0][1]
+    data = read_range(file, start, max(offset + length for _, offset, length in run) - start)
+    for _, offset, length in run:
+        yield data[offset - start:offset - start + length].decode('utf-8')
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 2 and sys.argv[1] == 'list':
+        for path in sorted(glob.glob(os.path.join(INDEX_DIR, '*.json'))):
+            with open(path, 'r') as f:
+                meta = json.load(f)
+            print(f"{meta['table']}.{meta['column']} ({meta['kind']}, {meta['type']}): {meta['entries']} entries")
+        sys.exit(0)
+    if len(sys.argv) < 3:
+        print("Usage: python secondary_index.py <CREATE INDEX statement> <mapper|reducer>\n"
+              "       python secondary_index.py list")
+        sys.exit(1)
+
+    kind, table, column = parse_create_index(sys.argv[1])
+    if sys.argv[2] == 'mapper':
+        mapper(kind, table, column)
+    elif sys.argv[2] == 'reducer':
+        reducer()
+    else:
+        print("Invalid argument. Use 'mapper' or 'reducer'.")
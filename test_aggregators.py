@@ -0,0 +1,94 @@
+import random
+
+import pytest
+
+from aggregators import (HLL_SPARSE_LIMIT, TDIGEST_DELTA, CountDistinctAgg, PercentileAgg, decode_accumulator,
+                         new_accumulator)
+
+
+def fold(func, values, param=None):
+    state = new_accumulator(func, param)
+    for value in values:
+        state.update(value)
+    return state
+
+
+def split_and_merge(func, values, parts, param=None):
+    """
+    Folds `values` in `parts` slices, sends each through encode/decode as
+    the shuffle does, and merges them.
+    """
+    size = len(values) // parts + 1
+    states = [decode_accumulator(func, fold(func, values[i:i + size], param).encode())
+              for i in range(0, len(values), size)]
+    merged = states[0]
+    for state in states[1:]:
+        merged.merge(state)
+    return merged
+
+
+@pytest.mark.parametrize('func, expected', [
+    ('SUM', 14.5), ('COUNT', 4), ('AVG', 3.625), ('MIN', -1.5), ('MAX', 8.0),
+])
+def test_exact_aggregates(func, expected):
+    values = [3.0, -1.5, 8.0, 5.0]
+    assert fold(func, values).result() == expected
+    assert split_and_merge(func, values, 3).result() == expected
+
+
+def test_encoded_states_hold_no_separators():
+    for func in ('SUM', 'COUNT', 'AVG', 'MIN', 'MAX'):
+        assert not set(fold(func, [1.0, 2.0]).encode()) & {',', '\t'}
+    distinct = fold('COUNT_DISTINCT', [str(i) for i in range(5000)])
+    assert not set(distinct.encode()) & {',', '\t'}
+    assert not set(fold('PERCENTILE', [float(i) for i in range(1000)], 0.5).encode()) & {',', '\t'}
+
+
+def test_empty_avg_is_zero():
+    assert new_accumulator('AVG').result() == 0
+
+
+def test_count_distinct_is_exact_enough_when_small():
+    assert fold('COUNT_DISTINCT', ['a', 'b', 'a', 'c', 'b']).result() == 3
+
+
+@pytest.mark.parametrize('distinct', [1000, 50000])
+def test_count_distinct_error_is_small(distinct):
+    values = [f"user{i % distinct}" for i in range(distinct * 2)]
+    estimate = split_and_merge('COUNT_DISTINCT', values, 4).result()
+    assert abs(estimate - distinct) / distinct < 0.05
+
+
+def test_count_distinct_turns_dense_and_back_through_encoding():
+    state = fold('COUNT_DISTINCT', [str(i) for i in range(HLL_SPARSE_LIMIT * 4)])
+    assert state.registers is not None
+    assert state.encode().startswith('d')
+    assert CountDistinctAgg.decode(state.encode()).result() == state.result()
+
+
+def test_count_distinct_merges_sparse_into_dense():
+    dense = fold('COUNT_DISTINCT', [str(i) for i in range(20000)])
+    sparse = fold('COUNT_DISTINCT', ['x', 'y'])
+    dense.merge(sparse)
+    sparse.merge(fold('COUNT_DISTINCT', [str(i) for i in range(20000)]))
+    assert dense.result() == sparse.result()
+
+
+@pytest.mark.parametrize('quantile', [0.1, 0.5, 0.9, 0.99])
+def test_percentile_error_is_small(quantile):
+    rng = random.Random(7)
+    values = [rng.gauss(100, 15) for _ in range(20000)]
+    exact = sorted(values)[int(quantile * (len(values) - 1))]
+    estimate = split_and_merge('PERCENTILE', values, 5, quantile).result()
+    assert abs(estimate - exact) < 1.0
+
+
+def test_percentile_keeps_few_centroids():
+    state = fold('PERCENTILE', [float(i) for i in range(100000)], 0.5)
+    state.result()
+    assert len(state.centroids) < 10 * TDIGEST_DELTA
+
+
+def test_percentile_of_one_value_and_of_nothing():
+    assert fold('PERCENTILE', [4.0], 0.9).result() == 4.0
+    assert PercentileAgg(0.5).result() == 0
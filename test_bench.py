@@ -0,0 +1,35 @@
+import os
+import random
+from collections import Counter
+
+import bench
+
+
+def test_zipf_keys_are_skewed():
+    counts = Counter(bench.zipf_keys(20000, 100, 1.0, random.Random(1)))
+    assert set(counts) <= set(range(100))
+    # Rank k is drawn about 1 / (k + 1) as often as rank 0
+    assert 1.7 < counts[0] / counts[1] < 2.3
+    assert counts[0] > 10 * counts[50]
+
+
+def test_zero_skew_is_uniform():
+    counts = Counter(bench.zipf_keys(20000, 4, 0, random.Random(1)))
+    assert max(counts.values()) / min(counts.values()) < 1.1
+
+
+def test_generate_writes_the_tables(workdir):
+    bench.generate(str(workdir), rows=500, num_keys=20, seed=3)
+    for table, rows in (('tripdata.csv', 500), ('views.csv', 500), ('carts.csv', 50)):
+        assert bench.count_lines([os.path.join(str(workdir), table)]) == rows + 1
+
+
+def test_measure_reports_throughput_and_phases(workdir):
+    bench.generate(str(workdir), rows=2000, num_keys=20, seed=3)
+    operation, sql_statement, tables = bench.BENCHMARKS[2]
+    result = bench.measure(operation, sql_statement, [os.path.join(str(workdir), table) for table in tables], 2)
+    assert (result['rows_in'], result['rows_out']) == (2000, 20)
+    assert result['rows_per_second'] > 0 and result['peak_rss_mb'] > 0
+    assert set(result['phase_seconds']) == set(result['task_seconds']) == {'map', 'sort', 'reduce'}
+    assert all(result['phase_seconds'][phase] <= result['wall_seconds'] for phase in result['phase_seconds'])
+    assert result['counters']['mapper']['rows_in'] == 2000
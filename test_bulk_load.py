@@ -0,0 +1,112 @@
+import io
+import json
+import os
+import threading
+
+import pytest
+
+import bulk_load
+from schema import load_registry, table_of_file
+from zone_maps import zone_map_name
+
+TRIPS = "trip_id,city,fare\n" + ''.join(f"{i},city{i % 3},{i % 17}\n" for i in range(300))
+
+
+@pytest.fixture
+def target(workdir):
+    os.makedirs(str(workdir / 'hdfs'))
+    return 'file://' + str(workdir / 'hdfs')
+
+
+def loaded_files(target):
+    directory = os.path.join(target[len('file://'):], 'trips.csv')
+    return directory, sorted(os.listdir(directory))
+
+
+def test_read_chunks_end_at_lines():
+    chunks = list(bulk_load.read_chunks(io.BytesIO(TRIPS.encode()), 100))
+    assert b''.join(data for _, data in chunks) == TRIPS.encode()
+    assert all(data.endswith(b'\n') for _, data in chunks)
+    assert [offset for offset, _ in chunks] == [sum(len(data) for _, data in chunks[:i]) for i in range(len(chunks))]
+
+
+def test_load_cuts_the_file_into_chunks_and_registers_the_table(write_table, target):
+    path = write_table('trips.csv', TRIPS, register=False)
+    schema = bulk_load.bulk_load(path, target, workers=2, block_bytes=1000)
+    directory, files = loaded_files(target)
+    assert schema['rows'] == 300 and len(schema['parts']) > 1
+    assert files == sorted(schema['parts'] + [zone_map_name(name) for name in schema['parts']])
+    data = ''
+    for name in schema['parts']:
+        with open(os.path.join(directory, name)) as f:
+            data += f.read()
+    # Only the first chunk starts with the header
+    assert data == TRIPS
+    assert load_registry()['trips']['types'] == ['int', 'str', 'int']
+    assert table_of_file(os.path.join(directory, schema['parts'][1])) == 'trips'
+
+
+def test_a_load_that_failed_part_way_resumes(write_table, target, monkeypatch):
+    path = write_table('trips.csv', TRIPS, register=False)
+    put = bulk_load.LocalTarget.put
+    written = []
+
+    def failing_put(self, data, chunk_path):
+        if chunk_path.endswith('.00003.csv'):
+            raise OSError("connection reset")
+        written.append(chunk_path)
+        put(self, data, chunk_path)
+    monkeypatch.setattr(bulk_load.LocalTarget, 'put', failing_put)
+    with pytest.raises(OSError):
+        bulk_load.bulk_load(path, target, workers=1, block_bytes=1000)
+    with open(bulk_load.manifest_path(path)) as f:
+        assert sorted(json.load(f)['chunks']) == ['trips.00000.csv', 'trips.00001.csv', 'trips.00002.csv']
+
+    monkeypatch.setattr(bulk_load.LocalTarget, 'put', put)
+    uploaded = []
+    load_chunk = bulk_load.load_chunk
+    monkeypatch.setattr(bulk_load, 'load_chunk', lambda target, chunk_path, *args: uploaded.append(chunk_path) or
+                        load_chunk(target, chunk_path, *args))
+    schema = bulk_load.bulk_load(path, target, workers=1, block_bytes=1000)
+    # The chunks the manifest records are not uploaded again
+    assert uploaded == [f"trips.csv/{name}" for name in schema['parts'][3:]]
+    assert schema['rows'] == 300
+
+
+def test_a_shorter_file_removes_the_chunks_past_its_end(write_table, target):
+    path = write_table('trips.csv', TRIPS, register=False)
+    bulk_load.bulk_load(path, target, block_bytes=1000)
+    _, before = loaded_files(target)
+    write_table('trips.csv', TRIPS[:1500], register=False)
+    schema = bulk_load.bulk_load(path, target, block_bytes=1000)
+    _, after = loaded_files(target)
+    assert len(after) < len(before)
+    assert after == sorted(schema['parts'] + [zone_map_name(name) for name in schema['parts']])
+
+
+def test_an_empty_file_is_rejected(write_table, target):
+    with pytest.raises(ValueError):
+        bulk_load.bulk_load(write_table('trips.csv', '', register=False), target)
+
+
+@pytest.mark.parametrize('columnar', [False, True])
+def test_workers_compute_the_zone_maps_and_row_counts(write_table, target, monkeypatch, columnar):
+    path = write_table('trips.csv', TRIPS, register=False)
+    threads = []
+    chunk_zone_map = bulk_load.chunk_zone_map
+    monkeypatch.setattr(bulk_load, 'chunk_zone_map',
+                        lambda *args: threads.append(threading.current_thread()) or chunk_zone_map(*args))
+    schema = bulk_load.bulk_load(path, target, block_bytes=1000, columnar=columnar)
+    assert schema['rows'] == 300
+    with open(bulk_load.manifest_path(path)) as f:
+        assert sum(chunk['rows'] for chunk in json.load(f)['chunks'].values()) == 300
+    if columnar:
+        assert not threads
+        return
+    assert len(threads) == len(schema['parts'])
+    assert threading.main_thread() not in threads
+    directory, _ = loaded_files(target)
+    with open(os.path.join(directory, zone_map_name(schema['parts'][1]))) as f:
+        zone_map = json.load(f)
+    # Offsets are relative to the chunk, which has no header line past the first
+    assert zone_map['blocks'][0]['offset'] == 0
@@ -0,0 +1,92 @@
+from functools import partial
+
+import pytest
+
+import filter as filter_op
+import groupby
+from columnar import ColumnarFile, convert_csv, format_value, infer_type
+from predicate import parse_where
+
+TRIPS = """trip_id,city,fare,note
+1,sf,10,a
+2,nyc,4.5,b
+3,sf,,c
+4,la,7,d
+5,nyc,6,e
+"""
+
+
+@pytest.fixture
+def columnar_table(write_table, workdir):
+    csv_path = write_table('trips.csv', TRIPS)
+    path = str(workdir / 'trips.hcol')
+    convert_csv(csv_path, path, rows_per_group=2)
+    return path
+
+
+@pytest.mark.parametrize('values, expected', [
+    (['1', '-2', '30'], 'int'),
+    (['1', '2.5'], 'float'),
+    (['1', ''], 'float'),
+    (['1', 'x'], 'str'),
+    ([str(2 ** 63)], 'float'),
+])
+def test_infer_type(values, expected):
+    assert infer_type(values) == expected
+
+
+def test_rows_round_trip(columnar_table):
+    with ColumnarFile(columnar_table) as table:
+        assert table.columns == ['trip_id', 'city', 'fare', 'note']
+        assert len(table.row_groups) == 3
+        rows = [','.join(format_value(value) for value in row) for row in table.rows()]
+    # Each row group types its chunks on its own, and floats read back in shortest form
+    assert rows == ['1,sf,10.0,a', '2,nyc,4.5,b', '3,sf,,c', '4,la,7.0,d', '5,nyc,6,e']
+
+
+def test_chunk_types(columnar_table):
+    with ColumnarFile(columnar_table) as table:
+        chunks = table.row_groups[0]['columns']
+    assert [chunk['type'] for chunk in chunks] == ['int32', 'dict', 'float', 'dict']
+    assert all(chunk['offset'] % 8 == 0 for chunk in chunks)
+
+
+def test_only_requested_columns_are_read(columnar_table):
+    with ColumnarFile(columnar_table) as table:
+        footer_bytes = table.bytes_read
+        rows = list(table.rows(['city']))
+        pruned = table.bytes_read - footer_bytes
+    with ColumnarFile(columnar_table) as table:
+        list(table.rows())
+        full = table.bytes_read - footer_bytes
+    assert rows[0] == [None, 'sf', None, None]
+    assert 0 < pruned < full
+
+
+def test_zone_maps_skip_row_groups(columnar_table):
+    condition = parse_where("SELECT * FROM trips WHERE trip_id > 4")
+    with ColumnarFile(columnar_table) as table:
+        rows = list(table.rows(['trip_id'], condition))
+        assert table.blocks_skipped == 2
+        assert table.rows_skipped == 4
+    assert [row[0] for row in rows] == [5]
+
+
+def test_not_a_columnar_file(write_table):
+    with pytest.raises(ValueError):
+        ColumnarFile(write_table('trips.csv', TRIPS, register=False))
+
+
+def test_filter_mapper_reads_a_columnar_source(columnar_table, run_task):
+    where_clause, projections, table = filter_op.parse_sql("SELECT city, fare FROM trips WHERE fare > 5")
+    lines = run_task(partial(filter_op.mapper, where_clause, projections, table, columnar_table))
+    assert lines == ['sf,10.0', 'la,7.0', 'nyc,6']
+
+
+def test_groupby_mapper_reads_a_columnar_source(columnar_table, run_task):
+    where_clause, projections, table, group_by, aggregations = groupby.parse_sql(
+        "SELECT city, SUM(fare), COUNT(*) FROM trips GROUPBY city")
+    lines = run_task(partial(groupby.mapper, where_clause, projections, table, group_by, aggregations,
+                             source=columnar_table))
+    # The null fare of trip 3 is skipped, as an empty CSV field would be
+    assert sorted(lines) == ['la\t7.0,1', 'nyc\t10.5,2', 'sf\t10.0,1']
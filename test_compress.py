@@ -0,0 +1,54 @@
+import gzip
+
+import pytest
+
+from compress import HADOOP_CODECS, LOCAL_CODECS, benchmark, job_properties, open_text, suffix
+
+
+def test_job_properties():
+    assert job_properties('snappy', 'gzip') == {
+        'mapreduce.map.output.compress': 'true',
+        'mapreduce.map.output.compress.codec': HADOOP_CODECS['snappy'],
+        'mapreduce.output.fileoutputformat.compress': 'true',
+        'mapreduce.output.fileoutputformat.compress.codec': HADOOP_CODECS['gzip'],
+    }
+    assert job_properties() == {}
+    with pytest.raises(ValueError):
+        job_properties('brotli')
+
+
+@pytest.mark.parametrize('codec', sorted(LOCAL_CODECS))
+def test_local_codecs_round_trip(tmp_path, codec):
+    path = str(tmp_path / f"part-00000{suffix(codec)}")
+    with open_text(path, 'wt', codec) as f:
+        f.write("sf\t1,é\n")
+    with open_text(path, 'at', codec) as f:
+        f.write("la\t2\n")
+    with open_text(path, 'rt', codec) as f:
+        assert f.read() == "sf\t1,é\nla\t2\n"
+
+
+def test_gzip_output_is_plain_gzip(tmp_path):
+    path = str(tmp_path / 'part.gz')
+    with open_text(path, 'wt', 'gzip') as f:
+        f.write('a\n')
+    with open(path, 'rb') as f:
+        assert gzip.decompress(f.read()) == b'a\n'
+
+
+def test_unknown_local_codec(tmp_path):
+    with pytest.raises(ValueError):
+        open_text(str(tmp_path / 'part'), 'wt', 'snappy')
+
+
+def test_benchmark_reports_every_codec():
+    results = benchmark(b"sf\t10.0,1\n" * 1000)
+    assert [result['codec'] for result in results] == ['none', 'gzip', 'bzip2', 'xz']
+    assert all(result['ratio'] > 1 for result in results[1:])
+
+
+def test_local_run_with_compressed_output(write_table, run_local):
+    path = write_table('trips.csv', "trip_id,city\n1,sf\n2,la\n3,sf\n")
+    lines = run_local('groupby', "SELECT city, COUNT(*) FROM trips GROUPBY city", path, output_codec='bzip2',
+                      spill_codec='xz')
+    assert lines == ['la\t1', 'sf\t2']
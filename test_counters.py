@@ -0,0 +1,89 @@
+import json
+
+import pytest
+
+import counters
+from counters import (COUNTERS_ENV, TIMING_BATCH, Counters, format_summary, load_counters, parse_job_counters,
+                      sum_counters)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """
+    Counts the clock readings of counters.py.
+    """
+    readings = []
+    perf_counter = counters.time.perf_counter
+    monkeypatch.setattr(counters.time, 'perf_counter', lambda: readings.append(1) or perf_counter())
+    return readings
+
+
+def test_rows_are_counted_and_timed_per_batch(clock):
+    task = Counters('mapper')
+    rows = list(task.rows(str(i) for i in range(1000)))
+    assert rows == [str(i) for i in range(1000)]
+    assert task.rows_in == 1000
+    assert len(clock) == 2 * (1000 // TIMING_BATCH + 2)
+
+
+def test_predicate_counts_rejected_rows_and_times_a_sample(clock):
+    task = Counters('mapper')
+    check = task.predicate(lambda row: row % 3 == 0)
+    assert sum(map(check, range(1000))) == 334
+    assert task.rows_filtered == 666
+    assert len(clock) == 2 * (1000 // TIMING_BATCH)
+    assert task.predicate_seconds > 0
+
+
+def test_predicate_errors_pass_through():
+    check = Counters('mapper').predicate(lambda row: row[5])
+    with pytest.raises(IndexError):
+        check([])
+
+
+def test_emit_counts_lines_and_bytes(capsys):
+    task = Counters('reducer')
+    task.emit('sf\t1')
+    task.emit_lines(['la\t2', 'nyc\t3'])
+    task.emit_lines([])
+    assert capsys.readouterr().out == 'sf\t1\nla\t2\nnyc\t3\n'
+    assert (task.rows_out, task.bytes_out) == (3, 16)
+
+
+def test_report_under_hadoop_uses_reporter_lines(monkeypatch, capsys):
+    monkeypatch.setenv('mapreduce_task_id', 'attempt_1')
+    task = Counters('mapper')
+    task.parse_errors = 2
+    task.report()
+    assert 'reporter:counter:SQL mapper,parse_errors,2' in capsys.readouterr().err.splitlines()
+
+
+def test_report_appends_to_the_counters_file(monkeypatch, tmp_path):
+    path = str(tmp_path / 'counters.jsonl')
+    monkeypatch.delenv('mapreduce_task_id', raising=False)
+    monkeypatch.delenv('mapred_task_id', raising=False)
+    monkeypatch.setenv(COUNTERS_ENV, path)
+    for stage, rows in (('reducer', 1), ('mapper', 5), ('mapper', 7)):
+        task = Counters(stage)
+        task.rows_in = rows
+        task.report()
+    totals = load_counters(path)
+    assert list(totals) == ['mapper', 'reducer']
+    assert totals['mapper']['rows_in'] == 12
+    with open(path) as f:
+        assert json.loads(f.readline())['stage'] == 'reducer'
+
+
+def test_sum_counters_orders_stages():
+    totals = sum_counters([{'stage': 'reducer', 'rows_out': 1}, {'stage': 'combiner', 'rows_out': 2}])
+    assert list(totals) == ['combiner', 'reducer']
+    assert totals['reducer']['rows_in'] == 0
+
+
+def test_parse_job_counters():
+    log = ["\tFile System Counters\n", "\t\tFILE: Number of bytes read=10\n", "\tSQL mapper\n",
+           "\t\trows_in=100\n", "\t\tparse_errors=3\n", "\tSQL reducer\n", "\t\trows_out=4\n"]
+    totals = parse_job_counters(log)
+    assert totals['mapper']['rows_in'] == 100 and totals['mapper']['parse_errors'] == 3
+    assert totals['reducer']['rows_out'] == 4
+    assert 'unparseable' in format_summary(totals)
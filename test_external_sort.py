@@ -0,0 +1,53 @@
+import random
+
+import pytest
+
+from compress import LOCAL_CODECS
+from external_sort import ExternalSorter, SortStats, merge_runs, read_run, write_run
+
+
+def random_lines(count, seed=3):
+    rng = random.Random(seed)
+    return [f"{rng.randrange(10 ** 6)}\t{rng.choice(['a', 'b', 'é'])}\n" for _ in range(count)]
+
+
+@pytest.mark.parametrize('memory_bytes, fan_in, spills, merge_passes', [
+    (10 ** 9, 64, 0, 0),
+    (2000, 64, 25, 0),
+    (2000, 4, 25, 2),
+])
+def test_sorted_output_matches_sorted(memory_bytes, fan_in, spills, merge_passes):
+    lines = random_lines(5000)
+    with ExternalSorter(memory_bytes=memory_bytes, fan_in=fan_in) as sorter:
+        for line in lines:
+            sorter.add(line)
+        assert list(sorter.sorted()) == sorted(lines)
+        assert (sorter.stats.spills > 0) == (spills > 0)
+        assert sorter.stats.merge_passes == merge_passes
+
+
+@pytest.mark.parametrize('codec', sorted(LOCAL_CODECS))
+def test_runs_round_trip_through_each_codec(tmp_path, codec):
+    lines = sorted(random_lines(100))
+    path = str(tmp_path / 'run')
+    write_run(lines, path, codec)
+    assert list(read_run(path, codec)) == lines
+
+
+def test_merge_runs_in_passes(tmp_path):
+    lines = random_lines(1000)
+    paths = []
+    for i in range(10):
+        paths.append(str(tmp_path / f"run-{i}"))
+        write_run(sorted(lines[i::10]), paths[-1])
+    stats = SortStats()
+    assert list(merge_runs(paths, str(tmp_path), 3, stats)) == sorted(lines)
+    # 10 runs -> 4 -> 2
+    assert stats.merge_passes == 2
+
+
+def test_lines_compare_as_plain_strings():
+    with ExternalSorter(memory_bytes=1) as sorter:
+        for line in ['b\n', 'B\n', 'a\t1\n', 'a\n', '10\n', '9\n']:
+            sorter.add(line)
+        assert list(sorter.sorted()) == ['10\n', '9\n', 'B\n', 'a\t1\n', 'a\n', 'b\n']
@@ -0,0 +1,61 @@
+from functools import partial
+
+import pytest
+
+import filter as row_filter
+
+TRIPS = """trip_id,city,fare
+1,sf,10
+2,nyc,4
+3,sf,3
+4,la,7
+"""
+
+
+def test_parse_sql():
+    filters, projections, table = row_filter.parse_sql("SELECT trip_id, fare FROM trips WHERE fare > 5")
+    assert (projections, table) == (['trip_id', 'fare'], 'trips')
+    assert filters.columns() == {'fare'}
+
+
+def test_mapper_projects_matching_rows(write_table, run_task, execution):
+    write_table('trips.csv', TRIPS)
+    filters, projections, table = row_filter.parse_sql("SELECT trip_id, fare FROM trips WHERE city = 'sf'")
+    assert run_task(partial(row_filter.mapper, filters, projections, table), TRIPS) == ['1,10', '3,3']
+
+
+def test_local_filter(write_table, run_local, execution):
+    path = write_table('trips.csv', TRIPS)
+    assert run_local('filter', "SELECT * FROM trips WHERE fare >= 4 AND city != 'la'", path) == ['1,sf,10', '2,nyc,4']
+
+
+def test_mapper_skips_short_rows(write_table, run_task, execution):
+    write_table('trips.csv', TRIPS)
+    filters, projections, table = row_filter.parse_sql("SELECT trip_id, fare FROM trips WHERE city = 'sf'")
+    lines = run_task(partial(row_filter.mapper, filters, projections, table), TRIPS + "5,sf\n6\n7,sf,8\n")
+    assert lines == ['1,10', '3,3', '7,8']
+
+
+def test_local_ordered_filter_counts_short_rows_as_parse_errors(write_table, run_local):
+    path = write_table('trips.csv', TRIPS + "5,sf\n")
+    counters = {}
+    lines = run_local('filter', "SELECT trip_id FROM trips WHERE city = 'sf' ORDER BY fare LIMIT 5", path,
+                      job_counters=counters)
+    assert lines == ['1', '3']
+    assert counters['mapper']['parse_errors'] == 1
+
+
+@pytest.mark.parametrize('where, expected', [
+    ("fare > 4", ['2', '3', '4', '5', '6']),
+    ("fare BETWEEN 5 AND 10", ['3', '5']),
+    ("fare IN (5, 40)", ['4', '5']),
+    ("fare < 4", ['1']),
+])
+def test_numeric_literals_compare_as_numbers_whatever_the_sampled_type(write_table, run_task, execution, where,
+                                                                       expected):
+    # The schema is inferred from the clean rows, so fare is an int column holding a word and a null
+    write_table('trips.csv', "trip_id,city,fare\n1,sf,3\n2,sf,12\n3,la,7\n4,nyc,40\n5,sf,5\n")
+    text = "trip_id,city,fare\n1,sf,3\n2,sf,12\n3,la,7\n4,nyc,40\n5,sf,5\n6,la,abc\n7,sf,\n"
+    write_table('trips.csv', text, register=False)
+    filters, projections, table = row_filter.parse_sql(f"SELECT trip_id FROM trips WHERE {where}")
+    assert run_task(partial(row_filter.mapper, filters, projections, table), text) == expected
@@ -0,0 +1,89 @@
+from functools import partial
+
+import groupby
+import vectorized
+
+TRIPS = """trip_id,city,fare
+1,sf,10
+2,nyc,4
+3,sf,3
+4,la,7
+5,nyc,6
+6,sf,2
+"""
+
+
+def test_mapper_aggregates_each_group_once(write_table, run_task):
+    write_table('trips.csv', TRIPS)
+    where_clause, projections, table, group_by, aggregations = groupby.parse_sql(
+        "SELECT city, SUM(fare), COUNT(*) FROM trips GROUPBY city")
+    lines = run_task(partial(groupby.mapper, where_clause, projections, table, group_by, aggregations), TRIPS)
+    assert sorted(lines) == ['la\t7.0,1', 'nyc\t10.0,2', 'sf\t15.0,3']
+
+
+def test_mapper_flushes_when_the_table_is_full(write_table, run_task, monkeypatch):
+    # The batch path flushes per batch, so this needs the row path
+    monkeypatch.setattr(vectorized, 'np', None)
+    write_table('trips.csv', TRIPS)
+    where_clause, projections, table, group_by, aggregations = groupby.parse_sql(
+        "SELECT city, COUNT(*) FROM trips GROUPBY city")
+    lines = run_task(partial(groupby.mapper, where_clause, projections, table, group_by, aggregations,
+                             max_groups=1), TRIPS)
+    # Every row is flushed on its own, but the counts still add up
+    assert len(lines) == 6
+    assert sum(int(line.split('\t')[1]) for line in lines if line.startswith('sf\t')) == 3
+
+
+def test_combiner_merges_partials_of_a_key(run_task):
+    _, _, _, _, aggregations = groupby.parse_sql("SELECT city, SUM(fare), COUNT(*) FROM trips GROUPBY city")
+    lines = run_task(partial(groupby.combiner, aggregations), "nyc\t4.0,1\nsf\t10.0,1\nsf\t5.0,2\n")
+    assert lines == ['nyc\t4.0,1', 'sf\t15.0,3']
+
+
+def test_reducer_skips_unparseable_partials(run_task):
+    _, _, _, _, aggregations = groupby.parse_sql("SELECT city, SUM(fare) FROM trips GROUPBY city")
+    lines = run_task(partial(groupby.reducer, aggregations), "sf\t1.5\nsf\tnot-a-number\nsf\t2.5\n")
+    assert lines == ['sf\t4.0']
+
+
+def test_local_groupby_matches_a_direct_computation(write_table, run_local, execution):
+    rows = [f"{i},city{i % 7},{(i * 13) % 50}" for i in range(2000)]
+    path = write_table('trips.csv', "trip_id,city,fare\n" + '\n'.join(rows) + '\n')
+    expected = {}
+    for i in range(2000):
+        total, count = expected.get(f"city{i % 7}", (0.0, 0))
+        expected[f"city{i % 7}"] = (total + (i * 13) % 50, count + 1)
+
+    lines = run_local('groupby', "SELECT city, SUM(fare), COUNT(*) FROM trips GROUPBY city", path,
+                      split_bytes=4096)
+    assert lines == sorted(f"{city}\t{total},{count}" for city, (total, count) in expected.items())
+
+
+def test_parse_sql_reads_approximate_aggregations():
+    _, projections, table, group_by, aggregations = groupby.parse_sql(
+        "SELECT city, COUNT(DISTINCT vendor), MEDIAN(fare), PERCENTILE(fare, 0.9) FROM trips GROUPBY city")
+    assert (projections, table, group_by) == (['city'], 'trips', ['city'])
+    assert aggregations == [('COUNT_DISTINCT', 'vendor', None), ('PERCENTILE', 'fare', 0.5),
+                            ('PERCENTILE', 'fare', 0.9)]
+
+
+def test_local_groupby_with_approximate_aggregations(write_table, run_local):
+    rows = [f"{i},city{i % 3},v{i % 40},{i % 100}" for i in range(3000)]
+    path = write_table('trips.csv', "trip_id,city,vendor,fare\n" + '\n'.join(rows) + '\n')
+    lines = run_local('groupby', "SELECT city, COUNT(DISTINCT vendor), MEDIAN(fare) FROM trips GROUPBY city",
+                      path, split_bytes=8192)
+    assert len(lines) == 3
+    for line in lines:
+        distinct, median = line.split('\t')[1].split(',')
+        assert int(distinct) == 40
+        assert abs(float(median) - 49.5) < 3
+
+
+def test_aggregating_a_text_column_skips_the_fields_that_are_not_numbers(write_table, run_local, execution):
+    # The sample holds a word, so fare is registered as str, but most of its fields are numbers
+    path = write_table('trips.csv', TRIPS + "7,sf,n/a\n8,la,\n")
+    counters = {}
+    lines = run_local('groupby', "SELECT city, SUM(fare), MAX(fare) FROM trips GROUPBY city", path,
+                      job_counters=counters)
+    assert lines == ['la\t7.0,7.0', 'nyc\t10.0,6.0', 'sf\t15.0,10.0']
+    assert counters['mapper']['parse_errors'] == 2
@@ -0,0 +1,244 @@
+import os
+import subprocess
+from functools import partial
+
+import pytest
+
+import bulk_load
+import inner_join
+import main
+
+VIEWS = """user_id,category_id,product_id
+u1,1,p1
+u2,2,p2
+u3,1,p3
+u4,3,p4
+u5,9,p5
+"""
+CARTS = """category_id,product_id,price
+1,p1,10
+2,p9,60
+1,p7,70
+3,p4,5
+"""
+SQL = "SELECT views.user_id, carts.price FROM views INNER JOIN carts ON views.category_id = carts.category_id"
+
+
+@pytest.fixture
+def tables(write_table):
+    return write_table('views.csv', VIEWS), write_table('carts.csv', CARTS)
+
+
+def test_broadcast_mapper_joins_against_the_small_table(tables, run_task):
+    _, carts = tables
+    lines = run_task(partial(inner_join.broadcast_mapper, SQL, carts, 'carts'), VIEWS)
+    assert sorted(lines) == ['1\tu1,10', '1\tu1,70', '1\tu3,10', '1\tu3,70', '2\tu2,60', '3\tu4,5']
+
+
+def test_broadcast_mapper_with_the_small_table_on_the_left(tables, run_task):
+    views, _ = tables
+    sql = "SELECT views.user_id, carts.price FROM views INNER JOIN carts ON views.category_id = carts.category_id " \
+          "WHERE carts.price > 50"
+    lines = run_task(partial(inner_join.broadcast_mapper, sql, views, 'views'), CARTS)
+    assert sorted(lines) == ['1\tu1,70', '1\tu3,70', '2\tu2,60']
+
+
+def test_broadcast_join_ships_the_small_table_from_hdfs(monkeypatch):
+    commands = []
+    monkeypatch.setattr(main, 'run_job', commands.append)
+    main.run_broadcast_join('/data/views.csv', '/data/carts.csv', 'carts', '/out', SQL)
+    assert '-files hdfs:///data/carts.csv ' in commands[0]
+    assert 'broadcast carts.csv carts' in commands[0]
+
+
+def test_spill_buffer_moves_rows_to_disk_past_its_limit():
+    buffer = inner_join.SpillBuffer(max_bytes=10)
+    assert not buffer
+    for i in range(5):
+        buffer.append(f"row{i}")
+    assert buffer.spills == 1 and buffer.file is not None
+    buffer.append('row5')
+    # It can be read more than once, and appended to in between
+    assert list(buffer) == [f"row{i}" for i in range(6)]
+    buffer.append('row6')
+    assert list(buffer)[-1] == 'row6'
+    buffer.clear()
+    assert not buffer and list(buffer) == []
+
+
+def test_mapper_salts_hot_keys(tables, run_task, monkeypatch):
+    monkeypatch.setenv('mapreduce_map_input_file', 'hdfs:///data/views.csv')
+    large = run_task(partial(inner_join.mapper, SQL, None, 'carts', {'1'}, 3), VIEWS)
+    hot = [line for line in large if line.startswith('1' + inner_join.SALT_SEPARATOR)]
+    # The large side's rows of a hot key go to one salt each, round robin
+    assert len(hot) == 2 and len({line.split('\t')[0] for line in hot}) == 2
+    assert '2\t1\tviews,u2' in large
+
+    small = run_task(partial(inner_join.mapper, SQL, 'carts', 'carts', {'1'}, 3), CARTS)
+    # The small side's rows of a hot key go to every salt
+    assert sorted(line for line in small if line.startswith('1' + inner_join.SALT_SEPARATOR)) == sorted(
+        f"1{inner_join.SALT_SEPARATOR}{salt}\t0\tcarts,{price}" for salt in range(3) for price in ('10', '70'))
+
+
+def test_reducer_drops_salts_from_the_keys(tables, run_task):
+    salted = f"1{inner_join.SALT_SEPARATOR}2"
+    lines = run_task(partial(inner_join.reducer, SQL),
+                     f"{salted}\t0\tcarts,10\n{salted}\t1\tviews,u1\n2\t0\tcarts,60\n2\t1\tviews,u2\n")
+    assert lines == ['1\tu1,10', '2\tu2,60']
+
+
+def test_sample_counts_the_keys_of_its_split(tables, run_task):
+    views = "user_id,category_id,product_id\n" + ''.join(f"u{i},{1 if i % 2 else i},p{i}\n" for i in range(10))
+    lines = run_task(partial(inner_join.sample_hot_keys, SQL, 'views', 1.0), views)
+    # The header is not a row
+    assert sorted(lines) == ['0\t1', '1\t5', '2\t1', '4\t1', '6\t1', '8\t1']
+
+
+def test_hot_keys_are_decided_on_the_merged_sample():
+    # Each split alone holds too few rows, and key 7 is hot in only one of them
+    splits = [["1\t300", "7\t40", "x\t260"], ["1\t300", "y\t300"], ["1\t300", "z\t300"]]
+    lines = [line for split in splits for line in split]
+    assert inner_join.hot_keys(lines, min_share=0.1, min_sample=1000) == ['1', 'x', 'y', 'z']
+    assert inner_join.hot_keys(lines, min_share=0.2, min_sample=1000) == ['1']
+    # A small sample has no hot keys, however often a key repeats in it
+    assert inner_join.hot_keys(["1\t3", "2\t1"], min_share=0.1, min_sample=1000) == []
+
+
+HEADERS = {'views': ['user_id', 'category_id', 'product_id'], 'carts': ['category_id', 'product_id', 'price']}
+
+
+def plan(sql):
+    parsed = inner_join.parse_sql_inner_join(sql)
+    parsed['where'] = inner_join.parse_where(sql)
+    return inner_join.plan_join(parsed, HEADERS)
+
+
+def test_plan_ships_only_the_needed_columns():
+    join = plan(SQL + " WHERE carts.price > 50 AND views.product_id != carts.product_id")
+    assert join['tables'] == ['views', 'carts']
+    assert join['sides']['views']['key_index'] == 1 and join['sides']['carts']['key_index'] == 0
+    # user_id and product_id from views; price and product_id from carts
+    assert join['sides']['views']['columns'] == [0, 2]
+    assert join['sides']['carts']['columns'] == [2, 1]
+    assert join['output'] == [(0, 0), (1, 0)]
+    # The single-table condition is pushed down to the carts mapper
+    assert join['sides']['views']['predicate'] is None
+    assert join['sides']['carts']['predicate'](['1', 'p1', '60'])
+    assert not join['sides']['carts']['predicate'](['1', 'p1', '6'])
+    # The one over both tables is checked after the join
+    assert join['residual'](['u1', 'p1', '60', 'p2'])
+    assert not join['residual'](['u1', 'p1', '60', 'p1'])
+
+
+def test_plan_of_star_and_unqualified_columns():
+    join = plan("SELECT * FROM views INNER JOIN carts ON views.category_id = carts.category_id")
+    assert join['shipped'] == (3, 3)
+    assert len(join['output']) == 6
+    join = plan("SELECT user_id, price FROM views INNER JOIN carts ON views.category_id = carts.category_id")
+    assert join['output'] == [(0, 0), (1, 0)]
+
+
+@pytest.mark.parametrize('sql', [
+    "SELECT product_id FROM views INNER JOIN carts ON views.category_id = carts.category_id",
+    "SELECT views.rating FROM views INNER JOIN carts ON views.category_id = carts.category_id",
+    "SELECT * FROM views INNER JOIN views ON views.category_id = views.category_id",
+    "SELECT * FROM views INNER JOIN carts ON views.category_id = views.product_id",
+    "SELECT * FROM views JOIN carts",
+])
+def test_invalid_plans(sql):
+    with pytest.raises(ValueError):
+        plan(sql)
+
+
+def test_reduce_side_join_job(monkeypatch):
+    commands = []
+    monkeypatch.setattr(main, 'table_memory_bytes', lambda path, table: 10 ** 9 if 'views' in path else 2 * 10 ** 8)
+    monkeypatch.setattr(main, 'hdfs_files', lambda path: {f"hdfs://{path}": 10})
+    monkeypatch.setattr(main, 'ensure_schema', lambda path, table: None)
+    monkeypatch.setattr(main, 'run_job', commands.append)
+    monkeypatch.setattr(main, 'run_bash_command', lambda command: None)
+    # Two sampling tasks' counts, merged before the 1% threshold applies
+    sample = ''.join(f"{key}\t{count}\n" for key, count in [(1, 12), (2, 988), (1, 12), (3, 988)])
+    monkeypatch.setattr(main.subprocess, 'run',
+                        lambda command, *args, **kwargs: subprocess.CompletedProcess(command, 0, stdout=sample))
+    main.run_inner_join('/data', '/out', SQL, num_reducers=4)
+    with open('hot_keys.txt') as f:
+        assert f.read() == "1\n2\n3\n"
+
+    sample, join = commands
+    assert '-input /data/views.csv' in sample and 'sample views' in sample
+    assert '-input /data/carts.csv -input /data/views.csv' in join
+    assert 'mapper auto carts hot_keys.txt 4' in join
+    assert '-partitioner org.apache.hadoop.mapred.lib.KeyFieldBasedPartitioner' in join
+    assert "mapreduce.partition.keycomparator.options='-k1,1 -k2,2n'" in join
+    assert '-numReduceTasks 4' in join
+
+
+def test_local_join_matches_the_broadcast_join(tables, run_local, run_task):
+    views, carts = tables
+    expected = sorted(run_task(partial(inner_join.broadcast_mapper, SQL, carts, 'carts'), VIEWS))
+    assert run_local('join', SQL, views, carts) == expected
+
+
+def test_reducer_buffers_only_the_small_side(tables, run_task, monkeypatch):
+    buffered = []
+    append = inner_join.SpillBuffer.append
+    monkeypatch.setattr(inner_join.SpillBuffer, 'append', lambda self, row: buffered.append(row) or append(self, row))
+    # views is the small side here, so its rows come first within each key
+    lines = run_task(partial(inner_join.reducer, SQL),
+                     "1\t0\tviews,u1\n1\t0\tviews,u3\n1\t1\tcarts,10\n1\t1\tcarts,70\n"
+                     "2\t1\tcarts,60\n3\t0\tviews,u4\n")
+    assert buffered == ['u1', 'u3', 'u4']
+    # Keys missing from either side produce nothing, and output keeps the statement's column order
+    assert lines == ['1\tu1,10', '1\tu3,10', '1\tu1,70', '1\tu3,70']
+
+
+def test_reducer_spills_a_large_key(tables, run_task):
+    small = ''.join(f"1\t0\tviews,u{i}\n" for i in range(100))
+    lines = run_task(partial(inner_join.reducer, SQL, 64), small + "1\t1\tcarts,10\n")
+    assert len(lines) == 100
+
+
+@pytest.fixture
+def loaded_views(write_table, workdir):
+    """
+    Bulk loads views into chunks of two rows or so, as views.csv/views.0000N.csv.
+    """
+    os.makedirs(str(workdir / 'hdfs'))
+    schema = bulk_load.bulk_load(write_table('views_source.csv', VIEWS, register=False), f"file://{workdir}/hdfs",
+                                 block_bytes=20, table='views')
+    directory = os.path.join(str(workdir), 'hdfs', 'views_source.csv')
+    return directory, [os.path.join(directory, name) for name in schema['parts']]
+
+
+def test_input_table_of_a_chunk(loaded_views, monkeypatch):
+    _, chunks = loaded_views
+    monkeypatch.setenv('mapreduce_map_input_file', 'hdfs:///data/views_source.csv/' + os.path.basename(chunks[1]))
+    assert inner_join.input_table() == 'views'
+    # Without the registry the directory gives the table away
+    monkeypatch.setenv('mapreduce_map_input_file', 'hdfs:///data/carts.csv/carts.00002.csv')
+    assert inner_join.input_table() == 'carts'
+
+
+def test_local_join_over_a_loaded_table(tables, loaded_views, run_local, run_task):
+    _, carts = tables
+    _, chunks = loaded_views
+    assert len(chunks) > 2
+    expected = sorted(run_task(partial(inner_join.broadcast_mapper, SQL, carts, 'carts'), VIEWS))
+    assert run_local('join', SQL, *chunks, carts) == expected
+
+
+def test_broadcast_mapper_loads_a_directory_of_chunks(tables, loaded_views, run_task):
+    directory, _ = loaded_views
+    lines = run_task(partial(inner_join.broadcast_mapper, SQL, directory, 'views'), CARTS)
+    assert sorted(lines) == ['1\tu1,10', '1\tu1,70', '1\tu3,10', '1\tu3,70', '2\tu2,60', '3\tu4,5']
+
+
+def test_join_keeps_a_comma_inside_a_field(tables, write_table, run_local, run_task):
+    views, _ = tables
+    products = write_table('products.csv', "product_id;name;price\np1;Widget, large;10\np4;Bolt;5\n")
+    sql = ("SELECT products.name, views.user_id, products.price FROM products "
+           "INNER JOIN views ON products.product_id = views.product_id")
+    expected = ['p1\tWidget, large,u1,10', 'p4\tBolt,u4,5']
+    assert run_local('join', sql, products, views) == expected
+    assert sorted(run_task(partial(inner_join.broadcast_mapper, sql, products, 'products'), VIEWS)) == expected
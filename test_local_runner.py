@@ -0,0 +1,101 @@
+import os
+import time
+import zlib
+
+import pytest
+
+import local_runner
+
+TRIPS = "trip_id,city,fare\n" + ''.join(f"{i},city{i % 5},{i % 17}\n" for i in range(500))
+
+
+@pytest.mark.parametrize('split_bytes', [1, 100, 4096, 10 ** 6])
+def test_splits_cover_the_file_at_line_boundaries(write_table, split_bytes):
+    path = write_table('trips.csv', TRIPS)
+    splits = local_runner.input_splits(path, split_bytes)
+    data = TRIPS.encode()
+    assert splits[0][1] == 0
+    assert sum(length for _, _, length in splits) == len(data)
+    for (_, start, length), (_, next_start, _) in zip(splits, splits[1:]):
+        assert start + length == next_start
+        assert data[next_start - 1:next_start] == b'\n'
+
+
+def test_splits_of_a_byte_range(write_table):
+    path = write_table('trips.csv', TRIPS)
+    start = TRIPS.index('\n100,') + 1
+    end = TRIPS.index('\n200,') + 1
+    splits = local_runner.input_splits(path, 512, start, end)
+    assert splits[0][1] == start and sum(length for _, _, length in splits) == end - start
+
+
+def test_read_split_sets_the_input_variables(write_table):
+    path = write_table('trips.csv', TRIPS)
+    start = TRIPS.index('\n1,') + 1
+    data = local_runner.read_split((path, start, 10), offsets=True)
+    assert data == f"{start}\t1,city1,1\n".encode()
+    assert os.environ['mapreduce_map_input_file'] == path
+    assert os.environ['mapreduce_map_input_start'] == str(start)
+
+
+def test_line_writer_hands_over_complete_lines():
+    lines = []
+    writer = local_runner.LineWriter(lines.append)
+    writer.write('a\tb')
+    writer.write('c\nd\ne')
+    writer.write('\n')
+    writer.write('f')
+    writer.flush()
+    assert lines == ['a\tbc\n', 'd\n', 'e\n', 'f\n']
+
+
+def test_partition_does_not_depend_on_the_process():
+    # hash() of a str differs between processes, crc32 does not
+    assert local_runner.partition('sf', 8) == zlib.crc32(b'sf') % 8
+
+
+@pytest.mark.parametrize('workers, num_reducers', [(1, 1), (3, 4)])
+def test_local_groupby_is_independent_of_the_parallelism(write_table, run_local, workers, num_reducers):
+    path = write_table('trips.csv', TRIPS)
+    lines = run_local('groupby', "SELECT city, COUNT(*) FROM trips GROUPBY city", path, workers=workers,
+                      num_reducers=num_reducers, split_bytes=1000)
+    assert lines == [f"city{i}\t100" for i in range(5)]
+    parts = [name for name in os.listdir('output') if name.startswith('part-')]
+    assert len(parts) == num_reducers
+
+
+def test_map_only_operation_writes_one_part_per_split(write_table, run_local):
+    path = write_table('trips.csv', TRIPS)
+    lines = run_local('projection', "SELECT trip_id FROM trips", path, split_bytes=2000)
+    assert lines == sorted(str(i) for i in range(500))
+    parts = [name for name in os.listdir('output') if name.startswith('part-m-')]
+    assert len(parts) == len(local_runner.input_splits(path, 2000))
+
+
+def test_spilling_map_tasks_give_the_same_result(write_table, run_local):
+    path = write_table('trips.csv', TRIPS)
+    sql = "SELECT city, SUM(fare) FROM trips GROUPBY city"
+    assert run_local('groupby', sql, path, memory_bytes=256, fan_in=2) == run_local('groupby', sql, path)
+
+
+def test_wall_seconds_counts_overlapping_tasks_once():
+    assert local_runner.wall_seconds([]) == 0.0
+    assert local_runner.wall_seconds([(0.0, 2.0), (1.0, 3.0), (5.0, 6.0), (5.5, 5.75)]) == 4.0
+
+
+def test_phases_take_the_wall_time_of_their_tasks(write_table, run_local):
+    path = write_table('trips.csv', TRIPS)
+    phase_seconds, task_seconds = {}, {}
+    start = time.time()
+    run_local('groupby', "SELECT city, SUM(fare) FROM trips GROUPBY city", path, workers=3, split_bytes=500,
+              phase_seconds=phase_seconds, task_seconds=task_seconds)
+    wall = time.time() - start
+    assert set(phase_seconds) == set(task_seconds) == {'map', 'sort', 'reduce'}
+    for phase in phase_seconds:
+        # Summed over parallel tasks a phase may take longer than the run, but not in wall time
+        assert 0 < phase_seconds[phase] <= min(wall, task_seconds[phase]) + 1e-6
+
+
+def test_unknown_operation():
+    with pytest.raises(ValueError):
+        local_runner.load_operation('sort', "SELECT * FROM trips", [])
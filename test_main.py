@@ -0,0 +1,146 @@
+import shlex
+import subprocess
+from functools import partial
+
+import pytest
+
+import main
+
+
+def fake_run(monkeypatch, stdout):
+    """
+    Replaces subprocess.run in main.py with one that prints `stdout`.
+    Returns the list the commands run are appended to.
+    """
+    commands = []
+
+    def run(command, *args, **kwargs):
+        commands.append(command)
+        return subprocess.CompletedProcess(command, 0, stdout=stdout)
+    monkeypatch.setattr(main.subprocess, 'run', run)
+    return commands
+
+
+def test_hdfs_uri():
+    assert main.hdfs_uri('/data/trips.csv') == 'hdfs:///data/trips.csv'
+    assert main.hdfs_uri('hdfs://namenode:9000/data') == 'hdfs://namenode:9000/data'
+
+
+def test_zone_map_files_are_hdfs_uris(monkeypatch):
+    fake_run(monkeypatch, "/data/_trips.csv.zonemap.json\n/data/views.csv/_views.00000.csv.zonemap.json\n")
+    assert main.zone_map_files('/data') == ['hdfs:///data/_trips.csv.zonemap.json',
+                                            'hdfs:///data/views.csv/_views.00000.csv.zonemap.json']
+
+
+def test_streaming_command_puts_generic_options_first():
+    command = main.streaming_command(['/data/trips.csv'], '/out', 'python3 filter.py "SQL" mapper',
+                                     files=['filter.py'], cache_files=['hdfs:///data/_trips.csv.zonemap.json'])
+    assert command.index('-D ') < command.index('-files ') < command.index('-input /data/trips.csv')
+    assert command.endswith('-file filter.py')
+    # A job without a reducer is map-only
+    assert '-numReduceTasks 0' in command
+
+
+def test_query_looks_indexes_up_with_the_table_path(monkeypatch):
+    # run_create_index fingerprints <input>/<table>.csv, so lookups have to as well
+    fingerprinted = []
+    monkeypatch.setattr(main, 'table_input', lambda input_path, table: f"{input_path}/{table}.csv")
+    monkeypatch.setattr(main, 'ensure_schema', lambda path, table: None)
+    monkeypatch.setattr(main, 'hdfs_files', lambda path: {f"hdfs://{path}/trips.00000.csv": 10})
+    monkeypatch.setattr(main, 'index_scan', lambda *args: fingerprinted.append(args[-1]()) or True)
+    monkeypatch.setattr(main, 'hdfs_fingerprint', lambda path: path)
+    monkeypatch.setattr(main, 'run_bash_command', lambda command: None)
+    main.run_query('/data', '/out', "SELECT * FROM trips WHERE trip_id = 5")
+    assert fingerprinted == ['/data/trips.csv']
+
+
+@pytest.mark.parametrize('run, sql', [
+    (main.run_query, "SELECT city, fare FROM trips WHERE fare > 5"),
+    (main.run_query, "SELECT city, SUM(fare) FROM trips GROUPBY city"),
+    (main.run_create_index, "CREATE INDEX ON trips (trip_id)"),
+    (main.run_inner_join, "SELECT trips.city, carts.price FROM trips INNER JOIN carts ON trips.city = carts.city"),
+])
+def test_jobs_reject_columnar_tables(monkeypatch, run, sql):
+    # Streaming would hand the binary chunks to the CSV mappers line by line
+    monkeypatch.setattr(main, 'table_input', lambda input_path, table: f"{input_path}/{table}.csv")
+    monkeypatch.setattr(main, 'hdfs_files', lambda path: {f"hdfs://{path}/part.00000.hcol": 10})
+    monkeypatch.setattr(main, 'ensure_schema', lambda path, table: pytest.fail("the table should be rejected first"))
+    monkeypatch.setattr(main, 'run_job', lambda command: pytest.fail("no job should run"))
+    with pytest.raises(ValueError, match='columnar'):
+        run('/data', '/out', sql)
+
+
+def test_table_memory_bytes_scales_compressed_files(monkeypatch):
+    monkeypatch.setattr(main, 'hdfs_files', lambda path: {'hdfs:///data/carts.csv/carts.00000.csv.gz': 1000,
+                                                          'hdfs:///data/carts.csv/carts.00001.csv': 500})
+    monkeypatch.setattr(main, 'load_registry', lambda: {'carts': {'rows': 100}})
+    assert main.table_memory_bytes('/data/carts.csv', 'carts') == 4500 + 100 * main.HASH_ROW_BYTES
+
+
+def test_table_memory_bytes_counts_rows_from_a_sample(monkeypatch):
+    monkeypatch.setattr(main, 'hdfs_files', lambda path: {'hdfs:///data/carts.csv': 1000})
+    monkeypatch.setattr(main, 'load_registry', lambda: {})
+    commands = fake_run(monkeypatch, "id,price\n1,10\n2,20\n")
+    # Rows of 5 bytes, so about 200 of them
+    assert main.table_memory_bytes('/data/carts.csv', 'carts') == 1000 + 200 * main.HASH_ROW_BYTES
+    assert commands[0].startswith('hadoop fs -text hdfs:///data/carts.csv ')
+
+
+def fake_hdfs(monkeypatch, files):
+    """
+    Replaces subprocess.run in main.py with a minimal HDFS holding `files`,
+    {path: (mtime, length)}, under /data. Returns the list the commands run
+    are appended to.
+    """
+    commands = []
+
+    def run(command, *args, **kwargs):
+        commands.append(command)
+        words = shlex.split(command)
+        stdout = ''
+        if words[2:4] == ['-ls', '-R']:
+            stdout = "drwxr-xr-x   - hadoop supergroup          0 2026-10-18 08:00 /data/trips.csv\n" + ''.join(
+                f"-rw-r--r--   1 hadoop supergroup {length:>10} 2026-10-18 08:00 {path}\n"
+                for path, (_, length) in files.items() if path.startswith(words[4] + '/'))
+        elif words[2] == '-stat':
+            stdout = ''.join(f"{files[path][0]} {files[path][1]}\n" for path in words[4:])
+        elif words[2] == '-checksum':
+            stdout = ''.join(f"{path}\tMD5-of-0MD5-of-512CRC32C\t{hash(files[path]):x}\n" for path in words[3:])
+        return subprocess.CompletedProcess(command, 0, stdout=stdout)
+    monkeypatch.setattr(main.subprocess, 'run', run)
+    return commands
+
+
+def test_hdfs_fingerprint_covers_the_chunks_of_a_table(monkeypatch):
+    files = {'/data/trips.csv/trips.00000.csv': (1000, 10), '/data/trips.csv/trips.00001.csv': (2000, 20)}
+    commands = fake_hdfs(monkeypatch, files)
+    fingerprint = main.hdfs_fingerprint('/data/trips.csv')
+    assert fingerprint.splitlines()[:2] == ['/data/trips.csv/trips.00000.csv 1000 10',
+                                            '/data/trips.csv/trips.00001.csv 2000 20']
+    # Directories are listed, not checksummed
+    assert commands[-1] == 'hadoop fs -checksum /data/trips.csv/trips.00000.csv /data/trips.csv/trips.00001.csv'
+
+
+def test_cache_misses_after_a_chunk_is_appended(monkeypatch, workdir):
+    files = {'/data/trips.csv/trips.00000.csv': (1000, 10), '/data/views.csv/views.00000.csv': (1000, 30)}
+    commands = fake_hdfs(monkeypatch, files)
+    monkeypatch.setattr(main, 'cache_entry', partial(main.cache_entry, cache_dir=str(workdir / 'cache')))
+    monkeypatch.setattr(main, 'run_bash_command', lambda command: (workdir / 'query_result.txt').write_text('sf\n'))
+    runs = []
+
+    def run(input_path, output_path, sql_statement):
+        runs.append(sql_statement)
+
+    sql = "SELECT city FROM trips WHERE fare > 5"
+    for _ in range(2):
+        main.run_cached(run, '/data', '/out', sql)
+    assert len(runs) == 1
+    # The cache is keyed on the table, so changes to other tables leave its results alone
+    assert 'hadoop fs -ls -R /data/trips.csv' in commands
+    files['/data/views.csv/views.00001.csv'] = (3000, 5)
+    main.run_cached(run, '/data', '/out', sql)
+    assert len(runs) == 1
+
+    files['/data/trips.csv/trips.00001.csv'] = (3000, 5)
+    main.run_cached(run, '/data', '/out', sql)
+    assert len(runs) == 2
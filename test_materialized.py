@@ -0,0 +1,95 @@
+import os
+
+import pytest
+
+import main
+import materialized
+
+TRIPS = "trip_id,city,fare\n" + ''.join(f"{i},city{i % 4},{i % 9}\n" for i in range(300))
+MORE = ''.join(f"{i},city{i % 5},{i % 7}\n" for i in range(300, 400))
+SQL = "SELECT city, SUM(fare), COUNT(*), MIN(fare), MAX(fare) FROM trips GROUPBY city"
+
+
+def append(path, text):
+    with open(path, 'a') as f:
+        f.write(text)
+
+
+def refresh(sql, path, capsys):
+    """
+    Refreshes the view into result.txt; returns its lines and the bytes read.
+    """
+    capsys.readouterr()
+    materialized.refresh_local(sql, [path], 'result.txt', workers=2)
+    message = capsys.readouterr().err
+    with open('result.txt') as f:
+        return sorted(f.read().splitlines()), int(message.split(' new bytes')[0].split()[-1])
+
+
+def test_a_refresh_reads_only_the_appended_lines(write_table, run_local, capsys):
+    path = write_table('trips.csv', TRIPS)
+    lines, read = refresh(SQL, path, capsys)
+    assert lines == run_local('groupby', SQL, path) and read == len(TRIPS)
+    append(path, MORE)
+    lines, read = refresh(SQL, path, capsys)
+    assert read == len(MORE)
+    assert lines == run_local('groupby', SQL, path)
+    # Nothing new, nothing read
+    assert refresh(SQL, path, capsys) == (lines, 0)
+
+
+def test_a_line_still_being_written_waits_for_the_next_refresh(write_table, run_local, capsys):
+    path = write_table('trips.csv', TRIPS)
+    refresh(SQL, path, capsys)
+    append(path, "300,city9,4\n301,city9,")
+    lines, read = refresh(SQL, path, capsys)
+    assert read == len("300,city9,4\n")
+    assert 'city9\t4.0,1,4.0,4.0' in lines
+    append(path, "5\n")
+    lines, _ = refresh(SQL, path, capsys)
+    assert 'city9\t9.0,2,4.0,5.0' in lines
+
+
+def test_a_rewritten_file_rebuilds_the_view(write_table, run_local, capsys):
+    path = write_table('trips.csv', TRIPS)
+    refresh(SQL, path, capsys)
+    write_table('trips.csv', TRIPS.replace('\n5,city1,5\n', '\n5,city1,6\n') + MORE)
+    lines, read = refresh(SQL, path, capsys)
+    assert read == len(TRIPS + MORE)
+    assert lines == run_local('groupby', SQL, path)
+    # A shorter file too
+    write_table('trips.csv', TRIPS[:1000].rsplit('\n', 1)[0] + '\n')
+    lines, _ = refresh(SQL, path, capsys)
+    assert lines == run_local('groupby', SQL, path)
+    assert len(os.listdir(materialized.VIEW_DIR)) == 2
+
+
+def test_order_by_and_limit_share_the_view(write_table, capsys):
+    path = write_table('trips.csv', TRIPS)
+    refresh(SQL, path, capsys)
+    ordered = SQL + " ORDER BY SUM(fare) LIMIT 2"
+    assert materialized.view_name(ordered, [path]) == materialized.view_name(SQL, [path])
+    capsys.readouterr()
+    materialized.refresh_local(ordered, [path], 'result.txt', workers=2)
+    assert ' 0 new bytes' in capsys.readouterr().err
+    with open('result.txt') as f:
+        assert [line.split('\t')[0] for line in f] == ['city1', 'city2']
+
+
+def test_plan_refresh(write_table):
+    path = write_table('trips.csv', TRIPS, register=False)
+    size = len(TRIPS)
+    assert materialized.plan_refresh(None, {path: size}) == ([(path, 0, size)], True)
+    view = {'watermark': {path: {'bytes': 100, 'tail': materialized.tail_checksum(path, 100)}}}
+    end = materialized.line_end(path, 100, size)
+    assert materialized.plan_refresh(view, {path: size}) == ([(path, 100, end)], False)
+    # A file that vanished
+    assert materialized.plan_refresh(view, {})[1]
+
+
+def test_run_groupby_rejects_columnar_tables(monkeypatch):
+    monkeypatch.setattr(main, 'ensure_schema', lambda path, table: None)
+    monkeypatch.setattr(main, 'hdfs_files', lambda path: {'hdfs:///data/trips.csv/trips.00000.hcol': 10})
+    monkeypatch.setattr(main, 'run_job', lambda command: pytest.fail("no job should run"))
+    with pytest.raises(ValueError):
+        main.run_groupby('/data', '/out', SQL)
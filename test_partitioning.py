@@ -0,0 +1,54 @@
+from functools import partial
+
+import groupby
+from partitioning import (TOKEN_WIDTH, RangeRouter, estimate_groups, key_field_hash, partition_of, plan_reducers,
+                          range_tokens, write_partition_file)
+
+
+def test_key_field_hash_is_java_string_hash():
+    # "hello".hashCode() and a key with non-ASCII bytes, taken from Java
+    assert key_field_hash('hello') == 99162322
+    assert key_field_hash('') == 0
+    assert key_field_hash('é') == (31 * (0xC3 - 256) + (0xA9 - 256)) & 0xFFFFFFFF
+
+
+def test_each_reducer_gets_a_token():
+    tokens = range_tokens(16)
+    assert all(len(token) == TOKEN_WIDTH for token in tokens)
+    assert [partition_of(token, 16) for token in tokens] == list(range(16))
+
+
+def test_estimate_groups():
+    # Every key seen more than once: the sample holds them all
+    assert estimate_groups({'a': 3, 'b': 2}, 0.01) == 2
+    # Keys seen once stand for 1/sqrt(fraction) keys each
+    assert estimate_groups({'a': 1, 'b': 1, 'c': 5}, 0.01) == 21
+
+
+def test_plan_reducers_splits_the_keys_evenly():
+    keys = [f"k{i:04d}" for i in range(1000) for _ in range(2)]
+    plan = plan_reducers(keys, 0.5, groups_per_reducer=250)
+    assert plan['reducers'] == 4
+    assert plan['boundaries'] == ['k0250', 'k0500', 'k0750']
+    assert plan['estimated_groups'] == 1000
+    assert plan['top_key_share'] == 0.001
+
+
+def test_plan_reducers_of_an_empty_sample():
+    assert plan_reducers([], 0.1)['reducers'] == 1
+
+
+def test_router_sends_each_key_to_its_range(tmp_path):
+    path = str(tmp_path / 'partitions')
+    write_partition_file(path, ['g', 'p'])
+    router = RangeRouter(path)
+    for key, reducer in [('a', 0), ('g', 1), ('m', 1), ('p', 2), ('z', 2)]:
+        prefixed = router.prefix(key)
+        assert prefixed.endswith(key)
+        assert partition_of(prefixed[:TOKEN_WIDTH], 3) == reducer
+
+
+def test_ranged_groupby_reducer_strips_the_token(run_task):
+    _, _, _, _, aggregations = groupby.parse_sql("SELECT city, COUNT(*) FROM trips GROUPBY city")
+    lines = run_task(partial(groupby.reducer, aggregations, None, ['city'], True), "0001sf\t2\n0001sf\t3\n")
+    assert lines == ['sf\t5']
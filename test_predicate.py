@@ -0,0 +1,122 @@
+import pytest
+
+from predicate import And, Or, parse_where, rename_columns, tokenize
+
+HEADERS = ['trip_id', 'city', 'fare', 'vendor']
+ROWS = [
+    ['1', 'sf', '10', 'acme'],
+    ['2', 'nyc', '4.5', 'bolt'],
+    ['3', 'la', '30', 'acme'],
+    ['4', "o'hare", '9', 'cab co'],
+    ['5', 'sf', '', 'bolt'],
+]
+
+
+def matches(where, headers=HEADERS, rows=ROWS, types=None):
+    test = parse_where(f"SELECT * FROM trips WHERE {where}").compile(headers, types)
+    return [row[0] for row in rows if test(row)]
+
+
+@pytest.mark.parametrize('where, expected', [
+    ("fare > 9", ['1', '3']),
+    ("fare >= 9", ['1', '3', '4']),
+    ("fare < 9", ['2', '5']),
+    ("fare = 10.0", ['1']),
+    ("fare != 10", ['2', '3', '4', '5']),
+    ("fare <> 10", ['2', '3', '4', '5']),
+    ("city = 'sf'", ['1', '5']),
+    ("city = sf", ['1', '5']),
+    ("city = 'o''hare'", ['4']),
+    ('vendor = "cab co"', ['4']),
+    ("city IN ('sf', 'la')", ['1', '3', '5']),
+    ("city NOT IN ('sf', 'la')", ['2', '4']),
+    ("fare IN (10, 4.5)", ['1', '2']),
+    ("fare BETWEEN 5 AND 10", ['1', '4']),
+    ("fare NOT BETWEEN 5 AND 10", ['2', '3', '5']),
+    ("vendor LIKE 'ac%'", ['1', '3']),
+    ("vendor LIKE '%o%'", ['2', '4', '5']),
+    ("vendor LIKE 'b_lt'", ['2', '5']),
+    ("vendor NOT LIKE 'ac%'", ['2', '4', '5']),
+    ("city = 'sf' AND fare > 5", ['1']),
+    ("city = 'la' OR fare < 5", ['2', '3', '5']),
+    ("NOT (city = 'sf' OR city = 'la')", ['2', '4']),
+    ("(city = 'sf' OR city = 'nyc') AND vendor = 'bolt'", ['2', '5']),
+])
+def test_compiled_clause(where, expected):
+    assert matches(where) == expected
+
+
+def test_clause_ends_at_group_by_order_by_and_limit():
+    condition = parse_where("SELECT city, SUM(fare) FROM trips WHERE fare > 9 GROUPBY city ORDER BY city LIMIT 3")
+    assert condition.columns() == {'fare'}
+
+
+def test_column_comparison():
+    headers = ['a.x', 'b.x']
+    rows = [['1', '2', ], ['3', '3'], ['10', '9']]
+    test = parse_where("SELECT * FROM a WHERE a.x < b.x").compile(headers)
+    assert [row for row in rows if test(row)] == [['1', '2']]
+
+
+def test_qualified_column_against_plain_headers():
+    assert matches("trips.city = 'la'") == ['3']
+
+
+def test_and_or_order_operands_by_selectivity():
+    condition = parse_where("SELECT * FROM t WHERE fare > 1 AND city = 'sf' AND fare != 3")
+    assert isinstance(condition, And)
+    assert [child.op for child in condition.children] == ['=', '>', '!=']
+    condition = parse_where("SELECT * FROM t WHERE city = 'sf' OR fare != 3")
+    assert isinstance(condition, Or)
+    assert [child.op for child in condition.children] == ['!=', '=']
+
+
+def test_rename_columns():
+    condition = rename_columns(parse_where("SELECT * FROM t WHERE t.fare > 1 AND NOT t.city = 'sf'"),
+                               {'t.fare': 'fare', 't.city': 'city'})
+    assert condition.columns() == {'fare', 'city'}
+
+
+@pytest.mark.parametrize('where', [
+    "fare >", "fare > 1 AND", "(fare > 1", "fare NOT = 1", "fare > 1 city = 2", "fare ~ 1",
+])
+def test_malformed_clause(where):
+    with pytest.raises(ValueError):
+        parse_where(f"SELECT * FROM trips WHERE {where}")
+
+
+def test_unknown_column():
+    with pytest.raises(ValueError):
+        parse_where("SELECT * FROM trips WHERE distance > 1").compile(HEADERS)
+
+
+def test_no_where_clause():
+    assert parse_where("SELECT * FROM trips") is None
+
+
+def test_tokenize_keeps_quoted_text_whole():
+    assert tokenize("city = 'a b, c' AND x<>2") == [
+        ('word', 'city'), ('op', '='), ('string', 'a b, c'), ('word', 'AND'), ('word', 'x'), ('op', '!='),
+        ('word', '2')]
+
+
+# Types inferred from a sample that saw only numbers in fare, yet a later row holds a word
+DIRTY = [
+    ['1', 'sf', '10', 'acme'],
+    ['2', 'la', 'abc', 'bolt'],
+    ['3', 'sf', '', 'acme'],
+    ['4', 'la', '9', 'bolt'],
+]
+
+
+@pytest.mark.parametrize('where, types, expected', [
+    ("fare < 50", ['int', 'str', 'int', 'str'], ['1', '4']),
+    ("fare < 50", None, ['1', '3', '4']),
+    ("fare > 9.5", ['int', 'str', 'int', 'str'], ['1', '2']),
+    ("fare > 9.5", ['int', 'str', 'str', 'str'], ['1', '2']),
+    ("fare IN (9, 'abc')", ['int', 'str', 'int', 'str'], ['2', '4']),
+    ("fare BETWEEN 9 AND 10", ['int', 'str', 'str', 'str'], ['1', '4']),
+    ("trips.trip_id < trips.fare", ['int', 'str', 'int', 'str'], ['1', '2', '4']),
+])
+def test_types_do_not_decide_how_fields_compare(where, types, expected):
+    assert matches(where, rows=DIRTY, types=types) == expected
@@ -0,0 +1,50 @@
+from functools import partial
+
+import pytest
+
+import projection
+
+TRIPS = """trip_id,city,vendor
+1,sf,acme
+2,nyc,bolt
+3,sf,acme
+4,la,bolt
+5,sf,acme
+"""
+
+
+@pytest.mark.parametrize('sql, expected', [
+    ("SELECT city, vendor FROM trips", (['city', 'vendor'], 'trips', False)),
+    ("select distinct city from trips", (['city'], 'trips', True)),
+    ("SELECT * FROM trips", (['*'], 'trips', False)),
+])
+def test_parse_sql(sql, expected):
+    assert projection.parse_sql(sql) == expected
+
+
+def test_distinct_rows_remember_the_recently_seen():
+    assert list(projection.distinct_rows(['a', 'b', 'a', 'c', 'b'])) == ['a', 'b', 'c']
+    # With room for two rows, 'a' is forgotten once 'b' and 'c' have been seen
+    assert list(projection.distinct_rows(['a', 'b', 'c', 'a', 'c'], max_rows=2)) == ['a', 'b', 'c', 'a']
+
+
+def test_plain_mapper_keeps_every_row(write_table, run_task):
+    write_table('trips.csv', TRIPS)
+    # The header is skipped wherever it appears in the split
+    lines = run_task(partial(projection.mapper, ['city'], None, False, 'trips'), TRIPS + "6\n")
+    assert lines == ['sf', 'nyc', 'sf', 'la', 'sf']
+
+
+def test_distinct_mapper_drops_duplicates(write_table, run_task):
+    write_table('trips.csv', TRIPS)
+    lines = run_task(partial(projection.mapper, ['city', 'vendor'], None, True, 'trips'), TRIPS)
+    assert lines == ['sf,acme', 'nyc,bolt', 'la,bolt']
+
+
+def test_reducer_drops_adjacent_copies(run_task):
+    assert run_task(projection.reducer, "la\nsf\nsf\nsf,x\n") == ['la', 'sf', 'sf,x']
+
+
+def test_local_distinct_over_several_mappers(write_table, run_local):
+    path = write_table('trips.csv', TRIPS * 50)
+    assert run_local('projection', "SELECT DISTINCT vendor FROM trips", path, split_bytes=200) == ['acme', 'bolt']
@@ -0,0 +1,105 @@
+from functools import partial
+
+import pytest
+
+import query
+
+TRIPS = """trip_id,city,fare,vendor
+1,sf,10,acme
+2,nyc,4.5,bolt
+3,sf,30,acme
+4,la,9,bolt
+5,sf,1,cab
+"""
+
+
+def test_plan_of_a_fused_statement():
+    plan = query.plan_query("SELECT city, SUM(fare) FROM trips WHERE vendor = 'acme' GROUPBY city")
+    assert plan['table'] == 'trips'
+    assert plan['columns'] == ['city']
+    assert plan['group_by'] == ['city']
+    assert plan['aggregations'] == [('SUM', 'fare', None)]
+    assert plan['scan'] == {'city', 'fare', 'vendor'}
+    assert not plan['distinct'] and query.needs_reducer(plan) and query.range_partitioned(plan)
+
+
+def test_plan_of_a_plain_scan():
+    plan = query.plan_query("SELECT * FROM trips WHERE fare > 5")
+    assert plan['columns'] == ['*'] and plan['scan'] is None
+    assert not query.needs_reducer(plan)
+    plan = query.plan_query("SELECT DISTINCT city, fare FROM trips ORDER BY fare DESC LIMIT 2")
+    assert plan['distinct'] and plan['scan'] == {'city', 'fare'}
+    assert query.reducer_count(plan, 8) == 1
+
+
+@pytest.mark.parametrize('sql', [
+    "DELETE FROM trips",
+    "SELECT city FROM trips GROUPBY city",
+    "SELECT *, SUM(fare) FROM trips",
+    "SELECT DISTINCT city FROM trips ORDER BY fare LIMIT 2",
+])
+def test_invalid_statements(sql):
+    with pytest.raises(ValueError):
+        query.plan_query(sql)
+
+
+def test_mapper_projects_filtered_rows(write_table, run_task, execution):
+    write_table('trips.csv', TRIPS)
+    lines = run_task(partial(query.mapper, query.plan_query("SELECT trip_id, fare FROM trips WHERE city = 'sf'")),
+                     TRIPS)
+    assert lines == ['1,10', '3,30', '5,1']
+
+
+def test_mapper_skips_short_rows(write_table, run_task, execution):
+    write_table('trips.csv', TRIPS)
+    text = TRIPS + "6,sf\n7\n8,sf,2,acme\n"
+    lines = run_task(partial(query.mapper, query.plan_query("SELECT trip_id, vendor FROM trips WHERE city = 'sf'")),
+                     text)
+    assert lines == ['1,acme', '3,acme', '5,cab', '8,acme']
+
+
+def test_ordered_mapper_skips_short_rows(write_table, run_task):
+    write_table('trips.csv', TRIPS)
+    plan = query.plan_query("SELECT trip_id FROM trips ORDER BY vendor LIMIT 2")
+    assert run_task(partial(query.mapper, plan), TRIPS + "6,sf\n") == ['acme\t1', 'acme\t3']
+
+
+def test_local_query_counts_short_rows_as_parse_errors(write_table, run_local):
+    path = write_table('trips.csv', TRIPS + "6,sf\n7\n")
+    counters = {}
+    lines = run_local('query', "SELECT trip_id, vendor FROM trips ORDER BY fare DESC LIMIT 3", path,
+                      job_counters=counters)
+    assert lines == ['1,acme', '3,acme', '4,bolt']
+    assert counters['mapper']['parse_errors'] == 2
+
+
+@pytest.mark.parametrize('sql, expected', [
+    ("SELECT city, COUNT(*) FROM trips GROUPBY city", ['la\t1', 'nyc\t1', 'sf\t3']),
+    ("SELECT city, MAX(fare) FROM trips WHERE vendor != 'cab' GROUPBY city", ['la\t9.0', 'nyc\t4.5', 'sf\t30.0']),
+    ("SELECT DISTINCT vendor FROM trips", ['acme', 'bolt', 'cab']),
+    ("SELECT trip_id FROM trips WHERE fare BETWEEN 4 AND 10", ['1', '2', '4']),
+])
+def test_local_query(write_table, run_local, sql, expected):
+    assert run_local('query', sql, write_table('trips.csv', TRIPS)) == expected
+
+
+def test_local_distinct_with_order_by_removes_copies_from_every_mapper(write_table, run_local):
+    rows = ''.join(f"{i},{city},{fare},acme\n" for i, (city, fare) in
+                   enumerate([('sf', 1), ('la', 2), ('sf', 1), ('nyc', 3), ('la', 2), ('sf', 1), ('la', 5)] * 30))
+    path = write_table('trips.csv', "trip_id,city,fare,vendor\n" + rows)
+    lines = run_local('query', "SELECT DISTINCT city, fare FROM trips ORDER BY fare LIMIT 3", path,
+                      split_bytes=64)
+    assert lines == ['la,2', 'nyc,3', 'sf,1']
+
+
+def test_distinct_reducer_removes_copies_that_are_not_adjacent(run_task):
+    plan = query.plan_query("SELECT DISTINCT city, fare FROM trips ORDER BY fare LIMIT 3")
+    # Hadoop sorts on the ORDER BY value only, so copies of a row may be apart
+    lines = run_task(partial(query.reducer, plan), "1\tsf,1\n1\tla,1\n1\tsf,1\n2\tnyc,2\n")
+    assert lines == ['sf,1', 'la,1', 'nyc,2']
+
+
+def test_distinct_mapper_emits_at_most_the_limit(write_table, run_task):
+    write_table('trips.csv', TRIPS)
+    plan = query.plan_query("SELECT DISTINCT vendor, fare FROM trips ORDER BY fare DESC LIMIT 2")
+    assert run_task(partial(query.mapper, plan), TRIPS + "6,sf,30,acme\n") == ['30\tacme,30', '10\tacme,10']
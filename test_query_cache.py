@@ -0,0 +1,78 @@
+import os
+from functools import partial
+
+import pytest
+
+from query_cache import cache_entry, load_result, local_fingerprint, normalize_sql, store_result
+
+
+@pytest.mark.parametrize('a, b', [
+    ("select city, fare from trips where fare > 5;", "SELECT city,fare FROM trips WHERE fare>5"),
+    ("SELECT  *\n FROM trips  GROUPBY city", "select * from trips groupby city"),
+    ("SELECT * FROM trips WHERE city IN ( 'sf' , 'la' )", "SELECT * FROM trips WHERE city IN('sf','la')"),
+])
+def test_equivalent_statements_share_a_key(a, b):
+    assert normalize_sql(a) == normalize_sql(b)
+
+
+@pytest.mark.parametrize('a, b', [
+    ("SELECT City FROM trips", "SELECT city FROM trips"),
+    ("SELECT * FROM trips WHERE city = 'SF'", "SELECT * FROM trips WHERE city = 'sf'"),
+    ("SELECT * FROM trips WHERE city = 'a  b'", "SELECT * FROM trips WHERE city = 'a b'"),
+])
+def test_names_and_literals_keep_their_case_and_spacing(a, b):
+    assert normalize_sql(a) != normalize_sql(b)
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache_dir = str(tmp_path / 'cache')
+    return partial(cache_entry, fingerprint=partial(local_fingerprint, cache_dir=cache_dir), cache_dir=cache_dir)
+
+
+def store(entry, text, **options):
+    with open('result.txt', 'w') as f:
+        f.write(text)
+    return store_result(entry, 'result.txt', **options)
+
+
+def test_a_repeated_query_hits(write_table, cache):
+    path = write_table('trips.csv', "trip_id\n1\n")
+    entry = cache("SELECT * FROM trips", [path])
+    assert load_result(entry) is None
+    store(entry, 'result')
+    assert load_result(cache("select *  from trips;", [path])) == entry
+
+
+def test_a_changed_input_misses_and_drops_the_old_result(write_table, cache):
+    path = write_table('trips.csv', "trip_id\n1\n")
+    old = cache("SELECT * FROM trips", [path])
+    store(old, 'result')
+    write_table('trips.csv', "trip_id\n2\n")
+    new = cache("SELECT * FROM trips", [path])
+    assert new != old and load_result(new) is None
+    assert not os.path.exists(old)
+
+
+def test_least_recently_used_results_are_evicted(write_table, cache):
+    paths = [write_table(f"t{i}.csv", f"id\n{i}\n") for i in range(3)]
+    entries = [cache("SELECT * FROM t", [path]) for path in paths]
+    store(entries[0], 'x' * 10)
+    store(entries[1], 'x' * 10)
+    os.utime(entries[0], (1, 1))
+    os.utime(entries[1], (2, 2))
+    load_result(entries[0])
+    store(entries[2], 'x' * 10, max_bytes=25)
+    assert [os.path.exists(entry) for entry in entries] == [True, False, True]
+
+
+def test_fingerprint_covers_every_file_of_a_directory(workdir, tmp_path):
+    table = workdir / 'trips'
+    table.mkdir()
+    (table / 'a.csv').write_text('1\n')
+    (table / 'b.csv').write_text('2\n')
+    cache_dir = str(tmp_path / 'cache')
+    before = local_fingerprint(str(table), cache_dir)
+    assert len(before.splitlines()) == 2
+    (table / 'b.csv').write_text('3\n')
+    assert local_fingerprint(str(table), cache_dir) != before
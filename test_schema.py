@@ -0,0 +1,56 @@
+import pytest
+
+from schema import column_types, infer_schema, infer_type, load_registry, register_file, sniff_delimiter, table_schema
+
+
+@pytest.mark.parametrize('values, expected', [
+    (['1', '-2', ''], 'int'),
+    (['1', '2.5'], 'float'),
+    (['1e3', '2'], 'float'),
+    (['1', 'abc'], 'str'),
+    (['', ''], 'str'),
+])
+def test_infer_type(values, expected):
+    assert infer_type(values) == expected
+
+
+def test_sniff_delimiter():
+    assert sniff_delimiter('a,b,c') == ','
+    assert sniff_delimiter('a\tb;c\td') == '\t'
+    assert sniff_delimiter('single') == ','
+
+
+def test_infer_schema_keeps_the_header_as_written():
+    schema = infer_schema(['\ufeffid; city ;fare\r\n', '1;sf;2.5\r\n', '2;la;\r\n'], 'trips.csv')
+    assert schema == {'file': 'trips.csv', 'columns': ['id', 'city', 'fare'], 'types': ['int', 'str', 'float'],
+                      'delimiter': ';', 'header': '\ufeffid; city ;fare'}
+    with pytest.raises(ValueError):
+        infer_schema([], 'empty.csv')
+
+
+def test_infer_schema_samples_only_the_first_rows():
+    # A word past the sample does not change the type; the predicates cope with it (see predicate.py)
+    schema = infer_schema(['id,fare', '1,2', '2,3', '3,abc'], 'trips.csv', sample_rows=2)
+    assert schema['types'] == ['int', 'int']
+
+
+def test_table_schema_lookup(write_table, monkeypatch):
+    monkeypatch.delenv('mapreduce_map_input_file', raising=False)
+    monkeypatch.delenv('map_input_file', raising=False)
+    write_table('trips.csv', "trip_id,city\n1,sf\n")
+    assert table_schema('trips')['file'] == 'trips.csv'
+    # With one table registered, it is the one
+    assert table_schema('rides')['file'] == 'trips.csv'
+    write_table('views.csv', "user_id,product_id\nu1,p1\n")
+    assert set(load_registry()) == {'trips', 'views'}
+    with pytest.raises(ValueError):
+        table_schema('rides')
+    monkeypatch.setenv('mapreduce_map_input_file', 'hdfs:///data/views.csv')
+    assert table_schema('rides')['columns'] == ['user_id', 'product_id']
+    assert column_types(table_schema('trips'), ['city', 'trip_id']) == ['str', 'int']
+
+
+def test_register_file_under_another_name(write_table):
+    path = write_table('tripdata.csv', "trip_id\n1\n", register=False)
+    register_file(path, 'trips')
+    assert list(load_registry()) == ['trips']
@@ -0,0 +1,136 @@
+from functools import partial
+
+import pytest
+
+import secondary_index
+from predicate import parse_where
+from secondary_index import UNPARSED, key_ranges, sort_key
+
+
+def where(clause):
+    return parse_where(f"SELECT * FROM trips WHERE {clause}")
+
+
+def test_sort_key_orders_numbers_as_text():
+    values = [-1e9, -2.5, -0.0, 0.0, 1, 2.5, 10, 1e9]
+    keys = [sort_key(value, 'float') for value in values]
+    assert keys == sorted(keys)
+    assert sort_key(-0.0, 'float') == sort_key(0, 'int')
+    assert sort_key('abc', 'str') == 'abc'
+
+
+def test_values_of_a_numeric_column_that_are_not_numbers_sort_last():
+    assert sort_key('abc', 'int') == UNPARSED + 'abc'
+    assert sort_key('abc', 'int') > sort_key(1e300, 'float')
+
+
+def test_mapper_indexes_the_words_of_a_numeric_column(write_table, run_task, monkeypatch):
+    write_table('trips.csv', "trip_id,city,fare\n1,sf,10\n2,la,4\n")
+    monkeypatch.setenv('mapreduce_map_input_file', 'trips.csv')
+    lines = run_task(partial(secondary_index.mapper, 'sorted', 'trips', 'fare'),
+                     "0\ttrip_id,city,fare\n18\t1,sf,10\n26\t2,la,n/a\n35\t3,la,\n43\t4\n")
+    assert lines == [f"{sort_key('10', 'int')}\ttrips.csv\t18\t7", f"{UNPARSED}n/a\ttrips.csv\t26\t8"]
+
+
+@pytest.mark.parametrize('clause, expected', [
+    ("fare = 10", [(sort_key(10, 'int'), sort_key(10, 'int'))]),
+    ("fare > 10", [(sort_key(10, 'int'), None)]),
+    # A word compares as text with 10, so it may be below it
+    ("fare < 10", [(None, sort_key(10, 'int')), (UNPARSED, None)]),
+    ("fare BETWEEN 5 AND 10", [(sort_key(5, 'int'), sort_key(10, 'int'))]),
+    ("fare = 'abc'", None),
+    ("fare != 10", None),
+])
+def test_key_ranges_of_a_numeric_column(clause, expected):
+    assert key_ranges(where(clause), 'fare', 'int') == expected
+
+
+def test_key_ranges_of_a_text_column():
+    assert key_ranges(where("city >= 'la' AND city < 'sf'"), 'city', 'str') == [('la', 'sf')]
+    # An unquoted number compares numerically with the fields that are numbers
+    assert key_ranges(where("city = 10"), 'city', 'str') is None
+
+
+TRIPS = "trip_id,city,fare\n" + ''.join(f"{i},city{i % 7},{i % 400}\n" for i in range(2000))
+
+
+@pytest.fixture(autouse=True)
+def fences(monkeypatch):
+    # A fence every 16 entries, so that a sorted index of a small table narrows lookups down
+    monkeypatch.setattr(secondary_index, 'FENCE_ENTRIES', 16)
+
+
+def build(run_local, path, sql):
+    lines = run_local('index', sql, path)
+    return secondary_index.save_index(sql, lines, secondary_index.local_fingerprint([path]))
+
+
+def test_parse_create_index():
+    assert secondary_index.parse_create_index("CREATE INDEX ON trips (fare)") == ('sorted', 'trips', 'fare')
+    assert secondary_index.parse_create_index("create hash index on trips(city)") == ('hash', 'trips', 'city')
+    with pytest.raises(ValueError):
+        secondary_index.parse_create_index("CREATE INDEX trips (fare)")
+
+
+def test_intersect():
+    assert secondary_index.intersect([(None, 'm')], [('c', None)]) == [('c', 'm')]
+    assert secondary_index.intersect([('a', 'b'), ('x', 'z')], [('y', None)]) == [('y', 'z')]
+    assert secondary_index.intersect([('a', 'b')], [('c', 'd')]) == []
+
+
+@pytest.mark.parametrize('kind, where, used', [
+    ('', "fare = 7", True),
+    ('', "fare BETWEEN 10 AND 12 AND city = 'city3'", True),
+    ('HASH ', "fare IN (1, 399)", True),
+    # An OR is not a conjunct on the column, so it is not narrowed down
+    ('', "fare = 1 OR fare = 2", False),
+])
+def test_filter_reads_only_the_indexed_rows(write_table, run_local, capsys, kind, where, used):
+    path = write_table('trips.csv', TRIPS)
+    sql = f"SELECT trip_id, fare FROM trips WHERE {where}"
+    expected = run_local('filter', sql, path)
+    meta = build(run_local, path, f"CREATE {kind}INDEX ON trips (fare)")
+    assert meta['entries'] == 2000
+    capsys.readouterr()
+    lines = run_local('filter', sql, path)
+    assert ('Using index trips.fare' in capsys.readouterr().err) == used
+    assert lines == expected
+
+
+def test_hash_index_does_not_serve_ranges(write_table, run_local):
+    path = write_table('trips.csv', TRIPS)
+    build(run_local, path, "CREATE HASH INDEX ON trips (fare)")
+    fingerprint = partial(secondary_index.local_fingerprint, [path])
+    schema = {'columns': ['trip_id', 'city', 'fare']}
+    assert secondary_index.find_index(where("fare = 7"), 'trips', schema, fingerprint) is not None
+    assert secondary_index.find_index(where("fare BETWEEN 7 AND 8"), 'trips', schema, fingerprint) is None
+
+
+def test_an_index_of_changed_data_is_dropped(write_table, run_local):
+    path = write_table('trips.csv', TRIPS)
+    build(run_local, path, "CREATE INDEX ON trips (trip_id)")
+    assert secondary_index.table_indexes('trips')
+    write_table('trips.csv', TRIPS + "2000,city0,5\n")
+    assert run_local('filter', "SELECT city FROM trips WHERE trip_id = 2000", path) == ['city0']
+    assert secondary_index.table_indexes('trips') == []
+
+
+def test_an_index_matching_too_many_rows_is_not_used(write_table, run_local):
+    path = write_table('trips.csv', TRIPS)
+    build(run_local, path, "CREATE INDEX ON trips (fare)")
+    fingerprint = partial(secondary_index.local_fingerprint, [path])
+    schema = {'columns': ['trip_id', 'city', 'fare']}
+    assert secondary_index.find_index(where("fare > 100"), 'trips', schema, fingerprint) is None
+
+
+def test_read_records_coalesces_nearby_records(write_table, monkeypatch):
+    path = write_table('trips.csv', TRIPS, register=False)
+    reads = []
+    read_range = secondary_index.read_range
+    monkeypatch.setattr(secondary_index, 'read_range', lambda *args: reads.append(args) or read_range(*args))
+    first, second = TRIPS.index('\n5,') + 1, TRIPS.index('\n9,') + 1
+    far = len(TRIPS) - len("1999,city4,399\n")
+    monkeypatch.setattr(secondary_index, 'COALESCE_BYTES', 100)
+    records = list(secondary_index.read_records([(path, first, 8), (path, second, 8), (path, far, 14)]))
+    assert records == ['5,city5,', '9,city2,', '1999,city4,399']
+    assert len(reads) == 2
@@ -0,0 +1,53 @@
+import pytest
+
+from top_n import parse_order_by, sort_value, top_n, top_n_distinct
+
+
+@pytest.mark.parametrize('sql, expected', [
+    ("SELECT * FROM trips ORDER BY fare DESC LIMIT 10", {'column': 'fare', 'descending': True, 'limit': 10}),
+    ("SELECT * FROM trips ORDER BY fare asc LIMIT 3;", {'column': 'fare', 'descending': False, 'limit': 3}),
+    ("SELECT city, SUM(fare) FROM trips GROUPBY city ORDER BY SUM(fare) LIMIT 1",
+     {'column': 'SUM(fare)', 'descending': False, 'limit': 1}),
+    ("SELECT * FROM trips LIMIT 5", {'column': None, 'descending': False, 'limit': 5}),
+    ("SELECT * FROM trips", None),
+])
+def test_parse_order_by(sql, expected):
+    assert parse_order_by(sql) == expected
+
+
+def test_order_by_needs_a_limit():
+    with pytest.raises(ValueError):
+        parse_order_by("SELECT * FROM trips ORDER BY fare")
+
+
+def test_numbers_sort_by_value_and_before_text():
+    assert sorted(['b', '10', 'a', '9', '-1.5'], key=sort_value) == ['-1.5', '9', '10', 'a', 'b']
+
+
+def order(column='x', descending=False, limit=3):
+    return {'column': column, 'descending': descending, 'limit': limit}
+
+
+def test_top_n():
+    values = ['5', '1', '9', '3', '7']
+    assert top_n(values, order(), str) == ['1', '3', '5']
+    assert top_n(values, order(descending=True), str) == ['9', '7', '5']
+    assert top_n(iter(values), order(column=None), str) == ['5', '1', '9']
+
+
+@pytest.mark.parametrize('descending', [False, True])
+def test_top_n_distinct_matches_sorting_the_distinct_items(descending):
+    items = [(str(i * 7 % 23), f"row{i * 7 % 23}") for i in range(200)]
+    expected = sorted(set(items), key=lambda item: sort_value(item[0]), reverse=descending)[:5]
+    assert top_n_distinct(items, order(descending=descending, limit=5), lambda item: item[0]) == expected
+
+
+def test_top_n_distinct_does_not_readmit_a_dropped_item():
+    # '3' is kept, pushed out by '1' and '2', and then comes again
+    assert top_n_distinct(['3', '4', '1', '2', '3', '1'], order(limit=2), str) == ['1', '2']
+    assert top_n_distinct(['3', '3', '3'], order(limit=2), str) == ['3']
+
+
+def test_top_n_distinct_without_order_by_keeps_the_first_distinct_items():
+    assert top_n_distinct(['b', 'b', 'a', 'b', 'c', 'd'], order(column=None), str) == ['b', 'a', 'c']
+    assert top_n_distinct(['a'], order(limit=0), str) == []
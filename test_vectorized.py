@@ -0,0 +1,102 @@
+import io
+import sys
+from functools import partial
+
+import pytest
+
+import groupby
+import vectorized
+from counters import Counters
+from predicate import parse_where
+from schema import table_schema
+from zone_maps import ScanStats
+
+np = pytest.importorskip('numpy')
+
+TRIPS = "trip_id,city,fare,vendor\n" + ''.join(
+    f"{i},{('sf', 'la', 'nyc')[i % 3]},{'' if i % 11 == 0 else (i * 7) % 40},{('acme', 'bolt')[i % 2]}\n"
+    for i in range(1, 200))
+HEADERS = ['trip_id', 'city', 'fare', 'vendor']
+
+
+def set_stdin(monkeypatch, text):
+    monkeypatch.setattr(sys, 'stdin', io.TextIOWrapper(io.BytesIO(text.encode('utf-8')), encoding='utf-8'))
+
+
+def test_read_blocks_ends_every_block_at_a_line(monkeypatch):
+    monkeypatch.setattr(vectorized, 'BATCH_BYTES', 50)
+    set_stdin(monkeypatch, TRIPS + "200,sf,1,acme")
+    counters = Counters('mapper')
+    blocks = list(vectorized.read_blocks(None, ScanStats(), counters))
+    assert len(blocks) > 1 and all(block.endswith('\n') for block in blocks[:-1])
+    assert ''.join(blocks) == TRIPS + "200,sf,1,acme"
+    assert counters.bytes_in == len(TRIPS) + 13
+
+
+def test_to_numbers():
+    assert vectorized.to_numbers(['1', '2.5']).tolist() == [1.0, 2.5]
+    numbers = vectorized.to_numbers(['1', '', 'abc'])
+    assert numbers[0] == 1.0 and np.isnan(numbers[1:]).all()
+
+
+def test_batch_splits_a_regular_block_at_once():
+    batch = vectorized.Batch("trip_id,city\n1,sf\n2,la\n", "trip_id,city", 2, 2)
+    assert batch._fields is not None
+    assert (batch.size, batch.errors) == (2, 0)
+    assert batch.column(1) == ['sf', 'la'] and batch.lines == ['1,sf', '2,la']
+    assert batch.numbers(0).tolist() == [1.0, 2.0]
+
+
+def test_batch_drops_rows_narrower_than_the_width():
+    batch = vectorized.Batch("1,sf\r\n2\n\n3,la,x\n", "trip_id,city", 2, 2)
+    assert (batch.size, batch.errors) == (2, 1)
+    assert batch.column(1) == ['sf', 'la'] and batch.lines == ['1,sf', '3,la,x']
+
+
+@pytest.mark.parametrize('clause', [
+    "fare > 20",
+    "fare <= 7 OR city = 'la'",
+    "NOT fare != 14",
+    "fare BETWEEN 5 AND 15 AND vendor = 'acme'",
+    "city IN ('sf', 'nyc') AND fare IN (1, 7, 21)",
+    "city LIKE 'n%'",
+    "vendor LIKE '_cm%'",
+    "trip_id < fare",
+])
+def test_condition_mask_agrees_with_the_compiled_predicate(write_table, clause):
+    write_table('trips.csv', TRIPS)
+    types = table_schema('trips')['types']
+    condition = parse_where(f"SELECT * FROM trips WHERE {clause}")
+    batch = vectorized.Batch(TRIPS, TRIPS.split('\n')[0], 4, 4)
+    predicate = condition.compile(HEADERS, types)
+    expected = [predicate(line.split(',')) for line in batch.lines]
+    assert vectorized.condition_mask(condition, HEADERS, types, batch).tolist() == expected
+
+
+def test_group_states():
+    inverse = np.array([0, 1, 0, 1, 1])
+    values = np.array([4.0, 1.0, 2.0, 7.0, 3.0])
+    rows = np.argsort(inverse, kind='stable')
+    order = rows, np.searchsorted(inverse[rows], np.arange(2))
+    assert [state.result() for state in vectorized.group_states('SUM', inverse, 2, values, order)] == [6.0, 11.0]
+    assert [state.result() for state in vectorized.group_states('COUNT', inverse, 2, None, order)] == [2, 3]
+    assert [state.result() for state in vectorized.group_states('MIN', inverse, 2, values, order)] == [2.0, 1.0]
+    assert [state.result() for state in vectorized.group_states('MAX', inverse, 2, values, order)] == [4.0, 7.0]
+
+
+def test_can_aggregate():
+    assert vectorized.can_aggregate([('SUM', 'fare', None), ('COUNT', '*', None)])
+    assert not vectorized.can_aggregate([('MEDIAN', 'fare', None)])
+
+
+@pytest.mark.parametrize('sql', [
+    "SELECT city, SUM(fare), COUNT(*) FROM trips GROUPBY city",
+    "SELECT city, vendor, MIN(fare), MAX(fare), AVG(fare) FROM trips WHERE trip_id > 50 GROUPBY city, vendor",
+    "SELECT vendor, COUNT(fare) FROM trips WHERE city != 'sf' GROUPBY vendor",
+])
+def test_groupby_mapper_gives_the_same_partials_on_both_paths(write_table, run_task, monkeypatch, sql):
+    write_table('trips.csv', TRIPS)
+    task = partial(groupby.mapper, *groupby.parse_sql(sql))
+    batches = run_task(task, TRIPS)
+    monkeypatch.setattr(vectorized, 'np', None)
+    assert sorted(batches) == sorted(run_task(task, TRIPS))
@@ -0,0 +1,99 @@
+import io
+import json
+from functools import partial
+
+import filter as filter_op
+from predicate import parse_where
+from zone_maps import ColumnStats, ScanStats, build_zone_map, scan_lines, write_zone_maps, zone_map_path
+
+# Rows of BLOCK_BYTES / 4 bytes, so blocks hold 4 rows each, with fares 0-3, 10-13 and 20-23
+ROWS = [f"{i:02d},{'sf' if i < 4 else 'la'},{(i // 4) * 10 + i % 4:02d}" for i in range(12)]
+BLOCK_BYTES = 36
+TRIPS = "trip_id,city,fare\n" + '\n'.join(ROWS) + '\n'
+
+
+def where(clause):
+    return parse_where(f"SELECT * FROM trips WHERE {clause}")
+
+
+def zone_map(write_table):
+    path = write_table('trips.csv', TRIPS)
+    return path, build_zone_map(path, block_bytes=BLOCK_BYTES)
+
+
+def test_column_stats():
+    stats = ColumnStats()
+    for value in ['3', '', '10', '3']:
+        stats.update(value)
+    assert stats.to_dict() == {'numeric': True, 'min': 3.0, 'max': 10.0, 'min_text': '', 'max_text': '3',
+                               'null_count': 1, 'distinct': 2}
+    stats.update('abc')
+    assert stats.to_dict()['numeric'] is False
+    assert stats.to_dict()['min'] is None
+
+
+def test_blocks_cover_the_file(write_table):
+    path, zones = zone_map(write_table)
+    assert zones['columns'] == ['trip_id', 'city', 'fare']
+    assert [block['rows'] for block in zones['blocks']] == [4, 4, 4]
+    assert [(block['stats']['fare']['min'], block['stats']['fare']['max']) for block in zones['blocks']] == [
+        (0, 3), (10, 13), (20, 23)]
+    last = zones['blocks'][-1]
+    with open(path, 'rb') as f:
+        assert last['offset'] + last['length'] == len(f.read())
+
+
+def test_write_zone_maps_puts_a_sidecar_next_to_each_file(write_table, workdir):
+    path = write_table('trips.csv', TRIPS)
+    assert write_zone_maps(str(workdir)) == [zone_map_path(path)]
+    assert zone_map_path(path).endswith('_trips.csv.zonemap.json')
+    with open(zone_map_path(path)) as f:
+        assert json.load(f)['columns'] == ['trip_id', 'city', 'fare']
+
+
+def test_can_match():
+    stats = {'fare': {'numeric': True, 'min': 10.0, 'max': 13.0, 'min_text': '10', 'max_text': '13',
+                      'null_count': 0, 'distinct': 4},
+             'city': {'numeric': False, 'min': None, 'max': None, 'min_text': 'nyc', 'max_text': 'nyc',
+                      'null_count': 0, 'distinct': 1}}
+    assert where("fare > 12").can_match(stats)
+    assert not where("fare > 13").can_match(stats)
+    assert not where("fare BETWEEN 0 AND 9").can_match(stats)
+    assert not where("city = 'sf'").can_match(stats)
+    assert where("city = 'sf' OR fare = 11").can_match(stats)
+    assert not where("city = 'sf' AND fare = 11").can_match(stats)
+    assert where("fare IN (1, 12)").can_match(stats)
+
+
+def test_scan_skips_blocks_that_cannot_match(write_table):
+    path, zones = zone_map(write_table)
+    with open(path, 'rb') as f:
+        scan_stats = ScanStats()
+        lines = list(scan_lines(where("fare >= 11 AND fare < 12"), zones, (path, 0, None), f, scan_stats))
+    # The header comes before the first block and is always read
+    assert [line.strip() for line in lines] == ['trip_id,city,fare'] + ROWS[4:8]
+    assert (scan_stats.blocks_skipped, scan_stats.rows_skipped) == (2, 8)
+
+
+def test_a_split_past_the_start_is_skipped_only_as_a_whole(write_table):
+    path, zones = zone_map(write_table)
+    second = zones['blocks'][1]
+    condition = where("fare > 20")
+    lines = '\n'.join(ROWS[4:8]) + '\n'
+    scan_stats = ScanStats()
+    assert list(scan_lines(condition, zones, (path, second['offset'] + 1, 5),
+                           io.BytesIO(lines.encode()), scan_stats)) == []
+    assert scan_stats.blocks_skipped == 1
+    # A split reaching into a block that may match is read in full
+    assert len(list(scan_lines(condition, zones, (path, second['offset'] + 1, second['length'] + 5),
+                               io.BytesIO(lines.encode())))) == 4
+
+
+def test_filter_mapper_uses_the_sidecar_of_its_input(write_table, run_task, monkeypatch):
+    path = write_table('trips.csv', TRIPS)
+    write_zone_maps(path, block_bytes=BLOCK_BYTES)
+    monkeypatch.setenv('mapreduce_map_input_file', path)
+    monkeypatch.setenv('mapreduce_map_input_start', '0')
+    where_clause, projections, table = filter_op.parse_sql("SELECT trip_id FROM trips WHERE fare > 21")
+    lines = run_task(partial(filter_op.mapper, where_clause, projections, table), TRIPS)
+    assert lines == ['10', '11']
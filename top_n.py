@@ -0,0 +1,107 @@
+"""
+ORDER BY ... LIMIT support.
+
+A query with `ORDER BY <column> [ASC|DESC] LIMIT n` only ever needs n rows.
+Each task keeps them with heapq.nsmallest/nlargest, which hold a heap of n
+items however long the input is, so the mappers ship at most n rows each and
+a single reducer makes the final merge. LIMIT without ORDER BY keeps the first
+n rows. Values that parse as numbers sort numerically and before text.
+With SELECT DISTINCT, top_n_distinct() keeps the first n distinct rows instead.
+"""
+import bisect
+import heapq
+import re
+from itertools import islice
+from operator import itemgetter
+
+
+def parse_order_by(sql_statement):
+    """
+    Parses the ORDER BY and LIMIT clauses of a SQL statement.
+    Returns:
+        dict: {'column', 'descending', 'limit'}, where 'column' is None for a
+            LIMIT without ORDER BY; or None when the statement has no LIMIT.
+    Raises:
+        ValueError: For an ORDER BY without a LIMIT.
+    """
+    order_match = re.search(r"\bORDER\s+BY\s+(.+?)(?:\s+(ASC|DESC))?(?=\s+LIMIT\b|\s*;?\s*$)",
+                            sql_statement, re.IGNORECASE)
+    limit_match = re.search(r"\bLIMIT\s+(\d+)\s*;?\s*$", sql_statement, re.IGNORECASE)
+    if order_match and not limit_match:
+        raise ValueError("ORDER BY needs a LIMIT")
+    if not limit_match:
+        return None
+    return {
+        'column': order_match.group(1).strip() if order_match else None,
+        'descending': bool(order_match and order_match.group(2) and order_match.group(2).upper() == 'DESC'),
+        'limit': int(limit_match.group(1)),
+    }
+
+
+def sort_value(text):
+    """
+    Sort key of a field: numbers by value, ahead of text.
+    """
+    try:
+        return (0, float(text), '')
+    except ValueError:
+        return (1, 0.0, text)
+
+
+def top_n(items, order, key):
+    """
+    Returns the first order['limit'] items in ORDER BY order, holding no more
+    than that many at a time.
+    Args:
+        items (iterable): The items to choose from.
+        order (dict): As returned by parse_order_by.
+        key (function): Maps an item to the text of its ORDER BY value.
+    """
+    if order['column'] is None:
+        return list(islice(items, order['limit']))
+    choose = heapq.nlargest if order['descending'] else heapq.nsmallest
+    return choose(order['limit'], items, key=lambda item: sort_value(key(item)))
+
+
+def top_n_distinct(items, order, key):
+    """
+    Like top_n(), but returns each distinct item once. An item pushed out of
+    the first order['limit'] is no better than any item kept, so it cannot
+    get back in when it comes again, and only the kept items are remembered.
+    Args:
+        items (iterable): Hashable items to choose from.
+        order (dict): As returned by parse_order_by.
+        key (function): Maps an item to the text of its ORDER BY value.
+    """
+    limit = order['limit']
+    if order['column'] is None:
+        seen = set()
+        first = []
+        for item in items:
+            if len(first) == limit:
+                break
+            if item not in seen:
+                seen.add(item)
+                first.append(item)
+        return first
+    if limit == 0:
+        return []
+
+    descending = order['descending']
+    # (sort value, item) pairs in ascending order, and the items among them
+    kept = []
+    members = set()
+    for item in items:
+        if item in members:
+            continue
+        value = sort_value(key(item))
+        if len(kept) == limit:
+            worst = kept[0][0] if descending else kept[-1][0]
+            if (value <= worst) if descending else (value >= worst):
+                continue
+            members.discard(kept.pop(0 if descending else -1)[1])
+        bisect.insort(kept, (value, item), key=itemgetter(0))
+        members.add(item)
+    if descending:
+        kept.reverse()
+    return [item for _, item in kept]
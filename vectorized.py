@@ -0,0 +1,355 @@
+"""
+Vectorised batch execution for the CSV mappers, used when NumPy is installed.
+
+Instead of handling one line at a time, the mappers read stdin in blocks of
+about BATCH_BYTES, split each block into rows once, and turn only the columns
+the query references into NumPy arrays: the text of the fields and, on
+demand, their float values (NaN where a field is not a number). The WHERE
+clause is evaluated as a boolean mask over the whole batch with the same
+semantics as the predicates predicate.py compiles with the column types of
+the schema registry (an unquoted number compares numerically with the fields
+that are numbers and as text with the others; empty fields are nulls), and
+groupby partial aggregates are computed per batch with np.unique plus
+np.bincount for SUM, COUNT and AVG and ufunc.reduceat for MIN and MAX. The
+partial states are ordinary accumulators (see aggregators.py), so combiners
+and reducers merge them as they merge the row path's. Each batch's output
+goes out in a single write.
+
+The row-at-a-time path stays the fallback: without NumPy, for columnar
+sources, for ORDER BY ... LIMIT and SELECT DISTINCT, and for aggregates other
+than SUM, COUNT, AVG, MIN and MAX.
+"""
+import re
+import sys
+import time
+from itertools import islice
+
+from aggregators import NON_NUMERIC, AvgAgg, CountAgg, MaxAgg, MinAgg, SumAgg
+from predicate import OPERATORS, And, Between, ColumnRef, Comparison, InList, Like, Not, Or, column_index
+from zone_maps import load_zone_map, scan_lines
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Bytes of input read per batch
+BATCH_BYTES = 4 << 20
+# Lines per batch when a zone map makes the input arrive line by line
+BATCH_LINES = 50000
+BATCH_AGGREGATIONS = {'SUM', 'COUNT', 'AVG', 'MIN', 'MAX'}
+
+
+def available():
+    return np is not None
+
+
+def can_aggregate(aggregations):
+    """
+    Returns whether the batch path computes every aggregation of a groupby.
+    """
+    return available() and all(func in BATCH_AGGREGATIONS for func, _, _ in aggregations)
+
+
+def read_blocks(where_clause, scan_stats, counters):
+    """
+    Yields the CSV input on stdin as text blocks of whole lines. With a WHERE
+    clause and a zone map the lines come from scan_lines, which skips the
+    blocks that cannot match.
+    """
+    zone_map = load_zone_map() if where_clause is not None else None
+    if zone_map is not None:
+        lines = scan_lines(where_clause, zone_map, scan_stats=scan_stats)
+        while True:
+            block = ''.join(islice(lines, BATCH_LINES))
+            if not block:
+                return
+            counters.bytes_in += len(block)
+            yield block
+
+    stream = sys.stdin.buffer
+    rest = b''
+    while True:
+        data = stream.read(BATCH_BYTES)
+        if not data:
+            break
+        data = rest + data
+        end = data.rfind(b'\n') + 1
+        rest = data[end:]
+        if end:
+            counters.bytes_in += end
+            yield data[:end].decode('utf-8')
+    if rest:
+        counters.bytes_in += len(rest)
+        yield rest.decode('utf-8')
+
+
+def to_numbers(fields):
+    """
+    Converts a list of fields to a float array, NaN where a field is not a
+    number.
+    """
+    try:
+        return np.array(fields, dtype=np.float64)
+    except ValueError:
+        def number(text):
+            try:
+                return float(text)
+            except ValueError:
+                return np.nan
+        return np.fromiter(map(number, fields), np.float64, len(fields))
+
+
+class Batch:
+    """
+    The rows of one block of CSV input, with their columns converted to
+    arrays on first use.
+    When every line has one field per column, which is the common case, the
+    block is split into fields with a single split and column i is every
+    num_columns-th field from i on. Otherwise the lines are split one by one
+    and those with fewer than `width` fields are dropped as errors.
+    """
+
+    def __init__(self, block, header_line, num_columns, width, delimiter=','):
+        if '\r' in block:
+            block = block.replace('\r', '')
+        if block.startswith(header_line + '\n'):
+            block = block[len(header_line) + 1:]
+        block = block[:-1] if block.endswith('\n') else block
+        lines = block.split('\n') if block else []
+        self.num_columns = num_columns
+        self.errors = 0
+        self._fields = None
+        self._rows = None
+        self._texts = {}
+        self._numbers = {}
+
+        if header_line not in block and set(map(str.count, lines, [delimiter] * len(lines))) <= {num_columns - 1}:
+            self._fields = block.replace('\n', delimiter).split(delimiter) if lines else []
+        else:
+            lines = [line.strip() for line in lines]
+            lines = [line for line in lines if line and line != header_line]
+            rows = [line.split(delimiter) for line in lines]
+            if rows and min(map(len, rows)) < width:
+                kept = [i for i, row in enumerate(rows) if len(row) >= width]
+                self.errors = len(rows) - len(kept)
+                lines = [lines[i] for i in kept]
+                rows = [rows[i] for i in kept]
+            self._rows = rows
+        self.lines = lines
+        self.size = len(lines)
+
+    def column(self, i):
+        """
+        Returns the fields of column i as a list.
+        """
+        if self._fields is not None:
+            return self._fields[i::self.num_columns]
+        return [row[i] for row in self._rows]
+
+    def texts(self, i):
+        if i not in self._texts:
+            self._texts[i] = np.array(self.column(i), dtype=str)
+        return self._texts[i]
+
+    def numbers(self, i):
+        if i not in self._numbers:
+            self._numbers[i] = to_numbers(self.column(i))
+        return self._numbers[i]
+
+
+def compare(batch, op, i, literal):
+    """
+    Compares column i with an unquoted number: fields that are numbers
+    numerically, the others as text, and empty fields match nothing.
+    """
+    numbers = batch.numbers(i)
+    result = op(numbers, literal.number)
+    others = np.flatnonzero(np.isnan(numbers))
+    if len(others):
+        texts = batch.texts(i)[others]
+        result[others] = op(texts, literal.text) & (texts != '')
+    return result
+
+
+def condition_mask(condition, headers, types, batch):
+    """
+    Evaluates a WHERE clause (see predicate.py) over a batch, as the
+    predicates compiled with the column types of the schema registry do.
+    Returns:
+        numpy.ndarray: True for the rows that satisfy it.
+    """
+    if isinstance(condition, And):
+        result = np.ones(batch.size, dtype=bool)
+        for child in condition.children:
+            result &= condition_mask(child, headers, types, batch)
+        return result
+    if isinstance(condition, Or):
+        result = np.zeros(batch.size, dtype=bool)
+        for child in condition.children:
+            result |= condition_mask(child, headers, types, batch)
+        return result
+    if isinstance(condition, Not):
+        return ~condition_mask(condition.child, headers, types, batch)
+
+    i = column_index(headers, condition.column)
+    if isinstance(condition, Comparison):
+        op = OPERATORS[condition.op]
+        if isinstance(condition.literal, ColumnRef):
+            j = column_index(headers, condition.literal.column)
+            left, right = batch.numbers(i), batch.numbers(j)
+            texts = np.isnan(left) | np.isnan(right)
+            result = np.where(texts, op(batch.texts(i), batch.texts(j)), op(left, right))
+            return result & (batch.texts(i) != '') & (batch.texts(j) != '')
+        if condition.literal.number is not None:
+            return compare(batch, op, i, condition.literal)
+        return op(batch.texts(i), condition.literal.text)
+    if isinstance(condition, InList):
+        result = np.isin(batch.texts(i), [literal.text for literal in condition.literals])
+        numbers = [literal.number for literal in condition.literals if literal.number is not None]
+        if numbers:
+            result |= np.isin(batch.numbers(i), numbers)
+        return result
+    if isinstance(condition, Between):
+        if condition.low.number is not None and condition.high.number is not None:
+            numbers = batch.numbers(i)
+            return (condition.low.number <= numbers) & (numbers <= condition.high.number)
+        texts = batch.texts(i)
+        return (condition.low.text <= texts) & (texts <= condition.high.text)
+    if isinstance(condition, Like):
+        pattern = condition.pattern
+        body = pattern.rstrip('%')
+        if body and '%' not in body and '_' not in body:
+            if body == pattern:
+                return batch.texts(i) == body
+            return np.char.startswith(batch.texts(i), body)
+        regex = ''.join('.*' if c == '%' else '.' if c == '_' else re.escape(c) for c in pattern)
+        match = re.compile(regex, re.DOTALL).fullmatch
+        return np.fromiter((match(text) is not None for text in batch.texts(i).tolist()), bool, batch.size)
+    raise ValueError(f"Unsupported condition: {type(condition).__name__}")
+
+
+def read_batches(where_clause, schema, width, scan_stats, counters):
+    """
+    Yields (batch, mask) for every block of the input, the mask selecting the
+    rows that pass the WHERE clause.
+    Args:
+        schema (dict): The table's entry in the schema registry (see schema.py).
+    """
+    headers = schema['columns']
+    blocks = read_blocks(where_clause, scan_stats, counters)
+    while True:
+        start = time.perf_counter()
+        block = next(blocks, None)
+        if block is None:
+            return
+        batch = Batch(block, schema['header'], len(headers), width, schema['delimiter'])
+        counters.parse_seconds += time.perf_counter() - start
+        counters.rows_in += batch.size + batch.errors
+        counters.parse_errors += batch.errors
+        if not batch.size:
+            continue
+
+        start = time.perf_counter()
+        if where_clause is not None:
+            mask = condition_mask(where_clause, headers, schema['types'], batch)
+        else:
+            mask = np.ones(batch.size, dtype=bool)
+        counters.predicate_seconds += time.perf_counter() - start
+        counters.rows_filtered += batch.size - int(mask.sum())
+        yield batch, mask
+
+
+def condition_width(where_clause, headers):
+    """
+    Returns the number of fields a row needs for the WHERE clause.
+    """
+    if where_clause is None:
+        return 0
+    return max(column_index(headers, column) for column in where_clause.columns()) + 1
+
+
+def select(where_clause, schema, column_indices, scan_stats, counters):
+    """
+    Batch counterpart of the filter and projection mappers: yields, per
+    batch, the output lines of the rows that pass the WHERE clause, projected
+    to `column_indices` (None keeps whole lines).
+    """
+    width = max([condition_width(where_clause, schema['columns'])] + [i + 1 for i in column_indices or ()])
+    for batch, mask in read_batches(where_clause, schema, width, scan_stats, counters):
+        selected = np.flatnonzero(mask).tolist()
+        if column_indices is None:
+            lines = batch.lines
+            yield [lines[k] for k in selected]
+        else:
+            columns = [batch.column(i) for i in column_indices]
+            yield [','.join([column[k] for column in columns]) for k in selected]
+
+
+def group_states(func, inverse, num_groups, values, order):
+    """
+    Computes the partial state of one aggregation for every group of a batch.
+    Args:
+        inverse (numpy.ndarray): The group number of every row.
+        values (numpy.ndarray): The aggregated column's floats, None for COUNT.
+        order (tuple): (rows sorted by group, start of each group in them),
+            used by MIN and MAX.
+    Returns:
+        list: One accumulator per group.
+    """
+    if func == 'COUNT':
+        return [CountAgg(count) for count in np.bincount(inverse, minlength=num_groups).tolist()]
+    if func == 'SUM':
+        return [SumAgg(total) for total in np.bincount(inverse, values, num_groups).tolist()]
+    if func == 'AVG':
+        totals = np.bincount(inverse, values, num_groups).tolist()
+        counts = np.bincount(inverse, minlength=num_groups).tolist()
+        return [AvgAgg(total, count) for total, count in zip(totals, counts)]
+    rows, starts = order
+    if func == 'MIN':
+        return [MinAgg(value) for value in np.minimum.reduceat(values[rows], starts).tolist()]
+    return [MaxAgg(value) for value in np.maximum.reduceat(values[rows], starts).tolist()]
+
+
+def aggregate(where_clause, schema, key_indices, aggregation_columns, aggregations, scan_stats, counters):
+    """
+    Batch counterpart of the groupby mapper's hash aggregation: yields, per
+    batch, {group key: partial states} for the rows that pass the WHERE
+    clause. Rows whose aggregated fields are not numbers are skipped, as on
+    the row path.
+    Args:
+        key_indices (list): The columns of the group key.
+        aggregation_columns (list): (column index, converter) per aggregation,
+            as built by groupby.mapper.
+    """
+    width = max([condition_width(where_clause, schema['columns'])] +
+                [i + 1 for i in key_indices] + [i + 1 for i, _ in aggregation_columns])
+    numeric = sorted({i for (func, _, _), (i, _) in zip(aggregations, aggregation_columns) if func not in NON_NUMERIC})
+    for batch, mask in read_batches(where_clause, schema, width, scan_stats, counters):
+        for i in numeric:
+            valid = ~np.isnan(batch.numbers(i))
+            counters.parse_errors += int((mask & ~valid).sum())
+            mask &= valid
+        selected = np.flatnonzero(mask)
+        if not len(selected):
+            continue
+
+        if key_indices:
+            keys = batch.texts(key_indices[0])[selected]
+            for i in key_indices[1:]:
+                keys = np.char.add(np.char.add(keys, ','), batch.texts(i)[selected])
+        else:
+            keys = np.full(len(selected), '', dtype=str)
+        group_keys, inverse = np.unique(keys, return_inverse=True)
+        inverse = inverse.ravel()
+
+        order = None
+        if any(func in ('MIN', 'MAX') for func, _, _ in aggregations):
+            rows = np.argsort(inverse, kind='stable')
+            order = rows, np.searchsorted(inverse[rows], np.arange(len(group_keys)))
+
+        columns = []
+        for (func, _, _), (i, _) in zip(aggregations, aggregation_columns):
+            values = batch.numbers(i)[selected] if func not in NON_NUMERIC else None
+            columns.append(group_states(func, inverse, len(group_keys), values, order))
+        yield dict(zip(group_keys.tolist(), map(list, zip(*columns))))
@@ -0,0 +1,240 @@
+"""
+Zone maps: per-block column statistics for CSV files.
+
+At import time a CSV file is cut into line-aligned blocks of about
+ZONE_BLOCK_BYTES, and for every block and column we record the numeric and text
+min/max, the null (empty field) count and an estimate of the distinct values.
+The statistics are written to a sidecar file named _<file>.zonemap.json next to
+the data; the leading underscore keeps Hadoop from reading it as job input.
+
+Mappers pass their WHERE clause to scan_lines(), which leaves out every block
+whose statistics prove that no row can match (see Condition.can_match).
+"""
+import glob
+import json
+import os
+import sys
+from aggregators import CountDistinctAgg
+
+ZONE_BLOCK_BYTES = 4 * 1024 * 1024
+
+
+def zone_map_name(data_file):
+    return f"_{os.path.basename(data_file)}.zonemap.json"
+
+
+def zone_map_path(data_file):
+    """
+    Returns the sidecar path of a data file's zone map.
+    """
+    return os.path.join(os.path.dirname(data_file), zone_map_name(data_file))
+
+
+class ColumnStats:
+    """
+    Running statistics of one column within one block.
+    """
+    __slots__ = ('numeric', 'min', 'max', 'min_text', 'max_text', 'null_count', 'distinct')
+
+    def __init__(self):
+        self.numeric = True
+        self.min = None
+        self.max = None
+        self.min_text = None
+        self.max_text = None
+        self.null_count = 0
+        self.distinct = CountDistinctAgg()
+
+    def update(self, value):
+        if self.min_text is None or value < self.min_text:
+            self.min_text = value
+        if self.max_text is None or value > self.max_text:
+            self.max_text = value
+        if value == '':
+            self.null_count += 1
+            return
+        self.distinct.update(value)
+        if self.numeric:
+            try:
+                number = float(value)
+            except ValueError:
+                self.numeric = False
+                return
+            if self.min is None or number < self.min:
+                self.min = number
+            if self.max is None or number > self.max:
+                self.max = number
+
+    def to_dict(self):
+        return {
+            'numeric': self.numeric,
+            'min': self.min if self.numeric else None,
+            'max': self.max if self.numeric else None,
+            'min_text': self.min_text,
+            'max_text': self.max_text,
+            'null_count': self.null_count,
+            'distinct': self.distinct.result(),
+        }
+
+
+def build_zone_map(data_file, block_bytes=ZONE_BLOCK_BYTES, delimiter=','):
+    """
+    Computes the zone map of a CSV file with a header line.
+    Args:
+        data_file (str): Path to the CSV file.
+        block_bytes (int): Approximate size of each block in bytes.
+        delimiter (str): Field delimiter of the CSV file.
+    Returns:
+        dict: {'columns': [...], 'blocks': [{'offset', 'length', 'rows', 'stats'}]}
+    """
+    blocks = []
+    with open(data_file, 'rb') as f:
+        header = f.readline()
+        headers = header.decode('utf-8').strip().split(delimiter)
+        offset = len(header)
+        block_start = offset
+        rows = 0
+        stats = [ColumnStats() for _ in headers]
+
+        def close_block():
+            blocks.append({
+                'offset': block_start,
+                'length': offset - block_start,
+                'rows': rows,
+                'stats': {name: column.to_dict() for name, column in zip(headers, stats)},
+            })
+
+        for raw in f:
+            offset += len(raw)
+            line = raw.decode('utf-8').strip()
+            if line:
+                rows += 1
+                for column, value in zip(stats, line.split(delimiter)):
+                    column.update(value)
+            if offset - block_start >= block_bytes:
+                close_block()
+                block_start = offset
+                rows = 0
+                stats = [ColumnStats() for _ in headers]
+        if offset > block_start:
+            close_block()
+
+    return {'columns': headers, 'blocks': blocks}
+
+
+def write_zone_maps(local_path, block_bytes=ZONE_BLOCK_BYTES):
+    """
+    Writes the zone map sidecar of a CSV file, or of every CSV file in a directory.
+    Returns:
+        list: The sidecar paths written.
+    """
+    if os.path.isdir(local_path):
+        data_files = sorted(glob.glob(os.path.join(local_path, '*.csv')))
+    elif local_path.endswith('.csv'):
+        data_files = [local_path]
+    else:
+        data_files = []
+    written = []
+    for data_file in data_files:
+        path = zone_map_path(data_file)
+        with open(path, 'w') as f:
+            json.dump(build_zone_map(data_file, block_bytes), f)
+        written.append(path)
+    return written
+
+
+def input_split():
+    """
+    Returns the (file, start, length) of the current Hadoop input split, taken
+    from the environment Hadoop streaming sets for each map task.
+    """
+    input_file = os.environ.get('mapreduce_map_input_file') or os.environ.get('map_input_file')
+    start = int(os.environ.get('mapreduce_map_input_start', 0))
+    length = os.environ.get('mapreduce_map_input_length')
+    return input_file, start, int(length) if length is not None else None
+
+
+def load_zone_map():
+    """
+    Loads the zone map of the current input file, looking for the sidecar in the
+    task's working directory (where -files puts it) and next to the input file.
+    Returns None when there is no input file or no zone map.
+    """
+    input_file, _, _ = input_split()
+    if not input_file:
+        return None
+    for path in (zone_map_name(input_file), zone_map_path(input_file)):
+        if os.path.exists(path):
+            with open(path) as f:
+                return json.load(f)
+    return None
+
+
+class ScanStats:
+    __slots__ = ('blocks_skipped', 'rows_skipped', 'bytes_skipped')
+
+    def __init__(self):
+        self.blocks_skipped = 0
+        self.rows_skipped = 0
+        self.bytes_skipped = 0
+
+    def report(self):
+        print(f"Zone maps skipped {self.blocks_skipped} blocks, {self.rows_skipped} rows, "
+              f"{self.bytes_skipped} bytes", file=sys.stderr)
+
+
+def scan_lines(condition, zone_map=None, split=None, stream=None, scan_stats=None):
+    """
+    Yields the lines of the input, without the blocks that cannot satisfy the
+    condition. Without a condition or zone map every line is yielded.
+    Args:
+        condition (Condition): The WHERE clause, or None.
+        zone_map (dict): The input file's zone map, or None.
+        split (tuple): (file, start, length) of the input; defaults to input_split().
+        stream: Binary input stream; defaults to stdin.
+        scan_stats (ScanStats): Receives the counts of skipped blocks, rows and bytes.
+    """
+    if condition is None or zone_map is None:
+        for line in (stream or sys.stdin.buffer):
+            yield line.decode('utf-8')
+        return
+
+    stream = stream or sys.stdin.buffer
+    scan_stats = scan_stats if scan_stats is not None else ScanStats()
+    _, start, length = split or input_split()
+    blocks = zone_map['blocks']
+    skip = [not condition.can_match(block['stats']) for block in blocks]
+
+    if start:
+        # Hadoop starts a split at the first line after `start`, whose exact
+        # offset the mapper cannot know, so decide for the split as a whole.
+        end = start + length if length is not None else float('inf')
+        overlapping = [i for i, block in enumerate(blocks)
+                       if block['offset'] <= end and block['offset'] + block['length'] > start]
+        if overlapping and all(skip[i] for i in overlapping):
+            scan_stats.blocks_skipped += len(overlapping)
+            for raw in stream:
+                scan_stats.rows_skipped += 1
+                scan_stats.bytes_skipped += len(raw)
+            return
+        for raw in stream:
+            yield raw.decode('utf-8')
+        return
+
+    # The split starts at the beginning of the file, so offsets are exact
+    offset = 0
+    index = 0
+    skipping_block = None
+    for raw in stream:
+        position = offset
+        offset += len(raw)
+        while index < len(blocks) and position >= blocks[index]['offset'] + blocks[index]['length']:
+            index += 1
+        if index < len(blocks) and position >= blocks[index]['offset'] and skip[index]:
+            if skipping_block != index:
+                skipping_block = index
+                scan_stats.blocks_skipped += 1
+            scan_stats.rows_skipped += 1
+            scan_stats.bytes_skipped += len(raw)
+            continue
+        yield raw.decode('utf-8')